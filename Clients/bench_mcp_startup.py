@@ -0,0 +1,88 @@
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from client_mcp_server import call_daemon, daemon_alive
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "client_mcp_server.py")
+
+async def _list_tools_over_stdio(flags, env) -> float:
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+    params = StdioServerParameters(command=sys.executable, args=[SERVER, *flags], env=env)
+    start = time.perf_counter()
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            result = await session.list_tools()
+            elapsed = time.perf_counter() - start
+    if not result.tools:
+        raise RuntimeError("MCP server answered ListTools with no tools")
+    return elapsed
+
+def time_to_list_tools(*flags, env=None) -> float:
+    """Seconds from spawning the MCP server on stdio until its first ListTools response,
+    including the initialize handshake, as an MCP host sees it."""
+    return asyncio.run(_list_tools_over_stdio(flags, env))
+
+def time_to_list_flag(*flags, env=None) -> float:
+    """Seconds from spawning the server with --list until it prints its tool names (no MCP session)."""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, SERVER, "--list", *flags], stdout=subprocess.PIPE, env=env)
+    proc.stdout.readline()
+    elapsed = time.perf_counter() - start
+    proc.wait()
+    return elapsed
+
+def bench_startup(repeats: int = 5, tool: str = None, kwargs: dict = None):
+    """Compare time to the first ListTools response of lazy vs eager imports, and of a warm tool daemon.
+
+    With tool, also time its first call in a cold process against repeated calls through the daemon.
+    """
+    env = {**os.environ, "MCP_DAEMON_SOCKET": f"/tmp/mcp_bench_{os.getpid()}.sock"}
+    socket_path = env["MCP_DAEMON_SOCKET"]
+    results = {
+        "lazy_list_tools_s": statistics.median(time_to_list_tools(env=env) for _ in range(repeats)),
+        "eager_list_tools_s": statistics.median(time_to_list_tools("--eager", env=env) for _ in range(repeats)),
+        # Secondary: the --list shortcut, which skips the MCP session entirely
+        "lazy_list_flag_s": statistics.median(time_to_list_flag(env=env) for _ in range(repeats)),
+        "eager_list_flag_s": statistics.median(time_to_list_flag("--eager", env=env) for _ in range(repeats))
+    }
+
+    daemon = subprocess.Popen([sys.executable, SERVER, "--daemon"], env=env, stdout=subprocess.DEVNULL)
+    try:
+        start = time.perf_counter()
+        while not daemon_alive(socket_path):
+            time.sleep(0.01)
+        results["daemon_start_s"] = time.perf_counter() - start
+        pings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call_daemon(socket_path, {"tool": "__ping__"})
+            pings.append(time.perf_counter() - start)
+        results["daemon_attach_s"] = statistics.median(pings)
+
+        if tool:
+            calls = []
+            for _ in range(repeats + 1):
+                start = time.perf_counter()
+                call_daemon(socket_path, {"tool": tool, "kwargs": kwargs or {}})
+                calls.append(time.perf_counter() - start)
+            results[f"{tool}_cold_s"] = calls[0]  # first call pays the imports and model load
+            results[f"{tool}_warm_s"] = statistics.median(calls[1:])
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark MCP client server startup")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--tool", help="also time calls of this tool through the daemon")
+    parser.add_argument("--kwargs", default="{}", help="JSON arguments for --tool")
+    args = parser.parse_args()
+    print(json.dumps(bench_startup(args.repeats, args.tool, json.loads(args.kwargs)), indent=2))
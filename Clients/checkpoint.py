@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import numpy as np
+
+# Crash-safe checkpoints shared by the host (global adapter + round + strategy state) and the
+# clients (adapter + optimizer + data cursor). A checkpoint is a directory ckpt-<step> holding
+# arrays.npz, state.json, an optional optimizer.pt and a MANIFEST.json with the size and sha256
+# of each file. It is written under a temporary name and renamed into place, so a crash leaves
+# either the previous checkpoint or a stray *.tmp directory, never a half-written checkpoint.
+
+MANIFEST = "MANIFEST.json"
+
+def _snapshot(obj):
+    """Copy tensors/arrays out of live training state, to CPU, so writing can happen later."""
+    if isinstance(obj, dict):
+        return {key: _snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(value) for value in obj)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if hasattr(obj, "detach"):
+        return obj.detach().to("cpu", copy=True)
+    return obj
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _fsync(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_checkpoint(directory: str, step: int, arrays=None, state: dict = None, optimizer_state=None,
+                     keep: int = 2) -> str:
+    """Write checkpoint `step` atomically and prune all but the newest `keep`; returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"ckpt-{step:08d}")
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    files = []
+    if arrays is not None:
+        np.savez(os.path.join(tmp, "arrays.npz"), *arrays)
+        files.append("arrays.npz")
+    with open(os.path.join(tmp, "state.json"), 'w') as f:
+        json.dump({**(state or {}), "step": step}, f)
+    files.append("state.json")
+    if optimizer_state is not None:
+        import torch
+        torch.save(optimizer_state, os.path.join(tmp, "optimizer.pt"))
+        files.append("optimizer.pt")
+    manifest = {}
+    for name in files:
+        file_path = os.path.join(tmp, name)
+        _fsync(file_path)
+        manifest[name] = {"size": os.path.getsize(file_path), "sha256": _sha256(file_path)}
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    _fsync(directory)
+    for old in list_checkpoints(directory)[:-keep] if keep else []:
+        shutil.rmtree(old, ignore_errors=True)
+    return path
+
+def list_checkpoints(directory: str):
+    """Checkpoint directories in step order (oldest first), complete or not."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith("ckpt-") and not name.endswith(".tmp")]
+
+def is_valid(path: str) -> bool:
+    """True if every file listed in the manifest exists with the recorded size and hash."""
+    try:
+        with open(os.path.join(path, MANIFEST), 'r') as f:
+            manifest = json.load(f)
+        return all(os.path.getsize(os.path.join(path, name)) == entry["size"]
+                   and _sha256(os.path.join(path, name)) == entry["sha256"]
+                   for name, entry in manifest.items())
+    except (OSError, ValueError, KeyError):
+        return False
+
+def latest_checkpoint(directory: str) -> str:
+    """Newest checkpoint that passes validation, or None."""
+    for path in reversed(list_checkpoints(directory)):
+        if is_valid(path):
+            return path
+        print(f"Skipping corrupt checkpoint {path}")
+    return None
+
+def load_checkpoint(path: str, load_optimizer: bool = True):
+    """Return (arrays or None, state, optimizer state or None) from a checkpoint directory."""
+    arrays = None
+    if os.path.exists(os.path.join(path, "arrays.npz")):
+        with np.load(os.path.join(path, "arrays.npz")) as npz:
+            arrays = [npz[f"arr_{i}"] for i in range(len(npz.files))]
+    with open(os.path.join(path, "state.json"), 'r') as f:
+        state = json.load(f)
+    optimizer_state = None
+    if load_optimizer and os.path.exists(os.path.join(path, "optimizer.pt")):
+        import torch
+        optimizer_state = torch.load(os.path.join(path, "optimizer.pt"), map_location="cpu")
+    return arrays, state, optimizer_state
+
+class CheckpointWriter:
+    """Writes checkpoints on a background thread so training and aggregation never wait on disk.
+
+    save() snapshots its arguments immediately and returns; if a write is still in progress,
+    only the most recent pending snapshot is kept (older ones would be superseded anyway).
+    """
+
+    def __init__(self, directory: str, keep: int = 2):
+        self.directory = directory
+        self.keep = keep
+        self.error = None
+        self._pending = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def save(self, step: int, arrays=None, state: dict = None, optimizer_state=None):
+        job = (step, _snapshot(arrays), _snapshot(state or {}), _snapshot(optimizer_state))
+        while True:
+            try:
+                self._pending.put_nowait(job)
+                return
+            except queue.Full:
+                try:
+                    self._pending.get_nowait()
+                    self._pending.task_done()
+                except queue.Empty:
+                    pass
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        self._pending.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """Flush pending checkpoints and stop the writer thread; re-raises the last write failure,
+        so an unwritable checkpoint directory does not go unnoticed until a resume starts over."""
+        self._pending.join()
+        self._pending.put(None)
+        self._thread.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            job = self._pending.get()
+            if job is None:
+                self._pending.task_done()
+                return
+            step, arrays, state, optimizer_state = job
+            try:
+                write_checkpoint(self.directory, step, arrays, state, optimizer_state, self.keep)
+            except Exception as e:
+                print(f"Checkpoint {step} in {self.directory} failed: {e}")
+                self.error = e
+            finally:
+                self._pending.task_done()
@@ -1,49 +1,221 @@
-from mcp import Server, Tool
-from fetch_data import fetch_data
-from clean_data import clean_data
-from train_llava import train_llava
-from download_model import download_model
-from generate_profile import generate_profile
+import importlib
+import json
 import os
+import socket
+import socketserver
+from tracing import traced
 
-def create_mcp_server(client_id: str):
+# Tool modules pull in torch, transformers, peft and torchvision; they are imported on the
+# first call of a tool, so the server can list its tools without paying for them
+TOOL_MODULES = ["download_model", "fetch_data", "clean_data", "ingest_data", "token_shards", "train_llava",
+                "generate_profile"]
+
+def _lazy(module: str, attr: str):
+    """Return a function that imports module.attr on first call."""
+    def call(*args, **kwargs):
+        return getattr(importlib.import_module(module), attr)(*args, **kwargs)
+    call.__name__ = attr
+    return call
+
+download_model = _lazy("download_model", "download_model")
+fetch_data = _lazy("fetch_data", "fetch_data")
+clean_data_parallel = _lazy("clean_data", "clean_data_parallel")
+ingest_data = _lazy("ingest_data", "ingest_data")
+ingest_incremental = _lazy("ingest_data", "ingest_incremental")
+build_token_shards = _lazy("token_shards", "build_token_shards")
+train_llava = _lazy("train_llava", "train_llava")
+generate_profile = _lazy("generate_profile", "generate_profile")
+
+def client_tools(client_id: str, daemon_socket: str = None, output_dir: str = None):
+    """Client tools in pipeline order, as dicts with name, description and function.
+
+    "inputs" and "outputs" list the files each tool reads and writes; the in-process
+    executor uses them to skip stages whose inputs are unchanged. With daemon_socket,
+    each function forwards the call to a warm tool daemon instead of running locally.
+    Adapters, training stats and profiles go to output_dir (OUTPUT_DIR, /output by default).
+    """
+    output_dir = output_dir or default_output_dir()
+    adapter_file = f"{output_dir}/lora_weights_{client_id}/adapter_model.safetensors"
+    # Last training throughput, written by train_llava next to the adapter, for the dedup
+    # report's estimate of training time saved
+    stats_path = f"{output_dir}/train_stats_{client_id}.json"
+    cleaned_path = cleaned_data_path()
+    shard_manifest = f"{os.path.splitext(cleaned_path)[0]}_tokens/manifest.json"
+    tools = [
+        {
+            "name": "download_model",
+            "description": "Download LLaVA model for training",
+            "function": download_model,
+            "inputs": [],
+            "outputs": ["/model/config.json"]
+        },
+        {
+            "name": "fetch_data",
+            "description": "Fetch dummy data for training",
+            "function": fetch_data,
+            "inputs": ["/data/raw_facebook_data.json"],
+            "outputs": ["/data/dummy_data.json"]
+        },
+        {
+            "name": "clean_data",
+            "description": "Clean the fetched data",
+            "function": lambda input_path: clean_data_parallel(
+                input_path, "/data/cleaned_data.json", int(os.environ.get("CLEAN_WORKERS", 0)) or None,
+                dedup_path=dedup_index_path(), stats_path=stats_path
+            )["output_path"],
+            "inputs": ["/data/dummy_data.json"],
+            "outputs": ["/data/cleaned_data.json"]
+        },
+        {
+            "name": "ingest_data",
+            "description": "Fetch and clean raw data in one streaming pass",
+            "function": lambda input_path="/data/raw_facebook_data.json": ingest_data(
+                input_path, "/data/cleaned_data.json", dedup_path=dedup_index_path(), stats_path=stats_path
+            ),
+            "inputs": ["/data/raw_facebook_data.json"],
+            "outputs": ["/data/cleaned_data.json"]
+        },
+        {
+            "name": "ingest_incremental",
+            "description": "Fetch and clean only posts added since the last run",
+            "function": lambda input_path="/data/raw_facebook_data.json": ingest_incremental(
+                input_path, "/data/cleaned_data.jsonl", dedup_path=dedup_index_path(), stats_path=stats_path
+            ),
+            "inputs": ["/data/raw_facebook_data.json"],
+            "outputs": ["/data/cleaned_data.jsonl"]
+        },
+        {
+            "name": "build_token_shards",
+            "description": "Tokenize the cleaned data once into memory-mapped shards",
+            "function": lambda data_path=cleaned_path: build_token_shards(data_path, "/model"),
+            "inputs": [cleaned_path, "/model/tokenizer.json", "/model/tokenizer_config.json"],
+            "outputs": [shard_manifest]
+        },
+        {
+            "name": "train_llava",
+            "description": "Fine-tune LLaVA model with LoRA",
+            "function": lambda client_id=client_id, max_samples=None: train_llava(
+                cleaned_path, output_dir, client_id,
+                max_samples=max_samples or int(os.environ.get("TRAIN_MAX_SAMPLES", 0)) or None
+            ),
+            "inputs": [cleaned_path, shard_manifest, adapter_file],
+            "outputs": [adapter_file]
+        },
+        {
+            "name": "generate_profile",
+            "description": "Generate platform-specific profile",
+            "function": lambda client_id=client_id: generate_profile(cleaned_path, "/model", output_dir, client_id),
+            "inputs": [cleaned_path, shard_manifest, adapter_file],
+            "outputs": [f"{output_dir}/profile_{client_id}.npy"]
+        }
+    ]
+    for tool in tools:
+        if daemon_socket:
+            tool["function"] = _remote(daemon_socket, tool["name"])
+        else:
+            # Spans are recorded where the tool actually runs (here, or in the daemon)
+            tool["function"] = traced(f"tool.{tool['name']}", client_id=client_id)(tool["function"])
+    return tools
+
+def default_output_dir() -> str:
+    return os.environ.get("OUTPUT_DIR", "/output")
+
+def incremental_ingest() -> bool:
+    """INGEST_MODE=incremental: ingest_incremental replaces the fetch_data + clean_data stages."""
+    return os.environ.get("INGEST_MODE", "full") == "incremental"
+
+def cleaned_data_path() -> str:
+    """Cleaned dataset the training stages read (the appended JSONL in incremental mode)."""
+    return "/data/cleaned_data.jsonl" if incremental_ingest() else "/data/cleaned_data.json"
+
+def dedup_index_path():
+    """Persistent duplicate index used by the cleaning tools with DEDUP=1, else None (off by default)."""
+    if os.environ.get("DEDUP", "0") != "1":
+        return None
+    return os.environ.get("DEDUP_INDEX", "/data/dedup_index.sqlite")
+
+def daemon_socket_path(client_id: str) -> str:
+    return os.environ.get("MCP_DAEMON_SOCKET", f"/tmp/mcp_tools_{client_id}.sock")
+
+def _remote(socket_path: str, name: str):
+    """Return a function that runs tool `name` in the daemon listening on socket_path."""
+    def call(**kwargs):
+        return call_daemon(socket_path, {"tool": name, "kwargs": kwargs})
+    call.__name__ = name
+    return call
+
+def call_daemon(socket_path: str, request: dict):
+    """Send one JSON request to the tool daemon and return its result."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        response = json.loads(sock.makefile('rb').readline())
+    if "error" in response:
+        raise RuntimeError(f"Tool daemon failed on {request.get('tool')}: {response['error']}")
+    return response["result"]
+
+def daemon_alive(socket_path: str) -> bool:
+    try:
+        return call_daemon(socket_path, {"tool": "__ping__"}) == "pong"
+    except (OSError, ValueError):
+        return False
+
+def serve_daemon(client_id: str, socket_path: str = None):
+    """Serve the client tools over a Unix socket from one long-lived, warm process.
+
+    Requests are newline-delimited JSON {"tool": name, "kwargs": {...}} and are handled one
+    at a time, so tools that share the model registry never run concurrently.
+    """
+    socket_path = socket_path or daemon_socket_path(client_id)
+    tools = {tool["name"]: tool["function"] for tool in client_tools(client_id)}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+            try:
+                if request["tool"] == "__ping__":
+                    response = {"result": "pong"}
+                else:
+                    response = {"result": tools[request["tool"]](**request.get("kwargs", {}))}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # stale socket from a previous daemon
+    with socketserver.UnixStreamServer(socket_path, Handler) as server:
+        print(f"Tool daemon for {client_id} listening on {socket_path}")
+        server.serve_forever()
+
+def create_mcp_server(client_id: str, daemon_socket: str = None):
     """Create an MCP server exposing client tools."""
+    from mcp import Server, Tool
     server = Server()
 
     # Register tools
-    server.register_tool(Tool(
-        name="download_model",
-        description="Download LLaVA model for training",
-        function=download_model
-    ))
-
-    server.register_tool(Tool(
-        name="fetch_data",
-        description="Fetch dummy data for training",
-        function=fetch_data
-    ))
-
-    server.register_tool(Tool(
-        name="clean_data",
-        description="Clean the fetched data",
-        function=lambda input_path: clean_data(input_path, "/data/cleaned_data.json")
-    ))
-
-    server.register_tool(Tool(
-        name="train_llava",
-        description="Fine-tune LLaVA model with LoRA",
-        function=lambda client_id=client_id: train_llava("/data/cleaned_data.json", "/output", client_id)
-    ))
-
-    server.register_tool(Tool(
-        name="generate_profile",
-        description="Generate platform-specific profile",
-        function=lambda client_id=client_id: generate_profile("/data/cleaned_data.json", "/model", "/output", client_id)
-    ))
+    for tool in client_tools(client_id, daemon_socket):
+        server.register_tool(Tool(
+            name=tool["name"],
+            description=tool["description"],
+            function=tool["function"]
+        ))
 
     return server
 
 if __name__ == "__main__":
+    import sys
     client_id = os.environ.get("CLIENT_ID", "client1")
-    server = create_mcp_server(client_id)
-    server.run()
\ No newline at end of file
+    if "--eager" in sys.argv:
+        # Reproduces the former module-level imports, for the startup benchmark
+        for module in TOOL_MODULES:
+            importlib.import_module(module)
+    if "--daemon" in sys.argv:
+        serve_daemon(client_id)
+    elif "--list" in sys.argv:
+        print(json.dumps([tool["name"] for tool in client_tools(client_id)]), flush=True)
+    else:
+        # With MCP_DAEMON=1, sessions forward tool calls to an already warm daemon if one is running
+        socket_path = daemon_socket_path(client_id)
+        use_daemon = os.environ.get("MCP_DAEMON") == "1" and daemon_alive(socket_path)
+        server = create_mcp_server(client_id, socket_path if use_daemon else None)
+        server.run()
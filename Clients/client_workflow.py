@@ -2,14 +2,15 @@ from crewai import Agent, Task, Crew, Process
 from crewai_tools import MCPServerAdapter
 from mcp import StdioServerParameters
 import os
+from client_mcp_server import incremental_ingest
 
-def run_client_workflow(client_id: str):
+def run_client_workflow(client_id: str, output_dir: str = "/output"):
     """Run CrewAI workflow for MCP client tools, including model download."""
-    # Define MCP server parameters
+    # Define MCP server parameters; the server writes adapters and stats to OUTPUT_DIR
     server_params = StdioServerParameters(
         command="python",
         args=["-m", "clients.client_mcp_server"],
-        env={"UV_PYTHON": "3.12", "CLIENT_ID": client_id, **os.environ}
+        env={"UV_PYTHON": "3.12", "CLIENT_ID": client_id, **os.environ, "OUTPUT_DIR": output_dir}
     )
 
     # Initialize MCP server adapter
@@ -49,6 +50,24 @@ def run_client_workflow(client_id: str):
         inputs={"input_path": fetch_task.output}
     )
 
+    # INGEST_MODE=incremental: fetch and clean only posts added since the last run
+    ingest_task = Task(
+        description="Fetch and clean only posts added since the last run",
+        agent=agent,
+        expected_output="Path to cleaned data JSONL file",
+        tool="ingest_incremental",
+        inputs={}
+    )
+    incremental = incremental_ingest()
+
+    shard_task = Task(
+        description="Tokenize the cleaned data once into memory-mapped shards",
+        agent=agent,
+        expected_output="Path to the token shard directory",
+        tool="build_token_shards",
+        inputs={"data_path": (ingest_task if incremental else clean_task).output}
+    )
+
     train_task = Task(
         description="Fine-tune LLaVA model with LoRA",
         agent=agent,
@@ -60,7 +79,8 @@ def run_client_workflow(client_id: str):
     # Create CrewAI workflow
     crew = Crew(
         agents=[agent],
-        tasks=[download_task, fetch_task, clean_task, train_task],
+        tasks=[download_task, ingest_task, shard_task, train_task] if incremental
+        else [download_task, fetch_task, clean_task, shard_task, train_task],
         process=Process.sequential,
         verbose=True
     )
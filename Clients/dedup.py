@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import zlib
+import numpy as np
+
+# Exact, near-duplicate and (optionally) same-image post removal for cleaned samples. Near
+# duplicates are found with MinHash signatures over word shingles and an LSH band index;
+# everything kept is remembered in a SQLite index on the data PVC, so each new batch is
+# deduplicated against all earlier ones.
+
+FLUSH_DOCS = 5000  # new samples buffered in memory before they are written to the index
+WORD_RE = re.compile(r'\w+')
+
+def _digest(text: str, size: int = 16) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=size).digest()
+
+def sample_key(record: dict) -> bytes:
+    if record.get("post_id"):
+        return _digest(f"id:{record['post_id']}")
+    return _digest(f"{record['text']}\x00{record.get('image') or ''}")
+
+def normalize(text: str) -> str:
+    """Lowercased words only: reposts differing in case, punctuation or spacing hash the same."""
+    return " ".join(WORD_RE.findall(text.lower()))
+
+def shingles(text: str, size: int = 3):
+    words = normalize(text).split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def lsh_params(num_perm: int, threshold: float, recall: float = 0.95):
+    """(bands, rows) with the most rows per band (fewest spurious candidates) such that a pair
+    at exactly threshold similarity still shares a bucket with probability >= recall.
+
+    Candidates are then checked against the full signatures, so erring low costs only time.
+    """
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1.0 - (1.0 - threshold ** rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+class DedupIndex:
+    """Persistent exact + MinHash/LSH duplicate index.
+
+    Every sample has an identity key (its post id, or a hash of its text and image). Samples already kept
+    by an earlier run are kept again, so re-cleaning the full history is stable; a new sample is
+    dropped if its normalized text matches a kept sample exactly, if the estimated Jaccard
+    similarity of their shingle sets reaches threshold, or, with use_image, if it shows the same
+    image as a kept sample. Images are identified by content hash when image_cache_dir already
+    holds them (the same picture under another URL), else by URL.
+    Changes become durable on commit(); removed samples are streamed to dedup_removed.jsonl in
+    report_dir (next to the index by default) and summarized by report().
+    """
+
+    def __init__(self, path: str = "/data/dedup_index.sqlite", threshold: float = None, num_perm: int = 128,
+                 shingle_size: int = 3, use_image: bool = None, seed: int = 1, image_cache_dir: str = None,
+                 report_dir: str = None):
+        self.threshold = threshold if threshold is not None else float(os.environ.get("DEDUP_THRESHOLD", 0.85))
+        self.use_image = use_image if use_image is not None else os.environ.get("DEDUP_IMAGE", "0") == "1"
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(num_perm, self.threshold)
+        rng = np.random.RandomState(seed)
+        # Multiply-shift hashing: the top 32 bits of (a * x + b) mod 2^64, with a odd
+        self.a = rng.randint(1, 1 << 62, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 1 << 62, size=num_perm, dtype=np.uint64)
+        # Band buckets: a random linear hash of each band's rows (mod 2^64), distinct per band
+        self.band_mult = rng.randint(1, 1 << 62, size=(self.bands, self.rows), dtype=np.uint64) | np.uint64(1)
+        self.band_salt = rng.randint(0, 1 << 62, size=self.bands, dtype=np.uint64)
+        image_cache_dir = image_cache_dir or os.environ.get("DEDUP_IMAGE_CACHE", "/data/image_cache")
+        self.image_cache = None
+        if self.use_image and os.path.isdir(image_cache_dir):
+            from image_cache import ImageCache
+            self.image_cache = ImageCache(image_cache_dir)
+
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "PRAGMA cache_size = -65536;"
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS docs (key BLOB PRIMARY KEY, exact BLOB, image BLOB, signature BLOB,"
+            " text TEXT);"
+            "CREATE INDEX IF NOT EXISTS docs_exact ON docs (exact);"
+            "CREATE INDEX IF NOT EXISTS docs_image ON docs (image);"
+            "CREATE TABLE IF NOT EXISTS bands (bucket INTEGER, key BLOB, PRIMARY KEY (bucket, key)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS dupes (key BLOB PRIMARY KEY, canonical BLOB, reason TEXT, similarity REAL);"
+            # Keys written by this run, on disk rather than in memory; dropped with the connection
+            "CREATE TEMP TABLE emitted (key BLOB PRIMARY KEY) WITHOUT ROWID;"
+        )
+        # Signatures from different settings are not comparable: start over if they changed
+        params = json.dumps({"num_perm": num_perm, "bands": self.bands, "rows": self.rows,
+                             "shingle_size": shingle_size, "seed": seed, "use_image": self.use_image,
+                             "image_keys": 2})
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'params'").fetchone()
+        if row and row[0] != params:
+            print(f"Dedup settings changed, rebuilding {path}")
+            self.db.executescript("DELETE FROM docs; DELETE FROM bands; DELETE FROM dupes;")
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('params', ?)", (params,))
+        self.db.commit()
+        # Samples kept by this run and not yet flushed to the index
+        self._docs, self._bands, self._dupes, self._emitted = [], [], [], set()
+        self._exact, self._images, self._buckets = {}, {}, {}
+        self.stats = {"input": 0, "kept": 0, "exact_duplicates": 0, "near_duplicates": 0, "image_duplicates": 0}
+        self.report_dir = report_dir or os.path.dirname(path) or "."
+        self._removed = None  # dedup_removed.jsonl being written, opened on the first removal
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text, self.shingle_size)),
+                             dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            values = (hashes[:, None] * self.a + self.b) >> np.uint64(32)
+        return values.min(axis=0).astype(np.uint32)
+
+    def buckets(self, signature: np.ndarray):
+        rows = signature[:self.bands * self.rows].reshape(self.bands, self.rows).astype(np.uint64)
+        with np.errstate(over="ignore"):
+            return ((rows * self.band_mult).sum(axis=1) + self.band_salt).view(np.int64).tolist()
+
+    def image_key(self, url: str):
+        """Identity of the image at url: its content hash if the image cache has it, else the URL."""
+        content_hash = self.image_cache.lookup(url) if self.image_cache else None
+        return _digest(f"sha256:{content_hash}" if content_hash else f"url:{url}")
+
+    def check(self, record: dict):
+        """Return None if record should be kept, else (reason, canonical key, similarity)."""
+        text, image = record["text"], record.get("image")
+        key = sample_key(record)
+        if key in self._emitted:
+            return "exact", key, 1.0
+        exact = _digest(normalize(text))
+        image_key = self.image_key(image) if self.use_image and image else None
+        # One round trip: written by this run, kept before, dropped before, or an exact text or
+        # image match of a kept sample
+        rows = {kind: (canonical, reason, similarity) for kind, canonical, reason, similarity in self.db.execute(
+            "SELECT 'emitted', key, NULL, NULL FROM emitted WHERE key = ?1"
+            " UNION ALL SELECT 'kept', key, NULL, NULL FROM docs WHERE key = ?1"
+            " UNION ALL SELECT 'dropped', canonical, reason, similarity FROM dupes WHERE key = ?1"
+            " UNION ALL SELECT * FROM (SELECT 'exact', key, NULL, NULL FROM docs WHERE exact = ?2 LIMIT 1)"
+            " UNION ALL SELECT * FROM (SELECT 'image', key, NULL, NULL FROM docs WHERE image = ?3 LIMIT 1)",
+            (key, exact, image_key))}
+        if "emitted" in rows:
+            return "exact", key, 1.0
+        if "kept" in rows:
+            return None  # kept by an earlier run
+        if "dropped" in rows:
+            canonical, reason, similarity = rows["dropped"]
+            return reason, canonical, similarity
+        if "exact" in rows or exact in self._exact:
+            canonical = rows["exact"][0] if "exact" in rows else self._exact[exact]
+            return self._drop(key, "exact", canonical, 1.0)
+        if image_key is not None and ("image" in rows or image_key in self._images):
+            canonical = rows["image"][0] if "image" in rows else self._images[image_key]
+            return self._drop(key, "image", canonical, 1.0)
+
+        signature = self.signature(text)
+        buckets = self.buckets(signature)
+        candidates = self.db.execute(
+            f"SELECT DISTINCT d.key, d.signature FROM bands b JOIN docs d ON d.key = b.key "
+            f"WHERE b.bucket IN ({','.join('?' * len(buckets))})", buckets).fetchall()
+        candidates += {entry[0]: entry for bucket in buckets for entry in self._buckets.get(bucket, ())}.values()
+        best = None
+        for candidate_key, candidate_signature in candidates:
+            similarity = float(np.mean(np.frombuffer(candidate_signature, dtype=np.uint32) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate_key, similarity)
+        if best:
+            return self._drop(key, "near", best[0], best[1])
+
+        entry = (key, signature.tobytes())
+        self._docs.append((key, exact, image_key, entry[1], text[:200]))
+        self._exact[exact] = key
+        if image_key is not None:
+            self._images[image_key] = key
+        for bucket in buckets:
+            self._bands.append((bucket, key))
+            self._buckets.setdefault(bucket, []).append(entry)
+        if len(self._docs) >= FLUSH_DOCS:
+            self.flush()
+        return None
+
+    def _drop(self, key: bytes, reason: str, canonical: bytes, similarity: float):
+        self._dupes.append((key, canonical, reason, similarity))
+        return reason, canonical, similarity
+
+    def flush(self):
+        """Write buffered samples to the index (durable on the next commit)."""
+        # Sorted inserts touch each B-tree page once instead of at random
+        self.db.executemany("INSERT INTO docs VALUES (?, ?, ?, ?, ?)", sorted(self._docs))
+        self.db.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?)", sorted(self._bands))
+        self.db.executemany("INSERT OR REPLACE INTO dupes VALUES (?, ?, ?, ?)", self._dupes)
+        self.db.executemany("INSERT OR IGNORE INTO emitted VALUES (?)", ((key,) for key in sorted(self._emitted)))
+        self._docs, self._bands, self._dupes, self._emitted = [], [], [], set()
+        self._exact, self._images, self._buckets = {}, {}, {}
+
+    def filter(self, records):
+        """Yield the records that are not duplicates, recording the ones that are."""
+        for record in records:
+            self.stats["input"] += 1
+            duplicate = self.check(record)
+            if duplicate is None:
+                self._emitted.add(sample_key(record))
+                self.stats["kept"] += 1
+                yield record
+                continue
+            reason, canonical, similarity = duplicate
+            self.stats[f"{reason}_duplicates"] += 1
+            self._removed_file().write(json.dumps({
+                "post_id": record.get("post_id"), "text": record["text"], "image": record.get("image"),
+                "reason": reason, "similarity": round(similarity, 3), "duplicate_of": canonical.hex()
+            }, ensure_ascii=False) + "\n")
+
+    def _removed_file(self):
+        if self._removed is None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            self._removed = open(os.path.join(self.report_dir, "dedup_removed.jsonl.tmp"), 'w', encoding='utf-8')
+        return self._removed
+
+    def commit(self):
+        self.flush()
+        self.db.commit()
+
+    def report(self, samples_per_sec: float = None) -> dict:
+        """Print and save what this run removed; samples_per_sec turns it into training time saved."""
+        removed = self.stats["exact_duplicates"] + self.stats["near_duplicates"] + self.stats["image_duplicates"]
+        summary = {**self.stats, "removed": removed, "threshold": self.threshold,
+                   "estimated_train_seconds_saved": removed / samples_per_sec if samples_per_sec else None}
+        self._removed_file().close()
+        self._removed = None
+        os.replace(os.path.join(self.report_dir, "dedup_removed.jsonl.tmp"),
+                   os.path.join(self.report_dir, "dedup_removed.jsonl"))
+        with open(os.path.join(self.report_dir, "dedup_report.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+        saved = f", ~{summary['estimated_train_seconds_saved']:.0f}s of training per pass" if samples_per_sec else ""
+        images = f", {summary['image_duplicates']} same image" if self.use_image else ""
+        print(f"Dedup: {summary['input']} samples, removed {removed} ({summary['exact_duplicates']} exact, "
+              f"{summary['near_duplicates']} near at {self.threshold:.2f}{images}){saved}")
+        return summary
+
+    def close(self):
+        if self._removed is not None:
+            # Interrupted run: the previous report stays in place
+            self._removed.close()
+            os.remove(self._removed.name)
+            self._removed = None
+        self.db.close()
+
+def samples_per_sec(stats_path: str):
+    """Training throughput from a train_stats file, if training has run before."""
+    try:
+        with open(stats_path, 'r') as f:
+            return float(json.load(f).get("samples_per_sec") or 0.0) or None
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_deduplicated(records, write, index_path: str, stats_path: str = None, **options) -> int:
+    """Run write(records) on the non-duplicate records, then commit the index and report.
+
+    write is e.g. lambda records: write_records(records, output_path) and returns its count.
+    """
+    index = DedupIndex(index_path, **options)
+    try:
+        count = write(index.filter(records))
+        index.commit()
+        index.report(samples_per_sec=samples_per_sec(stats_path) if stats_path else None)
+        return count
+    finally:
+        index.close()
@@ -1,11 +1,23 @@
 import os
+import glob
+import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from huggingface_hub import HfApi, snapshot_download
 from pathlib import Path
 
 def download_model(model_name: str = "liuhaotian/llava-v1.5-7b", output_dir: str = "/model"):
     """Download LLaVA model and tokenizer from Hugging Face."""
     os.makedirs(output_dir, exist_ok=True)
     
+    # Weights already on the model PVC: nothing to do
+    if os.path.exists(os.path.join(output_dir, "config.json")) and glob.glob(os.path.join(output_dir, "*.safetensors")):
+        return output_dir
+    
+    # Safetensors checkpoints are copied as-is, without materializing the model in memory
+    if any(name.endswith(".safetensors") for name in HfApi().list_repo_files(model_name)):
+        snapshot_download(repo_id=model_name, local_dir=output_dir, ignore_patterns=["*.bin", "*.pt", "*.pth"])
+        return output_dir
+    
     # Download model and tokenizer
     model = AutoModelForCausalLM.from_pretrained(
         model_name, 
@@ -14,11 +26,11 @@ def download_model(model_name: str = "liuhaotian/llava-v1.5-7b", output_dir: str
     )
     tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=output_dir)
     
-    # Save model and tokenizer
-    model.save_pretrained(output_dir)
+    # Save model and tokenizer (as safetensors, so later loads can be memory-mapped)
+    model.save_pretrained(output_dir, safe_serialization=True)
     tokenizer.save_pretrained(output_dir)
     
     return output_dir
 
 if __name__ == "__main__":
-    download_model()
\ No newline at end of file
+    download_model()
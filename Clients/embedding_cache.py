@@ -0,0 +1,83 @@
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+from lora_adapter import ADAPTER_FILE
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+def adapter_hash(adapter_dir: str) -> str:
+    """Content hash of a saved LoRA adapter ("base" when there is none yet)."""
+    path = os.path.join(adapter_dir, ADAPTER_FILE)
+    if not os.path.exists(path):
+        return "base"
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by (text hash, adapter hash) with size-bounded LRU eviction."""
+
+    def __init__(self, cache_dir: str = "/data/embedding_cache", max_bytes: int = 2 << 30):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        # SQLite gives atomic, crash-safe updates from a single file on the data PVC
+        self.db = sqlite3.connect(os.path.join(cache_dir, "embeddings.sqlite"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " text_hash BLOB, adapter_hash TEXT, vector BLOB, last_used INTEGER,"
+            " PRIMARY KEY (text_hash, adapter_hash))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, text_hashes: List[bytes], adapter: str) -> Dict[bytes, np.ndarray]:
+        """Return cached embeddings for the given text hashes and mark them as recently used."""
+        found = {}
+        for start in range(0, len(text_hashes), 500):  # stay under SQLite's bound-parameter limit
+            chunk = text_hashes[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE adapter_hash = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                [adapter, *chunk]
+            ).fetchall()
+            found.update((bytes(h), np.frombuffer(v, dtype=np.float32)) for h, v in rows)
+        if found:
+            now = time.time_ns()
+            self.db.executemany("UPDATE embeddings SET last_used = ? WHERE text_hash = ? AND adapter_hash = ?",
+                                [(now, h, adapter) for h in found])
+            self.db.commit()
+        return found
+
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]], adapter: str):
+        """Store embeddings, then evict least recently used entries beyond max_bytes."""
+        if not items:
+            return
+        now = time.time_ns()
+        rows = [(h, adapter, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items]
+        self.db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+        self.total_bytes += sum(len(row[2]) for row in rows)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used embeddings until the cache fits in max_bytes."""
+        excess = self.total_bytes - self.max_bytes
+        freed, doomed = 0, []
+        for rowid, size in self.db.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if freed >= excess:
+                break
+            doomed.append((rowid,))
+            freed += size
+        self.db.executemany("DELETE FROM embeddings WHERE rowid = ?", doomed)
+        self.db.commit()
+        self.total_bytes -= freed
+
+    def close(self):
+        self.db.close()
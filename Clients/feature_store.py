@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+import torch
+from PIL import Image
+
+# Projected image features (vision tower + projector output) for a frozen vision tower, stored
+# once per image in one memory-mapped file. Layout under store_dir:
+#   meta.json      -> fingerprint of the vision model, feature shape and dtype
+#   features.bin   -> fixed-size slots, one (tokens, hidden) float16 array per image
+#   index.sqlite   -> image content hash (from ImageCache) -> slot
+# Slots are appended and fsynced before they are indexed, so the index never points at a
+# partial write; an unindexed tail left by a crash is truncated on the next open.
+
+def vision_fingerprint(model_dir: str, model) -> str:
+    """Identity of the vision path: model and processor configs, weight files and feature settings."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []:
+        path = os.path.join(model_dir, name)
+        if name.endswith(".json"):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        elif name.endswith((".safetensors", ".bin")):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    config = model.config
+    digest.update(json.dumps([config.vision_feature_layer, config.vision_feature_select_strategy]).encode())
+    return digest.hexdigest()
+
+def vision_frozen(model) -> bool:
+    """True if nothing in the vision tower or projector is trainable (e.g. no LoRA there)."""
+    return not any(param.requires_grad for name, param in model.named_parameters()
+                   if "vision_tower" in name or "multi_modal_projector" in name)
+
+def _vision_modules(model):
+    base = model.get_base_model() if hasattr(model, "get_base_model") else model
+    # transformers 4.x keeps the towers on the top-level model, 5.x on its inner .model
+    owner = base if isinstance(getattr(base, "vision_tower", None), torch.nn.Module) else base.model
+    return base.config, owner.vision_tower, owner.multi_modal_projector
+
+@torch.no_grad()
+def project_images(model, pixel_values: torch.Tensor) -> torch.Tensor:
+    """Image features as LLaVA splices them into the text: selected vision layer -> projector."""
+    config, vision_tower, projector = _vision_modules(model)
+    training = vision_tower.training
+    vision_tower.eval()
+    try:
+        outputs = vision_tower(pixel_values.to(vision_tower.device, vision_tower.dtype), output_hidden_states=True)
+    finally:
+        vision_tower.train(training)
+    layers = config.vision_feature_layer
+    if isinstance(layers, int):
+        selected = outputs.hidden_states[layers]
+    else:
+        selected = torch.cat([outputs.hidden_states[layer] for layer in layers], dim=-1)
+    if config.vision_feature_select_strategy == "default":
+        selected = selected[:, 1:]  # drop CLS
+    return projector(selected)
+
+def splice_features(model, input_ids: torch.Tensor, image_features: torch.Tensor, image_token_id: int):
+    """Input embeddings with the image token positions replaced by cached image features."""
+    image_mask = input_ids == image_token_id
+    embeds = model.get_input_embeddings()(input_ids.masked_fill(image_mask, 0))
+    features = image_features.to(embeds.device, embeds.dtype).reshape(-1, embeds.shape[-1])
+    return embeds.masked_scatter(image_mask.unsqueeze(-1), features)
+
+class FeatureStore:
+    """Memory-mapped image feature store keyed by image content hash, for one vision model."""
+
+    def __init__(self, store_dir: str = "/data/vision_features", fingerprint: str = ""):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.data_path = os.path.join(store_dir, "features.bin")
+        self.meta_path = os.path.join(store_dir, "meta.json")
+        self.db = sqlite3.connect(os.path.join(store_dir, "index.sqlite"))
+        self.db.execute("CREATE TABLE IF NOT EXISTS features (image_hash TEXT PRIMARY KEY, slot INTEGER)")
+        self.db.commit()
+        self.meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.meta = json.load(f)
+        if self.meta is not None and self.meta["fingerprint"] != fingerprint:
+            # Features of another vision model (or feature layer) are useless: start over
+            print(f"Vision model changed, clearing feature store {store_dir}")
+            self.db.execute("DELETE FROM features")
+            self.db.commit()
+            for path in (self.data_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.meta = None
+        self.fingerprint = fingerprint
+        self.slots = dict(self.db.execute("SELECT image_hash, slot FROM features"))
+        if self.meta is not None and os.path.exists(self.data_path):
+            with open(self.data_path, 'r+b') as f:
+                f.truncate((max(self.slots.values(), default=-1) + 1) * self.slot_bytes)
+
+    @property
+    def slot_bytes(self) -> int:
+        return int(np.prod(self.meta["shape"])) * np.dtype(self.meta["dtype"]).itemsize
+
+    def __contains__(self, image_hash: str) -> bool:
+        return image_hash in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def put_many(self, image_hashes, features: np.ndarray):
+        """Append features (one row per image) and index them once they are on disk."""
+        features = np.ascontiguousarray(features, dtype=np.float16)
+        if self.meta is None:
+            self.meta = {"fingerprint": self.fingerprint, "shape": list(features.shape[1:]), "dtype": "float16"}
+            tmp = f"{self.meta_path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.meta, f)
+            os.replace(tmp, self.meta_path)
+        with open(self.data_path, 'ab') as f:
+            first = f.tell() // self.slot_bytes
+            f.write(features.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        rows = [(image_hash, first + i) for i, image_hash in enumerate(image_hashes)]
+        self.db.executemany("INSERT OR REPLACE INTO features VALUES (?, ?)", rows)
+        self.db.commit()
+        self.slots.update(rows)
+
+    def warm(self, model, image_processor, image_cache, urls, batch_size: int = 16) -> int:
+        """Compute and store features for every image in urls that is not stored yet; returns the count."""
+        pending, seen = [], set()
+        for url in urls:
+            image_hash = image_cache.lookup(url) if url else None
+            if image_hash and image_hash not in self.slots and image_hash not in seen:
+                seen.add(image_hash)
+                pending.append((image_hash, url))
+        added = 0
+        for start in range(0, len(pending), batch_size):
+            hashes, images = [], []
+            for image_hash, url in pending[start:start + batch_size]:
+                array = image_cache.get(url)
+                if array is not None:
+                    hashes.append(image_hash)
+                    images.append(Image.fromarray(array))
+            if not images:
+                continue
+            pixel_values = image_processor(images, return_tensors="pt")["pixel_values"]
+            self.put_many(hashes, project_images(model, pixel_values).float().cpu().numpy())
+            added += len(hashes)
+        return added
+
+    def view(self, image_hashes) -> "FeatureView":
+        """Picklable per-sample accessor for DataLoader workers (None where no feature is stored)."""
+        slots = [self.slots.get(image_hash) if image_hash else None for image_hash in image_hashes]
+        return FeatureView(self.data_path, self.meta["shape"] if self.meta else None, slots)
+
+    def close(self):
+        self.db.close()
+
+class FeatureView:
+    """Read-only, lazily memory-mapped features for the samples of one dataset."""
+
+    def __init__(self, data_path: str, shape, slots):
+        self.data_path = data_path
+        self.shape = tuple(shape) if shape else None
+        self.slots = slots
+        self._features = None  # mapped on first use in each worker process
+
+    @property
+    def num_tokens(self) -> int:
+        return self.shape[0] if self.shape else 0
+
+    def __getitem__(self, idx):
+        slot = self.slots[idx]
+        if slot is None:
+            return None
+        if self._features is None:
+            self._features = np.memmap(self.data_path, dtype=np.float16, mode='r').reshape(-1, *self.shape)
+        return torch.from_numpy(np.array(self._features[slot]))
+
+    def __getstate__(self):
+        return {**self.__dict__, "_features": None}
@@ -1,20 +1,11 @@
 import json
 import os
 from pathlib import Path
+from jsonstream import iter_records, write_records
 
-def fetch_data(input_path: str = "/data/raw_facebook_data.json", output_path: str = "/data/dummy_data.json"):
-    """Fetch and preprocess unorganized Facebook data from PVC."""
-    # Check if input file exists in PVC
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"Raw data not found at {input_path}")
-
-    # Load raw Facebook data
-    with open(input_path, 'r') as f:
-        raw_data = json.load(f)
-
-    # Preprocess to extract relevant fields
-    processed_data = []
-    for item in raw_data:
+def fetch_records(raw_records):
+    """Yield preprocessed posts from an iterable of raw Facebook records."""
+    for item in raw_records:
         # Handle inconsistent data
         post_id = item.get("post_id", "unknown")
         text = item.get("message", item.get("text", ""))
@@ -25,19 +16,23 @@ def fetch_data(input_path: str = "/data/raw_facebook_data.json", output_path: st
         if not text or not image_url:
             continue
 
-        processed_data.append({
+        yield {
             "post_id": post_id,
             "text": text,
             "image_url": image_url,
             "platform": platform
-        })
+        }
+
+def fetch_data(input_path: str = "/data/raw_facebook_data.json", output_path: str = "/data/dummy_data.json"):
+    """Fetch and preprocess unorganized Facebook data from PVC."""
+    # Check if input file exists in PVC
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Raw data not found at {input_path}")
 
-    # Save processed data
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(processed_data, f, indent=2)
+    # Stream raw records through preprocessing and save them incrementally
+    write_records(fetch_records(iter_records(input_path)), output_path)
 
     return output_path
 
 if __name__ == "__main__":
-    fetch_data()
\ No newline at end of file
+    fetch_data()
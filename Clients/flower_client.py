@@ -1,44 +1,108 @@
+import json
+import os
+import time
 import flwr as fl
 import torch
-from client_workflow import run_client_workflow
+import numpy as np
 from typing import Dict, List, Tuple
-from transformers import AutoModelForCausalLM
-from peft import PeftModel
+from model_registry import get_lora_model
+from lora_adapter import get_lora_arrays, set_lora_arrays, load_lora_into
+from update_codec import UpdateCodec, UpdateEncoder
+from tracing import nbytes, reset_context, set_context, span
+
+# "direct" runs the tool pipeline in this process; "crewai" keeps the MCP server + CrewAI crew
+WORKFLOW_MODE = os.environ.get("WORKFLOW_MODE", "direct")
 
 class LLaVAClient(fl.client.NumPyClient):
-    def __init__(self, client_id: str, model_name: str = "liuhaotian/llava-v1.5-7b"):
+    def __init__(self, client_id: str, model_name: str = "/model", output_dir: str = "/output"):
         self.client_id = client_id
         self.model_name = model_name
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name, torch_dtype=torch.float16, device_map="auto"
-        )
+        self.output_dir = output_dir
+        self.adapter_dir = f"{output_dir}/lora_weights_{client_id}"
+        # The base model comes from the shared registry (mapped from the model PVC) and the
+        # PEFT wrapper stays resident; only adapters change per round
+        self.model = get_lora_model(model_name, self.adapter_dir)
+        self.encoder = None  # keeps the error-feedback residual between rounds
+        self.executor = None
+
+    def get_properties(self, config: Dict) -> Dict:
+        """Stable client identity: Flower cids change whenever a client reconnects."""
+        return {"client_id": self.client_id}
 
     def get_parameters(self, config: Dict) -> List[np.ndarray]:
-        """Return model parameters as NumPy arrays."""
-        model = PeftModel.from_pretrained(self.model, f"/output/lora_weights_{self.client_id}")
-        return [val.cpu().numpy() for val in model.state_dict().values()]
+        """Return the LoRA adapter tensors as NumPy arrays, in sorted name order."""
+        return get_lora_arrays(self.model)
 
     def set_parameters(self, parameters: List[np.ndarray]):
-        """Set model parameters from NumPy arrays."""
-        state_dict = PeftModel.from_pretrained(self.model, f"/output/lora_weights_{self.client_id}").state_dict()
-        for i, (key, val) in enumerate(state_dict.items()):
-            state_dict[key] = torch.from_numpy(parameters[i]).to(val.device)
-        model = PeftModel.from_pretrained(self.model, f"/output/lora_weights_{self.client_id}")
-        model.load_state_dict(state_dict)
+        """Load LoRA adapter tensors in place and persist them for the training stage."""
+        set_lora_arrays(self.model, parameters)
+        # train_llava resumes from this adapter, in-process or in the MCP server process
+        self.model.save_pretrained(self.adapter_dir)
 
     def fit(self, parameters: List[np.ndarray], config: Dict) -> Tuple[List[np.ndarray], int, Dict]:
-        """Train the model and return updated parameters."""
+        """Train the model and return updated parameters, the real sample count and throughput metrics."""
+        # Stage and tool spans recorded during this fit inherit the client id and round
+        token = set_context(client_id=self.client_id, round=config.get("server_round"))
+        try:
+            with span("client.fit") as trace:
+                trace.add(bytes_received=nbytes(parameters))
+                params, num_examples, metrics = self._fit(parameters, config)
+                trace.add(bytes_sent=nbytes(params), samples=num_examples)
+            return params, num_examples, metrics
+        finally:
+            reset_context(token)
+
+    def _fit(self, parameters: List[np.ndarray], config: Dict) -> Tuple[List[np.ndarray], int, Dict]:
+        start = time.perf_counter()
         self.set_parameters(parameters)
-        # Run CrewAI workflow to fetch, clean, and train
-        weights_path = run_client_workflow(self.client_id)
-        # Load updated parameters
+        # Fetch, clean, and train; the host may cap this round's samples to even out round times
+        weights_path = self.run_workflow(int(config.get("max_samples", 0)) or None)
+        # Pull the trained adapter back into the resident model
+        load_lora_into(self.model, self.adapter_dir)
         params = self.get_parameters(config)
-        return params, 2, {}  # 2 is dummy sample count
+        metrics = self.train_metrics()
+        # Optionally send a compressed delta against the received global weights
+        codec = UpdateCodec.from_spec(config.get("codec", ""))
+        if codec is not None:
+            if self.encoder is None or self.encoder.codec.spec != codec.spec:
+                self.encoder = UpdateEncoder(codec)
+            params, codec_metrics = self.encoder.encode(params, parameters)
+            metrics.update(codec_metrics)
+        metrics["round_seconds"] = time.perf_counter() - start
+        return params, metrics.pop("samples"), metrics
+
+    def train_metrics(self) -> Dict:
+        """Sample count and throughput of the last training run, from train_llava's stats file."""
+        with open(f"{self.output_dir}/train_stats_{self.client_id}.json", 'r') as f:
+            stats = json.load(f)
+        return {
+            "client_id": self.client_id,
+            "samples": max(int(stats["samples"]), 1),  # FedAvg weights must stay positive
+            "samples_per_sec": float(stats["samples_per_sec"]),
+            "tokens_per_sec": float(stats["tokens_per_sec"]),
+            "train_seconds": float(stats["seconds"]),
+            "dataset_size": int(stats.get("dataset_size") or stats["samples"])
+        }
+
+    def run_workflow(self, max_samples: int = None):
+        """Run the client pipeline in the configured mode and return the LoRA weights path."""
+        if WORKFLOW_MODE == "crewai":
+            from client_workflow import run_client_workflow
+            # The MCP server process inherits the environment, and with it the budget
+            os.environ["TRAIN_MAX_SAMPLES"] = str(max_samples or 0)
+            return run_client_workflow(self.client_id, self.output_dir)
+        if self.executor is None:
+            from pipeline_executor import PipelineExecutor
+            self.executor = PipelineExecutor(self.client_id, output_dir=self.output_dir)
+        stage_kwargs = {"train_llava": {"max_samples": max_samples}} if max_samples else None
+        return self.executor.run(stage_kwargs=stage_kwargs)["results"]["train_llava"]
 
     def evaluate(self, parameters: List[np.ndarray], config: Dict) -> Tuple[float, int, Dict]:
         """Evaluate the model (placeholder)."""
-        self.set_parameters(parameters)
-        return 0.0, 2, {"accuracy": 0.0}  # Dummy evaluation
+        with span("client.evaluate", client_id=self.client_id, round=config.get("server_round")) as trace:
+            trace.add(bytes_received=nbytes(parameters))
+            self.set_parameters(parameters)
+            return 0.0, 2, {"accuracy": 0.0}  # Dummy evaluation
 
 def start_flower_client(client_id: str):
     """Start Flower client."""
@@ -47,4 +111,4 @@ def start_flower_client(client_id: str):
 
 if __name__ == "__main__":
     import sys
-    start_flower_client(sys.argv[1] if len(sys.argv) > 1 else "client1")
\ No newline at end of file
+    start_flower_client(sys.argv[1] if len(sys.argv) > 1 else "client1")
@@ -1,45 +1,188 @@
 import torch
+import copy
+import hashlib
 import json
 import os
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from peft import PeftModel
+import time
 import numpy as np
+from itertools import islice
+from jsonstream import iter_records
+from model_registry import get_lora_model, get_tokenizer
+from token_shards import load_shards, shards_enabled
+from profile_io import save_profile
+from embedding_cache import EmbeddingCache, adapter_hash, text_hash
 
-def generate_profile(data_path: str, model_dir: str, output_dir: str, client_id: str):
-    """Generate a platform-specific profile using client LoRA weights."""
-    # Load model and tokenizer from PVC
-    tokenizer = AutoTokenizer.from_pretrained(model_dir)
-    model = AutoModelForCausalLM.from_pretrained(
-        model_dir, torch_dtype=torch.float16, device_map="auto"
-    )
-    model = PeftModel.from_pretrained(model, f"{output_dir}/lora_weights_{client_id}")
+class RunningStats:
+    """Running mean and variance of embedding vectors (Welford/Chan), in constant memory."""
 
-    # Load test data
-    with open(data_path, 'r') as f:
-        data = json.load(f)
+    def __init__(self, dim: int = None):
+        self.count = 0
+        self.mean = np.zeros(dim, dtype=np.float64) if dim else None
+        self.m2 = np.zeros(dim, dtype=np.float64) if dim else None
 
-    # Generate embeddings for each data point
-    model.eval()
-    embeddings = []
-    with torch.no_grad():
-        for item in data[:10]:  # Limit to 10 samples for efficiency
-            inputs = tokenizer(item["text"], return_tensors="pt", truncation=True, max_length=512).to(model.device)
-            outputs = model(**inputs, output_hidden_states=True)
-            # Use mean-pooled last hidden state as embedding
-            embedding = outputs.hidden_states[-1].mean(dim=1).squeeze().cpu().numpy()
-            embeddings.append(embedding)
+    def update(self, batch: np.ndarray):
+        """Fold a (n, dim) batch of embeddings into the statistics."""
+        batch = np.asarray(batch, dtype=np.float64)
+        if not len(batch):
+            return
+        self.merge_moments(len(batch), batch.mean(axis=0), ((batch - batch.mean(axis=0)) ** 2).sum(axis=0))
+
+    def merge_moments(self, count: int, mean: np.ndarray, m2: np.ndarray):
+        """Combine with another set of statistics given as (count, mean, sum of squared deviations)."""
+        if self.count == 0:
+            self.count, self.mean, self.m2 = count, np.array(mean, dtype=np.float64), np.array(m2, dtype=np.float64)
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        return self.m2 / self.count if self.count else self.m2
+
+def _windows(data, size: int):
+    data = iter(data)
+    while True:
+        window = list(islice(data, size))
+        if not window:
+            return
+        yield window
+
+def _chain(prefix: bytes, digest: bytes) -> bytes:
+    # Hash chain over text hashes: identifies the exact sequence of posts already profiled
+    return hashlib.sha256(prefix + digest).digest()
+
+def _items(data_path: str, shards=None, start: int = 0, stop: int = None):
+    """(text hash, payload) per post: token ids from shards, else the text from data_path."""
+    if shards is not None:
+        for index in range(start, min(stop, len(shards)) if stop is not None else len(shards)):
+            yield shards.text_hash(index), shards[index]
+    else:
+        for item in islice(iter_records(data_path), start, stop):
+            yield text_hash(item["text"]), item["text"]
+
+def _resume_state(state_path: str, adapter: str, data_path: str, shards=None):
+    """Return (stats, records_done, prefix) saved by the last run if the adapter and the already
+    profiled prefix of the dataset are unchanged, else a fresh start."""
+    fresh = (RunningStats(), 0, b"")
+    if not os.path.exists(state_path):
+        return fresh
+    state = np.load(state_path)
+    if str(state["adapter"]) != adapter:
+        return fresh
+    done, prefix = int(state["records_done"]), b""
+    for h, _ in _items(data_path, shards, 0, done):
+        prefix = _chain(prefix, h)
+    if prefix != state["prefix"].tobytes():
+        return fresh
+    stats = RunningStats()
+    stats.merge_moments(int(state["count"]), state["mean"], state["m2"])
+    return stats, done, prefix
+
+def _save_state(state_path: str, adapter: str, stats: RunningStats, done: int, prefix: bytes):
+    tmp_path = f"{state_path}.tmp.npz"
+    np.savez(tmp_path, adapter=adapter, records_done=done, prefix=np.frombuffer(prefix, dtype=np.uint8),
+             count=stats.count, mean=stats.mean, m2=stats.m2)
+    os.replace(tmp_path, state_path)
 
-    # Average embeddings to create platform-specific profile
-    profile = np.mean(embeddings, axis=0).tolist()
+def embed_batch(model, tokenizer, texts, max_length: int = 512) -> np.ndarray:
+    """Mean-pool the last hidden state over real (non-padding) tokens for a batch of texts."""
+    return embed_ids(model, tokenizer, tokenizer(texts, truncation=True, max_length=max_length)["input_ids"])
 
-    # Save profile
+def embed_ids(model, tokenizer, sequences) -> np.ndarray:
+    """embed_batch for already tokenized texts (lists or arrays of token ids)."""
+    inputs = tokenizer.pad({"input_ids": [np.asarray(ids).tolist() for ids in sequences]},
+                           return_tensors="pt").to(model.device)
+    outputs = model(**inputs, output_hidden_states=True)
+    hidden = outputs.hidden_states[-1].float()
+    mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+    return pooled.cpu().numpy()
+
+def generate_profile(data_path: str, model_dir: str, output_dir: str, client_id: str,
+                     batch_size: int = 16, max_samples: int = None, binary: bool = True,
+                     cache_dir: str = "/data/embedding_cache", use_shards: bool = None):
+    """Generate a platform-specific profile using client LoRA weights.
+
+    With use_shards (TOKEN_SHARDS, on by default) posts are read pre-tokenized from the shards
+    of data_path, built by build_token_shards (or here if stale), instead of tokenized again.
+    max_samples caps the posts profiled by this run, after those resumed from the last one.
+    """
+    # Shared base model and tokenizer from the process-wide registry, with the client's adapter
+    tokenizer = get_tokenizer(model_dir)
+    adapter_dir = f"{output_dir}/lora_weights_{client_id}"
+    model = get_lora_model(model_dir, adapter_dir)
+    if use_shards is None:
+        use_shards = shards_enabled()
+    shards = load_shards(data_path, tokenizer) if use_shards else None
+    if tokenizer.pad_token is None:
+        # Pad with a copy: the registry's tokenizer is shared, and its special tokens are part of
+        # the shard fingerprint
+        tokenizer = copy.deepcopy(tokenizer)
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # Resume from the statistics of the last run when the adapter and already-seen posts are
+    # unchanged, so only newly appended posts are embedded
+    adapter = adapter_hash(adapter_dir)
+    cache = EmbeddingCache(cache_dir) if cache_dir else None
     os.makedirs(output_dir, exist_ok=True)
-    profile_path = f"{output_dir}/profile_{client_id}.json"
-    with open(profile_path, 'w') as f:
-        json.dump({"client_id": client_id, "profile": profile}, f, indent=2)
+    state_path = f"{output_dir}/profile_state_{client_id}.npz"
+    stats, done, prefix = _resume_state(state_path, adapter, data_path, shards) if cache else (RunningStats(), 0, b"")
+    skipped = done
+
+    # Stream the rest of the cleaned dataset (shards, or JSON array / JSONL), optionally capped
+    data = _items(data_path, shards, done, done + max_samples if max_samples is not None else None)
+
+    # Embed cache misses in padded, length-sorted batches and keep only running statistics
+    model.eval()
+    computed = reused = 0
+    start = time.perf_counter()
+    with torch.no_grad():
+        for window in _windows(data, batch_size * 16):
+            hashes = [h for h, _ in window]
+            cached = cache.get_many(list(set(hashes)), adapter) if cache else {}
+            missing = {h: payload for h, payload in window if h not in cached}
+            texts = sorted(missing.items(), key=lambda pair: len(pair[1]))
+            embed = embed_ids if shards is not None else embed_batch
+            for i in range(0, len(texts), batch_size):
+                batch = texts[i:i + batch_size]
+                vectors = embed(model, tokenizer, [payload for _, payload in batch])
+                cached.update(zip((h for h, _ in batch), vectors))
+            if cache:
+                cache.put_many([(h, cached[h]) for h in missing], adapter)
+            stats.update(np.stack([cached[h] for h in hashes]))
+            for h in hashes:
+                prefix = _chain(prefix, h)
+            computed += len(missing)
+            reused += len(hashes) - len(missing)
+            done += len(window)
+    if cache:
+        _save_state(state_path, adapter, stats, done, prefix)
+        cache.close()
+    elapsed = time.perf_counter() - start
+    print(f"Profile ({client_id}): {stats.count} samples ({skipped} unchanged, {reused} from cache, "
+          f"{computed} embedded), {(computed + reused) / elapsed if elapsed else 0.0:.2f} samples/sec")
+    if not stats.count:
+        raise ValueError(f"No samples to profile in {data_path}")
+
+    # Save profile (binary .npy + JSON sidecar by default, legacy JSON on request)
+    if binary:
+        profile_path = save_profile(f"{output_dir}/profile_{client_id}", stats.mean, stats.count,
+                                    stats.variance, client_id=client_id)
+    else:
+        profile_path = f"{output_dir}/profile_{client_id}.json"
+        with open(profile_path, 'w') as f:
+            json.dump({
+                "client_id": client_id,
+                "num_samples": stats.count,
+                "profile": stats.mean.tolist(),
+                "variance": stats.variance.tolist()
+            }, f)
 
     return profile_path
 
 if __name__ == "__main__":
     import sys
-    generate_profile("/data/cleaned_data.json", "/model", "/output", sys.argv[1] if len(sys.argv) > 1 else "client1")
\ No newline at end of file
+    generate_profile("/data/cleaned_data.json", "/model", "/output", sys.argv[1] if len(sys.argv) > 1 else "client1")
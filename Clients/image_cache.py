@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
+import requests
+from PIL import Image
+
+class ImageCache:
+    """Persistent, content-addressed image cache on the data PVC.
+
+    Layout under cache_dir:
+      urls/<sha256(url)>            -> content hash of the bytes served at that URL
+      blobs/<hash[:2]>/<hash>       -> raw downloaded bytes
+      decoded/<hash[:2]>/<hash>_<W>x<H>.npy -> decoded RGB uint8 array at the target size
+    Identical images served from different URLs are stored and decoded once.
+    """
+
+    def __init__(self, cache_dir: str = "/data/image_cache", size: tuple = (224, 224),
+                 timeout: float = 10.0, max_workers: int = 8):
+        self.cache_dir = cache_dir
+        self.size = tuple(size)
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._local = threading.local()
+        for sub in ("urls", "blobs", "decoded"):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+
+    def _session(self) -> requests.Session:
+        # requests sessions are not shared across threads
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", content_hash[:2], content_hash)
+
+    def _decoded_path(self, content_hash: str) -> str:
+        width, height = self.size
+        return os.path.join(self.cache_dir, "decoded", content_hash[:2], f"{content_hash}_{width}x{height}.npy")
+
+    def lookup(self, url: str):
+        """Return the content hash cached for url, or None."""
+        try:
+            with open(self._url_path(url), 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def fetch(self, url: str) -> str:
+        """Download url, store its bytes and decoded array, and return the content hash."""
+        response = self._session().get(url, timeout=self.timeout)
+        response.raise_for_status()
+        content = response.content
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        if not os.path.exists(self._blob_path(content_hash)):
+            _atomic_write(self._blob_path(content_hash), content)
+        if not os.path.exists(self._decoded_path(content_hash)):
+            self._store_decoded(content_hash, content)
+        # Index last, so a URL never points at a half-written entry
+        _atomic_write(self._url_path(url), content_hash.encode("utf-8"))
+        return content_hash
+
+    def _store_decoded(self, content_hash: str, content: bytes) -> np.ndarray:
+        image = Image.open(BytesIO(content)).convert("RGB").resize(self.size)
+        array = np.asarray(image, dtype=np.uint8)
+        buffer = BytesIO()
+        np.save(buffer, array)
+        _atomic_write(self._decoded_path(content_hash), buffer.getvalue())
+        return array
+
+    def get(self, url: str):
+        """Return the decoded RGB uint8 array for url, downloading on a miss; None on failure."""
+        try:
+            content_hash = self.lookup(url) or self.fetch(url)
+            try:
+                return np.load(self._decoded_path(content_hash))
+            except FileNotFoundError:
+                # Size changed or decoded entry evicted: re-decode from the stored blob
+                with open(self._blob_path(content_hash), 'rb') as f:
+                    return self._store_decoded(content_hash, f.read())
+        except Exception as e:
+            print(f"Erreur lors du chargement de l'image {url}: {e}")
+            return None
+
+    def get_image(self, url: str):
+        """Return the cached image for url as a PIL RGB image, or None."""
+        array = self.get(url)
+        return Image.fromarray(array) if array is not None else None
+
+    def prefetch(self, items, url_of=None, lookahead: int = 64):
+        """Yield (item, array) in input order while a bounded thread pool downloads ahead.
+
+        url_of maps an item to its image URL (items are URLs by default). At most
+        `lookahead` images are in flight or buffered; items without a URL yield None.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for item in items:
+                url = url_of(item) if url_of else item
+                pending.append((item, executor.submit(self.get, url) if url else None))
+                if len(pending) >= lookahead:
+                    item, future = pending.popleft()
+                    yield item, future.result() if future else None
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result() if future else None
+
+    def warm(self, urls) -> int:
+        """Populate the cache for urls ahead of training; returns how many are available."""
+        return sum(1 for _, array in self.prefetch(urls) if array is not None)
+
+def _atomic_write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    import sys
+    from jsonstream import iter_records
+    data_path = sys.argv[1] if len(sys.argv) > 1 else "/data/cleaned_data.json"
+    urls = (item.get("image_url") or item.get("image") for item in iter_records(data_path))
+    print(f"Cached {ImageCache().warm(urls)} images")
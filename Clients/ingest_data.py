@@ -0,0 +1,101 @@
+import os
+from itertools import islice
+from jsonstream import iter_records, is_jsonl, iter_jsonl_from, append_jsonl
+from fetch_data import fetch_records
+from clean_data import clean_records, write_cleaned
+from dedup import write_deduplicated
+from ingest_manifest import IngestManifest, post_key, file_fingerprint, head_hash
+
+def ingest_data(input_path: str = "/data/raw_facebook_data.json", output_path: str = "/data/cleaned_data.jsonl",
+                dedup_path: str = None, stats_path: str = None):
+    """Fetch and clean raw Facebook data in a single streaming pass (deduplicated with dedup_path)."""
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Raw data not found at {input_path}")
+
+    # Records flow raw -> fetched -> cleaned -> disk one at a time, so memory stays flat
+    count = write_cleaned(clean_records(fetch_records(iter_records(input_path))), output_path,
+                          dedup_path, stats_path)
+    print(f"Ingested {count} records into {output_path}")
+
+    return output_path
+
+def ingest_incremental(input_path: str = "/data/raw_facebook_data.json", output_path: str = "/data/cleaned_data.jsonl",
+                       manifest_path: str = "/data/ingest_manifest.sqlite", dedup_path: str = None,
+                       stats_path: str = None):
+    """Fetch and clean only posts added since the last run, appending them to a JSONL output.
+
+    With dedup_path, new posts are also deduplicated against everything ingested before.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Raw data not found at {input_path}")
+
+    manifest = IngestManifest(manifest_path)
+    try:
+        # Roll back a partial append from an interrupted run, or rebuild if the output was
+        # replaced by something else since the last commit
+        out_state = manifest.output(output_path)
+        if out_state and _output_intact(output_path, out_state):
+            # Only truncate a partial append: truncating also bumps the mtime, which would make
+            # the downstream stages look changed
+            if os.path.getsize(output_path) != out_state["size"]:
+                with open(output_path, 'r+b') as f:
+                    f.truncate(out_state["size"])
+        else:
+            manifest.reset()
+            open(output_path, 'wb').close()
+
+        # Nothing changed since the last watermark: skip fetch and clean entirely
+        stat = os.stat(input_path)
+        source = manifest.source(input_path)
+        if source and out_state and (source["size"], source["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            print(f"No new data in {input_path}, skipping ingestion")
+            return output_path
+
+        # Appended JSONL exports resume from the byte watermark; anything else is rescanned and
+        # filtered by the keys of posts already ingested
+        jsonl = is_jsonl(input_path)
+        offset = 0
+        if jsonl and source and source["offset"] <= stat.st_size \
+                and file_fingerprint(input_path, source["offset"]) == source["fingerprint"]:
+            offset = source["offset"]
+        raw = iter_jsonl_from(input_path, offset) if jsonl else ((record, 0) for record in iter_records(input_path))
+
+        new_keys = []
+        watermark = offset
+
+        def unseen():
+            nonlocal watermark
+            pending = set()
+            while True:
+                batch = list(islice(raw, 1000))
+                if not batch:
+                    return
+                keys = [post_key(record) for record, _ in batch]
+                seen = manifest.seen(keys)
+                for (record, end), key in zip(batch, keys):
+                    if jsonl:
+                        watermark = end
+                    if key in seen or key in pending:
+                        continue
+                    pending.add(key)
+                    new_keys.append(key)
+                    yield record
+
+        cleaned = clean_records(fetch_records(unseen()))
+        if dedup_path is None:
+            count = append_jsonl(cleaned, output_path)
+        else:
+            count = write_deduplicated(cleaned, lambda kept: append_jsonl(kept, output_path), dedup_path, stats_path)
+        manifest.commit(input_path, watermark, output_path, new_keys)
+        print(f"Ingested {len(new_keys)} new posts ({count} cleaned) into {output_path}")
+        return output_path
+    finally:
+        manifest.close()
+
+def _output_intact(output_path: str, out_state: dict) -> bool:
+    if not os.path.exists(output_path) or os.path.getsize(output_path) < out_state["size"]:
+        return False
+    return not out_state["size"] or head_hash(output_path, out_state["head_len"]) == out_state["head_hash"]
+
+if __name__ == "__main__":
+    ingest_incremental()
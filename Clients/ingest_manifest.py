@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Iterable, List, Set
+
+HEAD_BYTES = 4096
+FINGERPRINT_BYTES = 64 << 10
+
+def post_key(record) -> str:
+    """Stable identity of a raw post: its post_id, or a hash of its content when it has none."""
+    post_id = record.get("post_id") if isinstance(record, dict) else None
+    if post_id and post_id != "unknown":
+        return f"id:{post_id}"
+    return "sha:" + hashlib.sha256(json.dumps(record, sort_keys=True).encode("utf-8")).hexdigest()
+
+def file_fingerprint(path: str, offset: int) -> str:
+    """Cheap identity of the first `offset` bytes of a file: its head, its tail before offset, and offset."""
+    digest = hashlib.sha256(str(offset).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(min(offset, FINGERPRINT_BYTES)))
+        f.seek(max(0, offset - FINGERPRINT_BYTES))
+        digest.update(f.read(min(offset, FINGERPRINT_BYTES)))
+    return digest.hexdigest()
+
+def head_hash(path: str, length: int) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(length)).hexdigest()
+
+class IngestManifest:
+    """Crash-safe watermark manifest for incremental ingestion, stored in SQLite on the data PVC.
+
+    It records, per input file, its size, mtime and the byte offset already processed; per
+    output file, the size it had after the last committed run; and the keys of every post
+    already ingested. All three are updated in a single transaction after the output has been
+    appended and fsynced, so an interrupted run leaves the previous state intact and its
+    partial append is truncated away on the next run.
+    """
+
+    def __init__(self, path: str = "/data/ingest_manifest.sqlite"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS sources (input_path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+            " offset INTEGER, fingerprint TEXT);"
+            "CREATE TABLE IF NOT EXISTS outputs (output_path TEXT PRIMARY KEY, size INTEGER, head_len INTEGER,"
+            " head_hash TEXT);"
+            "CREATE TABLE IF NOT EXISTS seen (post_key TEXT PRIMARY KEY);"
+        )
+        self.db.commit()
+
+    def source(self, input_path: str):
+        row = self.db.execute("SELECT size, mtime_ns, offset, fingerprint FROM sources WHERE input_path = ?",
+                              (input_path,)).fetchone()
+        return dict(zip(("size", "mtime_ns", "offset", "fingerprint"), row)) if row else None
+
+    def output(self, output_path: str):
+        row = self.db.execute("SELECT size, head_len, head_hash FROM outputs WHERE output_path = ?",
+                              (output_path,)).fetchone()
+        return dict(zip(("size", "head_len", "head_hash"), row)) if row else None
+
+    def seen(self, keys: List[str]) -> Set[str]:
+        """Return the subset of keys that were already ingested."""
+        found = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.update(row[0] for row in self.db.execute(
+                f"SELECT post_key FROM seen WHERE post_key IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def commit(self, input_path: str, offset: int, output_path: str, new_keys: Iterable[str]):
+        """Atomically record the new watermark, output size and ingested keys."""
+        stat = os.stat(input_path)
+        out_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        head_len = min(out_size, HEAD_BYTES)
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((key,) for key in new_keys))
+            self.db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                            (input_path, stat.st_size, stat.st_mtime_ns, offset, file_fingerprint(input_path, offset)))
+            self.db.execute("INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+                            (output_path, out_size, head_len, head_hash(output_path, head_len) if out_size else ""))
+
+    def reset(self):
+        with self.db:
+            self.db.execute("DELETE FROM sources")
+            self.db.execute("DELETE FROM outputs")
+            self.db.execute("DELETE FROM seen")
+
+    def close(self):
+        self.db.close()
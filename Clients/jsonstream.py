@@ -0,0 +1,157 @@
+import json
+import os
+
+CHUNK_SIZE = 1 << 20  # 1 MiB read window
+
+
+def iter_records(path: str, chunk_size: int = CHUNK_SIZE):
+    """Yield records one at a time from a JSON array or JSONL file."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        eof = len(buf) < chunk_size
+        pos = _skip(buf, 0, " \t\r\n")
+
+        # A leading '[' means a JSON array, anything else is a stream of values (JSONL)
+        in_array = buf[pos:pos + 1] == "["
+        if in_array:
+            pos += 1
+
+        while True:
+            pos = _skip(buf, pos, " \t\r\n," if in_array else " \t\r\n")
+            if pos >= len(buf):
+                if eof:
+                    return
+                buf, pos = f.read(chunk_size), 0
+                eof = len(buf) < chunk_size
+                continue
+            if in_array and buf[pos] == "]":
+                return
+
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                record, end = None, None
+            # A value ending exactly at the window edge may be truncated (e.g. a number)
+            if end is None or (end == len(buf) and not eof):
+                if eof:
+                    raise ValueError(f"Malformed JSON record in {path} at offset {pos}")
+                chunk = f.read(chunk_size)
+                eof = len(chunk) < chunk_size
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+            yield record
+            pos = end
+            # Drop consumed text so the window stays bounded
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+
+def _skip(buf: str, pos: int, chars: str) -> int:
+    while pos < len(buf) and buf[pos] in chars:
+        pos += 1
+    return pos
+
+
+def write_jsonl(records, output_path: str) -> int:
+    """Write records as compact JSONL, atomically replacing output_path."""
+    return _atomic_write(records, output_path, jsonl=True)
+
+
+def write_json_array(records, output_path: str) -> int:
+    """Write records as a compact JSON array without materializing the list."""
+    return _atomic_write(records, output_path, jsonl=False)
+
+
+def write_records(records, output_path: str) -> int:
+    """Write records as JSONL if output_path ends in .jsonl, else as a JSON array."""
+    return _atomic_write(records, output_path, jsonl=output_path.endswith(".jsonl"))
+
+
+def _atomic_write(records, output_path: str, jsonl: bool) -> int:
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        if not jsonl:
+            f.write("[")
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            if jsonl:
+                f.write(line + "\n")
+            else:
+                f.write(("," if count else "") + "\n" + line)
+            count += 1
+        if not jsonl:
+            f.write("\n]\n")
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def is_jsonl(path: str) -> bool:
+    """True unless the file's first non-whitespace character opens a JSON array."""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                return True
+            stripped = chunk.lstrip()
+            if stripped:
+                return not stripped.startswith(b"[")
+
+
+def is_line_delimited(path: str, sample_lines: int = 64) -> bool:
+    """True if path is JSONL with one complete record per line, judged from its first lines.
+
+    Streams of pretty-printed values are JSONL to iter_records, but cannot be split at newlines.
+    """
+    if not is_jsonl(path):
+        return False
+    with open(path, 'rb') as f:
+        checked = 0
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                json.loads(line)
+            except ValueError:
+                return False
+            checked += 1
+            if checked >= sample_lines:
+                break
+    return True
+
+
+def iter_jsonl_from(path: str, offset: int = 0):
+    """Yield (record, end_offset) for each complete JSONL line starting at byte offset.
+
+    A trailing line without a newline that does not parse (e.g. an export still being
+    written) is left for the next call, so end_offset is always a safe watermark.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return
+                yield record, offset + len(line)
+                return
+            offset += len(line)
+            if line.strip():
+                yield json.loads(line), offset
+
+
+def append_jsonl(records, output_path: str) -> int:
+    """Append records as compact JSONL and fsync, so the new size is durable before it is recorded."""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    count = 0
+    with open(output_path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    return count
@@ -0,0 +1,166 @@
+import math
+import random
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, Sampler
+from image_cache import ImageCache
+
+IMAGE_TOKEN = "<image>"
+IGNORE_INDEX = -100
+
+def image_url(item):
+    # Cleaned samples store the URL under "image", fetched posts under "image_url"
+    return item.get("image_url") or item.get("image")
+
+class LlavaDataset(Dataset):
+    """Pre-tokenized LLaVA samples whose images are preprocessed inside DataLoader workers.
+
+    With shards (a token_shards.TokenShards), records are indices into the shards and token ids
+    are read from the memory-mapped shards instead of being tokenized here. With features (a
+    feature_store.FeatureView over the same records), samples carry the cached projected image
+    features instead of pixel values, one image token per feature row.
+    """
+
+    def __init__(self, records, processor, image_cache_dir: str = "/data/image_cache", max_length: int = 512,
+                 features=None, shards=None):
+        records = list(records)
+        tokenizer = processor.tokenizer
+        if shards is not None:
+            self.input_ids = _ShardSubset(shards, records, max_length)
+            self.image_urls = [shards.image(index) for index in records]
+            token_lengths = self.input_ids.lengths()
+        else:
+            # Tokenize once up front; lengths drive the bucketing sampler
+            encoded = tokenizer([item["text"] for item in records], truncation=True,
+                                max_length=max_length)["input_ids"] if records else []
+            self.input_ids = encoded
+            self.image_urls = [image_url(item) for item in records]
+            token_lengths = [len(ids) for ids in encoded]
+        self.image_processor = processor.image_processor
+        self.image_token_id = tokenizer.convert_tokens_to_ids(IMAGE_TOKEN)
+        self.image_token_count = _image_token_count(processor, self.image_token_id)
+        self.features = features
+        if features is not None:
+            self.lengths = [length + (features.num_tokens if slot is not None else 0)
+                            for length, slot in zip(token_lengths, features.slots)]
+        else:
+            self.lengths = [length + (self.image_token_count if url else 0)
+                            for length, url in zip(token_lengths, self.image_urls)]
+        self.bos_token_id = tokenizer.bos_token_id
+        self.image_cache_dir = image_cache_dir
+        self._cache = None  # created lazily in each worker process
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def __getitem__(self, idx):
+        input_ids = self.input_ids[idx]
+        input_ids = input_ids.tolist() if hasattr(input_ids, "tolist") else list(input_ids)
+        position = 1 if input_ids and input_ids[0] == self.bos_token_id else 0
+        if self.features is not None:
+            image_features = self.features[idx]
+            if image_features is not None:
+                input_ids[position:position] = [self.image_token_id] * image_features.shape[0]
+            return {"input_ids": input_ids, "pixel_values": None, "image_features": image_features}
+        pixel_values = None
+        url = self.image_urls[idx]
+        if url:
+            if self._cache is None:
+                self._cache = ImageCache(self.image_cache_dir)
+            array = self._cache.get(url)
+            if array is not None:
+                pixel_values = self.image_processor(Image.fromarray(array), return_tensors="pt")["pixel_values"][0]
+                # The image token goes right after BOS so the model can splice in image features
+                input_ids[position:position] = [self.image_token_id] * self.image_token_count
+        return {"input_ids": input_ids, "pixel_values": pixel_values}
+
+class _ShardSubset:
+    """Token ids of selected shard indices, truncated to max_length, read on access."""
+
+    def __init__(self, shards, indices, max_length: int):
+        self.shards = shards
+        self.indices = indices
+        self.max_length = max_length
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        return self.shards[self.indices[idx]][:self.max_length]
+
+    def lengths(self):
+        all_lengths = self.shards.lengths
+        return [min(int(all_lengths[index]), self.max_length) for index in self.indices]
+
+def _image_token_count(processor, image_token_id: int) -> int:
+    """Number of image tokens the processor emits per image (1 where the model expands it itself)."""
+    encoded = processor(text=IMAGE_TOKEN, images=Image.new("RGB", (224, 224)), return_tensors="pt")
+    return max(1, int((encoded["input_ids"] == image_token_id).sum()))
+
+class PadCollator:
+    """Pad a batch to its longest sample and mask padding and image tokens out of the loss."""
+
+    def __init__(self, pad_token_id: int, image_token_id: int = None):
+        self.pad_token_id = pad_token_id
+        self.image_token_id = image_token_id
+
+    def __call__(self, batch):
+        max_len = max(len(sample["input_ids"]) for sample in batch)
+        input_ids = torch.full((len(batch), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), max_len), dtype=torch.long)
+        labels = torch.full((len(batch), max_len), IGNORE_INDEX, dtype=torch.long)
+        for i, sample in enumerate(batch):
+            ids = torch.tensor(sample["input_ids"], dtype=torch.long)
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+            labels[i, :len(ids)] = ids
+        if self.image_token_id is not None:
+            labels[input_ids == self.image_token_id] = IGNORE_INDEX
+
+        out = {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+        pixel_values = [sample["pixel_values"] for sample in batch if sample["pixel_values"] is not None]
+        if pixel_values:
+            out["pixel_values"] = torch.stack(pixel_values)
+        image_features = [sample["image_features"] for sample in batch if sample.get("image_features") is not None]
+        if image_features:
+            out["image_features"] = torch.stack(image_features)
+        return out
+
+class LengthBucketSampler(Sampler):
+    """Yield batches of indices with similar token lengths to keep padding low.
+
+    Indices are shuffled, split into pools of batch_size * bucket_multiplier, sorted by
+    length inside each pool and cut into batches; batch order is then shuffled. The order only
+    depends on seed and epoch, so a resumed pass can skip the first `start` batches.
+    """
+
+    def __init__(self, lengths, batch_size: int, shuffle: bool = True, bucket_multiplier: int = 50, seed: int = 0,
+                 start: int = 0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pool_size = batch_size * bucket_multiplier
+        self.seed = seed
+        self.epoch = 0
+        self.start = start
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+        batches = []
+        for start in range(0, len(indices), self.pool_size):
+            pool = sorted(indices[start:start + self.pool_size], key=self.lengths.__getitem__)
+            batches.extend(pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size))
+        if self.shuffle:
+            rng.shuffle(batches)
+        return iter(batches[self.start:])
+
+    def __len__(self):
+        n = len(self.lengths)
+        return max(sum(math.ceil(min(self.pool_size, n - start) / self.batch_size)
+                       for start in range(0, n, self.pool_size)) - self.start, 0)
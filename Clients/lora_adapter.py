@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import torch
+from typing import Dict, List
+from peft import LoraConfig, PeftModel, get_peft_model, get_peft_model_state_dict, set_peft_model_state_dict
+from safetensors.torch import load_file
+
+ADAPTER_FILE = "adapter_model.safetensors"
+
+def lora_config() -> LoraConfig:
+    """LoRA configuration shared by training and the Flower client.
+
+    q_proj/v_proj also match the CLIP attention layers. VISION_FEATURE_CACHE=1 keeps LoRA on the
+    language model only, so the vision tower stays frozen and its features can be cached; it
+    changes the adapter layout, so every client and the host must use the same setting.
+    """
+    if os.environ.get("VISION_FEATURE_CACHE", "0") == "1":
+        target_modules = r".*language_model.*\.(q_proj|v_proj)"
+    else:
+        target_modules = ["q_proj", "v_proj"]
+    return LoraConfig(
+        r=8,
+        lora_alpha=16,
+        target_modules=target_modules,  # Applicable aux couches du transformer
+        lora_dropout=0.1,
+        bias="none",
+        task_type="CAUSAL_LM"  # Compatible avec LLaVA
+    )
+
+def wrap_with_lora(base_model, adapter_dir: str = None):
+    """Wrap base_model with LoRA, resuming from adapter_dir when a saved adapter exists."""
+    if adapter_dir and os.path.exists(os.path.join(adapter_dir, ADAPTER_FILE)):
+        return PeftModel.from_pretrained(base_model, adapter_dir, is_trainable=True)
+    return get_peft_model(base_model, lora_config())
+
+def lora_state(model) -> Dict[str, torch.Tensor]:
+    """Adapter-only state dict, keyed as in saved adapter files, in sorted name order."""
+    state_dict = get_peft_model_state_dict(model)
+    return {key: state_dict[key] for key in sorted(state_dict)}
+
+def get_lora_arrays(model) -> List[np.ndarray]:
+    """Return the LoRA tensors as NumPy arrays in stable name order."""
+    return [tensor.detach().cpu().numpy() for tensor in lora_state(model).values()]
+
+def set_lora_arrays(model, arrays: List[np.ndarray]):
+    """Copy NumPy arrays into the LoRA tensors of model, in place."""
+    names = list(lora_state(model))
+    if len(names) != len(arrays):
+        raise ValueError(f"Expected {len(names)} LoRA tensors, got {len(arrays)}")
+    set_peft_model_state_dict(model, {name: torch.from_numpy(np.asarray(array)) for name, array in zip(names, arrays)})
+
+def load_lora_into(model, adapter_dir: str):
+    """Refresh the resident model's LoRA tensors from a saved adapter directory."""
+    set_peft_model_state_dict(model, load_file(os.path.join(adapter_dir, ADAPTER_FILE)))
@@ -0,0 +1,190 @@
+import glob
+import json
+import mmap
+import os
+import resource
+import struct
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+import torch
+from accelerate import init_empty_weights
+from transformers import AutoConfig, AutoProcessor, AutoTokenizer, LlavaForConditionalGeneration
+from lora_adapter import wrap_with_lora, load_lora_into, ADAPTER_FILE
+
+# One entry per (model_dir, dtype): every stage in the process shares the same base weights
+_BASE_MODELS = {}
+_LORA_MODELS = {}
+_PROCESSORS = {}
+_LOCK = threading.RLock()
+
+# Load time and memory per stage, filled by measure()
+STAGE_STATS = {}
+
+SAFETENSORS_TORCH_DTYPES = {
+    "F16": torch.float16, "BF16": torch.bfloat16, "F32": torch.float32, "F64": torch.float64,
+    "I8": torch.int8, "U8": torch.uint8, "I16": torch.int16, "I32": torch.int32, "I64": torch.int64,
+    "BOOL": torch.bool
+}
+
+# llava-hf checkpoints (and those saved by transformers 5.x) use the key prefixes on the left,
+# while transformers >= 4.52 nests the towers under .model; each pair is tried both ways
+# and only applied where the loaded module actually expects the renamed key
+LEGACY_KEY_RENAMES = [
+    ("language_model.model.", "model.language_model."),
+    ("language_model.lm_head.", "lm_head."),
+    ("vision_tower.", "model.vision_tower."),
+    ("multi_modal_projector.", "model.multi_modal_projector."),
+]
+
+def get_base_model(model_dir: str = "/model", torch_dtype=torch.float16, use_mmap: bool = None):
+    """Return the process-wide LLaVA base model for model_dir, loading it on first use.
+
+    With use_mmap (default on CPU-only hosts, or MODEL_MMAP=1) the weights are mapped read-only
+    from the safetensors files on the model PVC, so co-located processes share the page cache
+    instead of each materializing a private copy. Mapped weights keep the dtype they are stored
+    in: checkpoints stored in another dtype than torch_dtype (or in one safetensors cannot be
+    mapped as) are loaded and converted the regular way, with a warning.
+    """
+    if use_mmap is None:
+        use_mmap = os.environ.get("MODEL_MMAP", "1" if not torch.cuda.is_available() else "0") == "1"
+    key = (os.path.abspath(model_dir) if os.path.isdir(model_dir) else model_dir, torch_dtype)
+    with _LOCK:
+        if key not in _BASE_MODELS:
+            with measure(f"load_base_model[{'mmap' if use_mmap else 'load'}]"):
+                model = _load_mapped(model_dir, torch_dtype) if use_mmap else None
+                if model is None:
+                    model = LlavaForConditionalGeneration.from_pretrained(
+                        model_dir, torch_dtype=torch_dtype, device_map="auto"
+                    )
+            _BASE_MODELS[key] = model
+        return _BASE_MODELS[key]
+
+def get_lora_model(model_dir: str = "/model", adapter_dir: str = None, torch_dtype=torch.float16):
+    """Return the PEFT wrapper over the shared base model, refreshed from adapter_dir if it exists."""
+    with _LOCK:
+        base = get_base_model(model_dir, torch_dtype)
+        model = _LORA_MODELS.get(id(base))
+        if model is None:
+            # PEFT injects LoRA layers into the base modules, so there is one wrapper per base
+            model = _LORA_MODELS[id(base)] = wrap_with_lora(base, adapter_dir)
+        elif adapter_dir and os.path.exists(os.path.join(adapter_dir, ADAPTER_FILE)):
+            load_lora_into(model, adapter_dir)
+        return model
+
+def get_processor(model_dir: str = "/model"):
+    """Return the cached processor for model_dir."""
+    with _LOCK:
+        if ("processor", model_dir) not in _PROCESSORS:
+            _PROCESSORS[("processor", model_dir)] = AutoProcessor.from_pretrained(model_dir)
+        return _PROCESSORS[("processor", model_dir)]
+
+def get_tokenizer(model_dir: str = "/model"):
+    """Return the cached tokenizer for model_dir."""
+    with _LOCK:
+        if ("tokenizer", model_dir) not in _PROCESSORS:
+            _PROCESSORS[("tokenizer", model_dir)] = AutoTokenizer.from_pretrained(model_dir)
+        return _PROCESSORS[("tokenizer", model_dir)]
+
+def _load_mapped(model_dir: str, torch_dtype=None):
+    """Build the model without allocating weights, then point parameters at mmap'd tensors.
+
+    Returns None, after a warning, when the checkpoint cannot be mapped as torch_dtype.
+    """
+    files = sorted(glob.glob(os.path.join(model_dir, "*.safetensors")))
+    if not files:
+        warnings.warn(f"No safetensors files in {model_dir}, falling back to a regular load")
+        return None
+    headers = {path: _read_header(path) for path in files}
+    stored_names = {info["dtype"] for header, _ in headers.values() for info in header.values()}
+    unsupported = stored_names - set(SAFETENSORS_TORCH_DTYPES)
+    stored = {SAFETENSORS_TORCH_DTYPES[name] for name in stored_names - unsupported
+              if SAFETENSORS_TORCH_DTYPES[name].is_floating_point}
+    if unsupported or (torch_dtype is not None and stored != {torch_dtype}):
+        # Converting would give every process a private copy, which is what mapping avoids
+        warnings.warn(f"Cannot map {model_dir} as {torch_dtype}: it stores {sorted(stored_names)} tensors; "
+                      f"falling back to a regular load")
+        return None
+    state_dict = {}
+    for path, (header, data_start) in headers.items():
+        state_dict.update(_map_safetensors(path, header, data_start))
+    config = AutoConfig.from_pretrained(model_dir)
+    # Buffers (e.g. rotary frequencies) are still created for real; only parameters stay empty
+    with init_empty_weights(include_buffers=False):
+        model = LlavaForConditionalGeneration._from_config(config, torch_dtype=torch_dtype or next(iter(stored)))
+    state_dict = _rename_keys(state_dict, set(model.state_dict()))
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing or result.unexpected_keys:
+        # A fallback would map everything and then load it all again: fail instead
+        raise RuntimeError(f"Cannot map {model_dir}: {len(missing)} parameters missing (e.g. {missing[:3]}), "
+                           f"{len(result.unexpected_keys)} unexpected keys (e.g. {result.unexpected_keys[:3]}); "
+                           f"set MODEL_MMAP=0 for a regular load")
+    # Base weights are read-only mappings; only LoRA adapters are ever trained
+    model.requires_grad_(False)
+    return model
+
+def _rename_keys(state_dict: dict, expected: set) -> dict:
+    """Map checkpoint key names onto the module's, trying LEGACY_KEY_RENAMES in both directions."""
+    renames = LEGACY_KEY_RENAMES + [(new, old) for old, new in LEGACY_KEY_RENAMES]
+    renamed = {}
+    for name, tensor in state_dict.items():
+        if name not in expected:
+            for old, new in renames:
+                if name.startswith(old) and new + name[len(old):] in expected:
+                    name = new + name[len(old):]
+                    break
+        renamed[name] = tensor
+    return renamed
+
+def _read_header(path: str):
+    """Tensor entries of a safetensors file and the offset where their data starts."""
+    with open(path, 'rb') as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+def _map_safetensors(path: str, header: dict, data_start: int):
+    """Map every tensor of a safetensors file as a read-only, zero-copy torch tensor."""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_TORCH_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.tensor([], dtype=dtype).element_size()
+        if not count:
+            # frombuffer rejects empty ranges
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        with warnings.catch_warnings():
+            # torch warns that the buffer is not writable; the tensors are never written to
+            warnings.simplefilter("ignore", UserWarning)
+            tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextmanager
+def measure(stage: str):
+    """Record wall time and resident memory growth of a stage in STAGE_STATS."""
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = STAGE_STATS[stage] = {
+            "seconds": time.perf_counter() - start,
+            "rss_before_mb": rss_before,
+            "rss_after_mb": _rss_mb()
+        }
+        print(f"[{stage}] {stats['seconds']:.2f}s, RSS {stats['rss_before_mb']:.0f} -> {stats['rss_after_mb']:.0f} MB")
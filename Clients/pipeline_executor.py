@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+from client_mcp_server import client_tools, default_output_dir, incremental_ingest
+from model_registry import measure, STAGE_STATS
+
+# Same stages, in the same order, as the CrewAI workflow in client_workflow
+DEFAULT_STAGES = ["download_model", "fetch_data", "clean_data", "build_token_shards", "train_llava"]
+# INGEST_MODE=incremental: only posts added since the last run are fetched and cleaned
+INCREMENTAL_STAGES = ["download_model", "ingest_incremental", "build_token_shards", "train_llava"]
+
+# Stage arguments taken from the result of an earlier stage, when that stage is in the run
+STAGE_INPUTS = {"clean_data": {"input_path": "fetch_data"},
+                "build_token_shards": {"data_path": ("clean_data", "ingest_incremental")}}
+
+def default_stages():
+    return INCREMENTAL_STAGES if incremental_ingest() else DEFAULT_STAGES
+
+class PipelineExecutor:
+    """Run the client MCP tools in-process as a fixed, cached DAG.
+
+    A stage is skipped when the files it reads (and its arguments) are unchanged since its
+    last successful run and the files it writes still exist. Because everything runs in
+    one process, the model loaded by one stage is reused by the next through the registry.
+    """
+
+    def __init__(self, client_id: str, stages=None, state_path: str = None, output_dir: str = None):
+        self.client_id = client_id
+        self.stages = stages or default_stages()
+        output_dir = output_dir or default_output_dir()
+        self.tools = {tool["name"]: tool for tool in client_tools(client_id, output_dir=output_dir)}
+        self.state_path = state_path or f"{output_dir}/pipeline_state_{client_id}.json"
+        self.state = self._load_state()
+
+    def run(self, force: bool = False, stage_kwargs: dict = None):
+        """Run all stages; returns {"results": {stage: result}, "timings": {stage: seconds}}.
+
+        stage_kwargs maps a stage name to extra arguments for its tool (e.g. a training budget).
+        """
+        results, timings = {}, {}
+        for name in self.stages:
+            tool = self.tools[name]
+            kwargs = {}
+            for arg, sources in STAGE_INPUTS.get(name, {}).items():
+                for source in (sources,) if isinstance(sources, str) else sources:
+                    if source in results:
+                        kwargs[arg] = results[source]
+            kwargs.update((stage_kwargs or {}).get(name, {}))
+            cached = self.state.get(name)
+            if not force and cached and cached["key"] == self._key(tool, kwargs) \
+                    and all(os.path.exists(path) for path in tool["outputs"]):
+                results[name] = cached["result"]
+                timings[name] = 0.0
+                print(f"[{self.client_id}] {name}: inputs unchanged, skipped")
+                continue
+            with measure(f"pipeline[{name}]"):
+                results[name] = tool["function"](**kwargs)
+            timings[name] = STAGE_STATS[f"pipeline[{name}]"]["seconds"]
+            # Fingerprint after the run, so a stage that rewrites its own input (training updates
+            # the adapter) is only re-run when something else changes that input
+            self.state[name] = {"key": self._key(tool, kwargs), "result": results[name]}
+            self._save_state()
+        return {"results": results, "timings": timings}
+
+    def _key(self, tool, kwargs) -> str:
+        digest = hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode())
+        for path in tool["inputs"]:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+            else:
+                digest.update(f"{path}:missing".encode())
+        return digest.hexdigest()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, default=str)
+        os.replace(tmp_path, self.state_path)
+
+def run_direct_workflow(client_id: str, output_dir: str = None):
+    """In-process equivalent of run_client_workflow; returns the path to the LoRA weights."""
+    return PipelineExecutor(client_id, output_dir=output_dir).run()["results"]["train_llava"]
+
+if __name__ == "__main__":
+    import sys
+    print(run_direct_workflow(sys.argv[1] if len(sys.argv) > 1 else "client1"))
@@ -0,0 +1,52 @@
+import json
+import os
+import numpy as np
+
+# Binary profile layout, for a stem such as /output/profile_client1:
+#   <stem>.npy       float32 mean embedding (memory-mappable)
+#   <stem>.var.npy   float32 per-dimension variance (optional)
+#   <stem>.meta.json {"format": 1, "num_samples": ..., "dim": ..., ...}
+PROFILE_FORMAT_VERSION = 1
+
+def profile_stem(path: str) -> str:
+    for suffix in (".meta.json", ".var.npy", ".npy", ".json"):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def save_profile(stem: str, mean: np.ndarray, num_samples: int, variance: np.ndarray = None, **metadata) -> str:
+    """Write a binary profile and its JSON sidecar; returns the .npy path."""
+    os.makedirs(os.path.dirname(stem) or ".", exist_ok=True)
+    np.save(f"{stem}.npy", np.asarray(mean, dtype=np.float32))
+    if variance is not None:
+        np.save(f"{stem}.var.npy", np.asarray(variance, dtype=np.float32))
+    meta = dict(metadata, format=PROFILE_FORMAT_VERSION, num_samples=int(num_samples), dim=int(np.shape(mean)[0]),
+                has_variance=variance is not None)
+    # Sidecar last: a profile is only visible once its arrays are complete
+    tmp_path = f"{stem}.meta.json.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, f"{stem}.meta.json")
+    return f"{stem}.npy"
+
+def load_profile(path: str) -> dict:
+    """Load a profile as {"mean", "variance", "num_samples", "meta"}.
+
+    Binary profiles are memory-mapped; a .json path resolves to the binary profile with
+    the same stem when one exists, otherwise it is parsed as a legacy JSON profile.
+    """
+    stem = profile_stem(path)
+    if os.path.exists(f"{stem}.meta.json") and os.path.exists(f"{stem}.npy"):
+        with open(f"{stem}.meta.json") as f:
+            meta = json.load(f)
+        variance = np.load(f"{stem}.var.npy", mmap_mode="r") if meta.get("has_variance") else None
+        return {"mean": np.load(f"{stem}.npy", mmap_mode="r"), "variance": variance,
+                "num_samples": meta.get("num_samples", 1), "meta": meta}
+
+    # Legacy JSON profile: {"profile": [...]} or {"general_profile": [...]}
+    with open(path, 'r') as f:
+        data = json.load(f)
+    mean = np.asarray(data.get("profile", data.get("general_profile")), dtype=np.float32)
+    variance = np.asarray(data["variance"], dtype=np.float32) if "variance" in data else None
+    meta = {k: v for k, v in data.items() if k not in ("profile", "general_profile", "variance")}
+    return {"mean": mean, "variance": variance, "num_samples": data.get("num_samples", 1), "meta": meta}
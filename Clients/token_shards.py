@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+from itertools import islice
+import numpy as np
+from jsonstream import is_jsonl, iter_jsonl_from, iter_records
+from ingest_manifest import file_fingerprint
+from llava_dataset import image_url
+
+# Cleaned posts tokenized once, for training and profiling alike. Each shard of up to
+# SHARD_RECORDS posts is a set of .npy files read with mmap_mode="r", so workers share the page
+# cache instead of holding Python lists:
+#   NNNNN.tokens.npy        int32, token ids of all posts back to back
+#   NNNNN.offsets.npy       int64, start of each post in tokens (one extra entry at the end)
+#   NNNNN.images.npy        uint8, image URLs (utf-8) back to back, "" for posts without one
+#   NNNNN.image_offsets.npy int64, as offsets for images
+#   NNNNN.text_hashes.npy   uint8 (n, 32), sha256 of each post's text (embedding cache keys)
+# manifest.json records the data file and tokenizer they were built from, and the byte watermark
+# of the data file they cover. Posts appended after the watermark become new shards; any other
+# change rebuilds the shards into a temporary directory that is swapped in.
+
+SHARD_RECORDS = 50000
+TOKENIZE_BATCH = 1000
+MANIFEST = "manifest.json"
+FIELDS = ("tokens", "offsets", "images", "image_offsets", "text_hashes")
+
+def default_shard_dir(data_path: str) -> str:
+    """Shards live next to their data file (/data/cleaned_data.json -> /data/cleaned_data_tokens)."""
+    return f"{os.path.splitext(data_path)[0]}_tokens"
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    digest = hashlib.sha256(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # Fast tokenizers serialize their full vocabulary, merges, normalizer and special tokens;
+        # truncation and padding are per-call state that earlier calls leave behind
+        serialized = json.loads(backend.to_str())
+        serialized.pop("truncation", None)
+        serialized.pop("padding", None)
+        digest.update(json.dumps(serialized, sort_keys=True).encode())
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    digest.update(json.dumps(tokenizer.all_special_tokens).encode())
+    return digest.hexdigest()
+
+def _tokenizer_key(tokenizer, max_length: int) -> str:
+    return hashlib.sha256(json.dumps([max_length, tokenizer_fingerprint(tokenizer)]).encode()).hexdigest()
+
+def _fingerprint(data_path: str, tokenizer_key: str) -> str:
+    stat = os.stat(data_path)
+    return hashlib.sha256(json.dumps([os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns,
+                                      tokenizer_key]).encode()).hexdigest()
+
+def _read_manifest(shard_dir: str):
+    try:
+        with open(os.path.join(shard_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_manifest(directory: str, manifest: dict):
+    tmp = os.path.join(directory, f"{MANIFEST}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+
+def _write_shard(directory: str, index: int, token_lists, urls, hashes) -> dict:
+    lengths = np.fromiter((len(ids) for ids in token_lists), dtype=np.int64, count=len(token_lists))
+    encoded_urls = [(url or "").encode("utf-8") for url in urls]
+    arrays = {
+        "tokens": np.fromiter((token for ids in token_lists for token in ids), dtype=np.int32,
+                              count=int(lengths.sum())),
+        "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        "images": np.frombuffer(b"".join(encoded_urls), dtype=np.uint8),
+        "image_offsets": np.concatenate([[0], np.cumsum([len(url) for url in encoded_urls])]).astype(np.int64),
+        "text_hashes": np.frombuffer(b"".join(hashes), dtype=np.uint8).reshape(-1, 32)
+    }
+    for field, array in arrays.items():
+        np.save(os.path.join(directory, f"{index:05d}.{field}.npy"), array)
+    return {"index": index, "records": len(token_lists), "tokens": int(lengths.sum())}
+
+def _tokenize_shards(directory: str, records, first_index: int, tokenizer, max_length: int,
+                     shard_records: int) -> list:
+    """Tokenize records into shards numbered from first_index; returns their manifest entries."""
+    shards, token_lists, urls, hashes = [], [], [], []
+    while True:
+        chunk = list(islice(records, TOKENIZE_BATCH))
+        if chunk:
+            texts = [item["text"] for item in chunk]
+            token_lists.extend(tokenizer(texts, truncation=True, max_length=max_length)["input_ids"])
+            urls.extend(image_url(item) for item in chunk)
+            hashes.extend(hashlib.sha256(text.encode("utf-8")).digest() for text in texts)
+        while len(token_lists) >= shard_records or (not chunk and token_lists):
+            shards.append(_write_shard(directory, first_index + len(shards), token_lists[:shard_records],
+                                       urls[:shard_records], hashes[:shard_records]))
+            del token_lists[:shard_records], urls[:shard_records], hashes[:shard_records]
+        if not chunk:
+            return shards
+
+def _appendable(data_path: str, manifest: dict, tokenizer_key: str) -> bool:
+    """True if data_path only grew since the shards were built (incremental ingestion appends
+    to its JSONL output), so the posts after the recorded byte watermark can be added as new shards."""
+    data_bytes = manifest.get("data_bytes")
+    return (data_bytes is not None and manifest.get("tokenizer") == tokenizer_key
+            and manifest["data_path"] == data_path and is_jsonl(data_path)
+            and os.path.getsize(data_path) >= data_bytes
+            and file_fingerprint(data_path, data_bytes) == manifest["data_fingerprint"])
+
+def _append_shards(data_path: str, tokenizer, shard_dir: str, manifest: dict, fingerprint: str,
+                   max_length: int, shard_records: int) -> dict:
+    watermark = manifest["data_bytes"]
+
+    def records():
+        nonlocal watermark
+        for record, end in iter_jsonl_from(data_path, manifest["data_bytes"]):
+            watermark = end
+            yield record
+    # New shard files first, then the manifest that makes them visible
+    shards = _tokenize_shards(shard_dir, records(), len(manifest["shards"]), tokenizer, max_length, shard_records)
+    manifest = dict(manifest, fingerprint=fingerprint, data_bytes=watermark,
+                    data_fingerprint=file_fingerprint(data_path, watermark), shards=manifest["shards"] + shards,
+                    records=manifest["records"] + sum(shard["records"] for shard in shards),
+                    tokens=manifest["tokens"] + sum(shard["tokens"] for shard in shards))
+    _write_manifest(shard_dir, manifest)
+    print(f"Token shards: appended {sum(shard['records'] for shard in shards)} posts in {len(shards)} shards "
+          f"({shard_dir}, {manifest['records']} posts in total)")
+    return manifest
+
+def build_shards(data_path: str, tokenizer, shard_dir: str = None, max_length: int = 512,
+                 shard_records: int = SHARD_RECORDS) -> str:
+    """Tokenize data_path into memory-mapped shards, unless shards of the same data file and
+    tokenizer already exist; returns the shard directory.
+
+    Posts appended to a JSONL data file since the last build are tokenized into new shards;
+    any other change to the data file or the tokenizer rebuilds every shard.
+    """
+    shard_dir = shard_dir or default_shard_dir(data_path)
+    tokenizer_key = _tokenizer_key(tokenizer, max_length)
+    fingerprint = _fingerprint(data_path, tokenizer_key)
+    manifest = _read_manifest(shard_dir)
+    if manifest is not None and manifest["fingerprint"] == fingerprint:
+        return shard_dir
+    if manifest is not None and _appendable(data_path, manifest, tokenizer_key):
+        _append_shards(data_path, tokenizer, shard_dir, manifest, fingerprint, max_length, shard_records)
+        return shard_dir
+
+    tmp = f"{shard_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    size = os.path.getsize(data_path)
+    shards = _tokenize_shards(tmp, iter_records(data_path), 0, tokenizer, max_length, shard_records)
+    # The byte watermark for later appends, unless the file changed while it was being read
+    data_bytes = size if _fingerprint(data_path, tokenizer_key) == fingerprint else None
+    manifest = {"fingerprint": fingerprint, "data_path": data_path, "max_length": max_length,
+                "tokenizer": tokenizer_key, "data_bytes": data_bytes,
+                "data_fingerprint": file_fingerprint(data_path, data_bytes) if data_bytes is not None else None,
+                "records": sum(shard["records"] for shard in shards),
+                "tokens": sum(shard["tokens"] for shard in shards), "shards": shards}
+    _write_manifest(tmp, manifest)
+
+    # Swap the new shards in; readers of the old ones keep their mappings until they reopen
+    old = f"{shard_dir}.old-{os.getpid()}"
+    if os.path.exists(shard_dir):
+        os.replace(shard_dir, old)
+    os.replace(tmp, shard_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    print(f"Token shards: {manifest['records']} posts, {manifest['tokens']} tokens in {len(shards)} shards "
+          f"({shard_dir})")
+    return shard_dir
+
+class TokenShards:
+    """Random access to pre-tokenized posts by global index, without copying token ids.
+
+    Arrays are mapped on first use in each process; pickling (e.g. into DataLoader workers)
+    only carries the directory and manifest.
+    """
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        self.manifest = _read_manifest(shard_dir)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No token shards in {shard_dir}")
+        counts = [shard["records"] for shard in self.manifest["shards"]]
+        self.starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._arrays = None
+
+    def _open(self):
+        if self._arrays is None:
+            self._arrays = [{field: np.load(os.path.join(self.shard_dir, f"{shard['index']:05d}.{field}.npy"),
+                                            mmap_mode="r") for field in FIELDS}
+                            for shard in self.manifest["shards"]]
+        return self._arrays
+
+    def __getstate__(self):
+        return {**self.__dict__, "_arrays": None}
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def _locate(self, idx: int):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard = int(np.searchsorted(self.starts, idx, side="right")) - 1
+        return self._open()[shard], idx - int(self.starts[shard])
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """Token ids of post idx, as a read-only view into the mapped shard."""
+        arrays, local = self._locate(idx)
+        offsets = arrays["offsets"]
+        return arrays["tokens"][offsets[local]:offsets[local + 1]]
+
+    def image(self, idx: int):
+        arrays, local = self._locate(idx)
+        offsets = arrays["image_offsets"]
+        return arrays["images"][offsets[local]:offsets[local + 1]].tobytes().decode("utf-8") or None
+
+    def text_hash(self, idx: int) -> bytes:
+        arrays, local = self._locate(idx)
+        return arrays["text_hashes"][local].tobytes()
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Token count of every post, in index order."""
+        return np.concatenate([np.diff(arrays["offsets"]) for arrays in self._open()]) if len(self) \
+            else np.zeros(0, dtype=np.int64)
+
+def load_shards(data_path: str, tokenizer, shard_dir: str = None, max_length: int = 512) -> TokenShards:
+    """Shards of data_path for tokenizer, building them first if missing or stale."""
+    return TokenShards(build_shards(data_path, tokenizer, shard_dir, max_length))
+
+def shards_enabled() -> bool:
+    return os.environ.get("TOKEN_SHARDS", "1") != "0"
+
+def build_token_shards(data_path: str = "/data/cleaned_data.json", model_dir: str = "/model") -> str:
+    """Pipeline step after cleaning: shards of data_path for the model's tokenizer."""
+    from model_registry import get_tokenizer
+    return build_shards(data_path, get_tokenizer(model_dir))
@@ -0,0 +1,282 @@
+import contextvars
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Spans are written as JSONL to $TRACE_DIR/trace_<service>_<pid>.jsonl. With TRACE_DIR unset,
+# span() returns a shared no-op object, so instrumented code pays one dict lookup per call.
+# TRACE_METRICS_PORT additionally serves Prometheus text-format counters per span name.
+
+TRACE_DIR = os.environ.get("TRACE_DIR")
+SERVICE = os.environ.get("TRACE_SERVICE", os.path.basename(sys.argv[0] or "python").rsplit(".", 1)[0])
+
+_context = contextvars.ContextVar("trace_context", default={})  # tags inherited by nested spans
+_current = contextvars.ContextVar("trace_span", default=None)
+_lock = threading.Lock()
+_file = None
+_metrics = defaultdict(lambda: defaultdict(float))  # span name -> metric -> total
+
+def enabled() -> bool:
+    return TRACE_DIR is not None
+
+def configure(trace_dir: str = None, service: str = None, metrics_port: int = None):
+    """Turn tracing on (or off with trace_dir=None) at runtime, e.g. from a simulation."""
+    global TRACE_DIR, SERVICE, _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+        TRACE_DIR = trace_dir
+        SERVICE = service or SERVICE
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+def set_context(**tags):
+    """Tag every span started from here on in this thread/task (e.g. client_id, round)."""
+    return _context.set({**_context.get(), **{k: v for k, v in tags.items() if v is not None}})
+
+def reset_context(token):
+    _context.reset(token)
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+    def add(self, **counts):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Span:
+    """One timed region: wall and CPU time, memory, bytes and samples, plus context tags."""
+
+    def __init__(self, name: str, tags: dict):
+        self.name = name
+        self.fields = {**_context.get(), **tags}
+        self.counts = {}
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add(self, **counts):
+        """Accumulate counters such as samples, bytes_sent and bytes_received."""
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.span_id = uuid.uuid4().hex[:16]
+        self._token = _current.set(self)
+        torch = sys.modules.get("torch")
+        self.cuda = torch is not None and torch.cuda.is_available()
+        # Never reset the CUDA peak counter: it is process-wide, so nested or concurrent spans would
+        # clear each other's peaks. Like RSS, spans record allocated memory and the peak so far.
+        self.gpu_start = torch.cuda.memory_allocated() / 2**20 if self.cuda else None
+        self.start = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.rss_start = _rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall_start
+        record = {
+            "name": self.name,
+            "service": SERVICE,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "start": self.start,
+            "end": self.start + wall,
+            "wall_s": wall,
+            "cpu_s": time.process_time() - self.cpu_start,
+            "rss_start_mb": self.rss_start,
+            "rss_end_mb": _rss_mb(),
+            # ru_maxrss is the process peak so far (KiB on Linux)
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            **self.fields,
+            **self.counts
+        }
+        if self.cuda:
+            cuda = sys.modules["torch"].cuda
+            record["gpu_start_mb"] = self.gpu_start
+            record["gpu_end_mb"] = cuda.memory_allocated() / 2**20
+            record["peak_gpu_mb"] = cuda.max_memory_allocated() / 2**20
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        _write(record)
+        return False
+
+def span(name: str, **tags):
+    """Context manager recording a span; a no-op when tracing is off."""
+    if TRACE_DIR is None:
+        return _NOOP
+    return Span(name, tags)
+
+def traced(name: str = None, **tags):
+    """Decorator form of span()."""
+    def wrap(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if TRACE_DIR is None:
+                return fn(*args, **kwargs)
+            with Span(span_name, tags):
+                return fn(*args, **kwargs)
+        return call
+    return wrap
+
+def nbytes(arrays) -> int:
+    return int(sum(getattr(a, "nbytes", 0) for a in arrays))
+
+def _write(record: dict):
+    global _file
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        if TRACE_DIR is None:
+            return
+        if _file is None:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            _file = open(os.path.join(TRACE_DIR, f"trace_{SERVICE}_{os.getpid()}.jsonl"), 'a', buffering=1)
+        _file.write(line)
+        totals = _metrics[record["name"]]
+        totals["count"] += 1
+        totals["seconds"] += record["wall_s"]
+        totals["cpu_seconds"] += record["cpu_s"]
+        for key in ("samples", "bytes_sent", "bytes_received"):
+            totals[key] += record.get(key, 0) or 0
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return 0.0
+
+def metrics_text() -> str:
+    """Prometheus text exposition of per-span-name totals."""
+    lines = []
+    with _lock:
+        snapshot = {name: dict(totals) for name, totals in _metrics.items()}
+    for metric, help_text in (("count", "Spans recorded"), ("seconds", "Wall time in spans"),
+                              ("cpu_seconds", "CPU time in spans"), ("samples", "Samples processed"),
+                              ("bytes_sent", "Bytes sent"), ("bytes_received", "Bytes received")):
+        lines.append(f"# HELP fl_span_{metric}_total {help_text}")
+        lines.append(f"# TYPE fl_span_{metric}_total counter")
+        for name, totals in sorted(snapshot.items()):
+            lines.append(f'fl_span_{metric}_total{{span="{name}",service="{SERVICE}"}} {totals.get(metric, 0.0)}')
+    return "\n".join(lines) + "\n"
+
+def start_metrics_server(port: int):
+    """Serve /metrics from a daemon thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics_text().encode()
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if os.environ.get("TRACE_METRICS_PORT"):
+    start_metrics_server(int(os.environ["TRACE_METRICS_PORT"]))
+
+def load_spans(paths):
+    """Read spans from trace files or directories of trace files."""
+    spans = []
+    for path in paths:
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".jsonl")] \
+            if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file, 'r') as f:
+                spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+def critical_paths(spans):
+    """Per round: host work before the client fit that finished last, that fit with its stage
+    breakdown, then the host's work after it, with the time between them as "waiting" entries.
+
+    A synchronous round cannot end before its slowest client returns, so that chain bounds the
+    round; waiting before the fit starts is time the update spent queued or in transit.
+    """
+    children = defaultdict(list)
+    for s in spans:
+        children[s.get("parent_id")].append(s)
+    rounds = defaultdict(list)
+    for s in spans:
+        if s.get("round") is not None:
+            rounds[s["round"]].append(s)
+
+    summaries = []
+    for round_ in sorted(rounds, key=lambda r: (str(type(r)), r)):
+        members = rounds[round_]
+        fits = [s for s in members if s["name"] == "client.fit"]
+        host = sorted((s for s in members if s["name"].startswith("host.")), key=lambda s: s["start"])
+        start = min(s["start"] for s in members)
+        end = max(s["end"] for s in members)
+        chain = host
+        slowest = max(fits, key=lambda s: s["end"]) if fits else None
+        if slowest is not None:
+            chain = sorted([s for s in host if s["end"] <= slowest["start"] or s["start"] >= slowest["end"]]
+                           + [slowest], key=lambda s: s["start"])
+        path, cursor = [], start
+        for s in chain:
+            if s["start"] > cursor:
+                path.append({"name": "(waiting)", "wall_s": s["start"] - cursor})
+            path.append(s)
+            if s is slowest:
+                path.extend(sorted(children[s["span_id"]], key=lambda c: c["start"]))
+            cursor = max(cursor, s["end"])
+        summaries.append({
+            "round": round_,
+            "wall_s": end - start,
+            "path": path,
+            "client_fits": sorted(((s.get("client_id"), s["wall_s"], end - s["end"]) for s in fits),
+                                  key=lambda item: -item[1])
+        })
+    return summaries
+
+def print_summary(paths):
+    for summary in critical_paths(load_spans(paths)):
+        print(f"Round {summary['round']}: {summary['wall_s']:.2f}s")
+        for s in summary["path"]:
+            share = s["wall_s"] / summary["wall_s"] * 100.0 if summary["wall_s"] else 0.0
+            if "span_id" not in s:
+                print(f"  {s['name']:<28} {'':<12} {s['wall_s']:8.2f}s {share:5.1f}%")
+                continue
+            nested = s["name"] != "client.fit" and not s["name"].startswith("host.")
+            extras = ", ".join(f"{k} {s[k]:.0f}" for k in ("samples", "bytes_sent", "bytes_received") if s.get(k))
+            gpu = f"  peak GPU {s['peak_gpu_mb']:.0f} MB" if "peak_gpu_mb" in s else ""
+            print(f"{'    ' if nested else '  '}{s['name']:<{26 if nested else 28}} {s.get('client_id') or s.get('service', ''):<12} "
+                  f"{s['wall_s']:8.2f}s {share:5.1f}%  cpu {s['cpu_s']:.2f}s  peak RSS {s['peak_rss_mb']:.0f} MB"
+                  + gpu + (f"  {extras}" if extras else ""))
+        if summary["client_fits"]:
+            print("  clients (fit seconds, finished before round end): "
+                  + ", ".join(f"{cid} {wall:.2f}s/{slack:.2f}s" for cid, wall, slack in summary["client_fits"]))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize trace files: critical path of each round")
+    parser.add_argument("paths", nargs="+", help="trace .jsonl files or directories")
+    print_summary(parser.parse_args().paths)
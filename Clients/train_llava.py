@@ -1,35 +1,237 @@
 
 import torch
+import hashlib
 import json
 import os
-from transformers import LlavaForConditionalGeneration, AutoProcessor
-from peft import LoraConfig, get_peft_model
-import requests
+import shutil
+import time
+from itertools import islice
 from PIL import Image
-from io import BytesIO
 import torchvision.transforms as transforms
+from torch.utils.data import DataLoader
+from jsonstream import iter_records
+from image_cache import ImageCache
+from model_registry import get_lora_model, get_processor, get_tokenizer
+from llava_dataset import LlavaDataset, LengthBucketSampler, PadCollator, image_url
+from lora_adapter import ADAPTER_FILE, get_lora_arrays, set_lora_arrays
+from checkpoint import CheckpointWriter, latest_checkpoint, load_checkpoint
+from feature_store import FeatureStore, splice_features, vision_fingerprint, vision_frozen
+from token_shards import load_shards, shards_enabled
 
-def train_llava(data_path: str, output_dir: str, client_id: str, model_dir: str = "/model"):
-    """Fine-tune LLaVA 1.5 (7B) with LoRA on text and image data from PVC."""
-    # Load model and processor from PVC
-    processor = AutoProcessor.from_pretrained(model_dir)
-    model = LlavaForConditionalGeneration.from_pretrained(
-        model_dir, 
-        torch_dtype=torch.float16, 
-        device_map="auto"
-    )
+def train_llava(data_path: str, output_dir: str, client_id: str, model_dir: str = "/model",
+                image_cache_dir: str = "/data/image_cache", batch_size: int = 8,
+                grad_accum_steps: int = 1, num_workers: int = 4, batched: bool = True, max_samples: int = None,
+                checkpoint_steps: int = None, cache_features: bool = None,
+                feature_store_dir: str = "/data/vision_features", use_shards: bool = None):
+    """Fine-tune LLaVA 1.5 (7B) with LoRA on text and image data from PVC.
+
+    max_samples is the host's per-round budget: training covers that many samples, continuing
+    from where the previous round stopped and wrapping around the data, instead of one full pass.
+
+    Every checkpoint_steps optimizer steps (TRAIN_CHECKPOINT_STEPS, default 50, 0 disables) the
+    adapter, optimizer state and data position are checkpointed in the background. A restarted
+    pass over the same starting adapter, data and budget resumes from its latest checkpoint.
+
+    With cache_features (VISION_FEATURE_CACHE=1) and a frozen vision tower, projected image
+    features are computed once per image into feature_store_dir and fed to the language model
+    directly, so training steps skip the vision encoder forward and backward.
+
+    With use_shards (TOKEN_SHARDS, on by default) the batched path reads token ids from the
+    pre-tokenized shards of data_path (built by build_token_shards, or here if stale).
+    """
+    # Shared base model and processor from the process-wide registry; LoRA starts from the
+    # adapter the Flower client saved from the global round
+    processor = get_processor(model_dir)
+    model = get_lora_model(model_dir, f"{output_dir}/lora_weights_{client_id}")
     
-    # Configure LoRA
-    lora_config = LoraConfig(
-        r=8,
-        lora_alpha=16,
-        target_modules=["q_proj", "v_proj"],  # Applicable aux couches du transformer
-        lora_dropout=0.1,
-        bias="none",
-        task_type="CAUSAL_LM"  # Compatible avec LLaVA
-    )
-    model = get_peft_model(model, lora_config)
+    # Stream data (JSON array or JSONL) instead of loading it whole
+    data = iter_records(data_path)
+    if use_shards is None:
+        use_shards = shards_enabled()
+    shards = load_shards(data_path, get_tokenizer(model_dir)) if batched and use_shards else None
     
+    stats_path = f"{output_dir}/train_stats_{client_id}.json"
+    model.train()
+    if cache_features is None:
+        cache_features = os.environ.get("VISION_FEATURE_CACHE", "0") == "1"
+    features = None
+    if cache_features and batched:
+        if vision_frozen(model):
+            features = FeatureStore(feature_store_dir, vision_fingerprint(model_dir, model))
+        else:
+            # e.g. an adapter saved before VISION_FEATURE_CACHE was set still adapts CLIP layers
+            print(f"Training ({client_id}): LoRA adapts the vision tower, not caching image features")
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    if batched:
+        if checkpoint_steps is None:
+            checkpoint_steps = int(os.environ.get("TRAIN_CHECKPOINT_STEPS", 50))
+        checkpoint_dir = f"{output_dir}/checkpoints/{client_id}"
+        adapter_dir = f"{output_dir}/lora_weights_{client_id}"
+        if not os.path.exists(os.path.join(adapter_dir, ADAPTER_FILE)):
+            # A fresh LoRA init is random: persist it so a restarted pass starts from the same one
+            model.save_pretrained(adapter_dir)
+        run = {"run_key": _run_key(model, data_path, max_samples, batch_size, grad_accum_steps)}
+        resume = _resume_point(checkpoint_dir, run["run_key"])
+        if resume is not None:
+            arrays, state, optimizer_state = resume
+            set_lora_arrays(model, arrays)
+            if optimizer_state is not None:
+                optimizer.load_state_dict(optimizer_state)
+            print(f"Training ({client_id}): resuming at batch {state['batch']} from {checkpoint_dir}")
+        else:
+            # Checkpoints of an earlier pass cannot be resumed any more
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            state = {"cursor": _last_cursor(stats_path), "batch": 0}
+        writer = CheckpointWriter(checkpoint_dir) if checkpoint_steps else None
+
+        def checkpoint(progress: dict):
+            writer.save(progress["batch"], get_lora_arrays(model), {**run, **progress}, optimizer.state_dict())
+
+        if state.get("complete"):
+            stats = state["stats"]
+        else:
+            stats = _train_batched(model, processor, optimizer, data, image_cache_dir,
+                                   batch_size, grad_accum_steps, num_workers,
+                                   max_samples=max_samples, cursor=state["cursor"], resume=state,
+                                   checkpoint=checkpoint if writer else None, checkpoint_steps=checkpoint_steps,
+                                   features=features, shards=shards)
+            if writer:
+                # The finished pass is checkpointed too, so a crash before the round is reported
+                # does not retrain it
+                writer.save(stats["batches"], get_lora_arrays(model),
+                            {**run, "cursor": state["cursor"], "batch": stats["batches"], "complete": True,
+                             "stats": stats})
+        if writer:
+            writer.close()
+        if features is not None:
+            features.close()
+    else:
+        stats = _train_per_sample(model, processor, optimizer, islice(data, max_samples), image_cache_dir)
+    stats["max_samples"] = max_samples
+    print(f"Training ({client_id}): {stats['samples']} samples, {stats['samples_per_sec']:.2f} samples/sec, "
+          f"{stats['tokens_per_sec']:.0f} tokens/sec")
+    
+    # Save LoRA weights and throughput stats
+    os.makedirs(output_dir, exist_ok=True)
+    model.save_pretrained(f"{output_dir}/lora_weights_{client_id}")
+    with open(stats_path, 'w') as f:
+        json.dump(stats, f)
+    return f"{output_dir}/lora_weights_{client_id}"
+
+def _run_key(model, data_path: str, max_samples: int, batch_size: int, grad_accum_steps: int) -> str:
+    """Identify a training pass: starting adapter weights, data file and batching settings."""
+    digest = hashlib.sha256()
+    for array in get_lora_arrays(model):
+        digest.update(array.tobytes())
+    stat = os.stat(data_path)
+    digest.update(json.dumps([data_path, stat.st_size, stat.st_mtime_ns, max_samples, batch_size,
+                              grad_accum_steps]).encode())
+    return digest.hexdigest()
+
+def _resume_point(checkpoint_dir: str, run_key: str):
+    """(arrays, state, optimizer state) of the latest valid checkpoint of this pass, or None."""
+    path = latest_checkpoint(checkpoint_dir)
+    if path is None:
+        return None
+    arrays, state, optimizer_state = load_checkpoint(path)
+    return (arrays, state, optimizer_state) if state.get("run_key") == run_key else None
+
+def _train_batched(model, processor, optimizer, data, image_cache_dir: str,
+                   batch_size: int, grad_accum_steps: int, num_workers: int, max_length: int = 512,
+                   max_samples: int = None, cursor: int = 0, resume: dict = None, checkpoint=None,
+                   checkpoint_steps: int = 50, features: FeatureStore = None, shards=None):
+    """Train on length-bucketed, dynamically padded micro-batches with gradient accumulation.
+
+    resume is the state of a checkpoint of this same pass: the batches it covered are skipped
+    and its counters carried over. checkpoint(progress) is called every checkpoint_steps
+    optimizer steps with the data position and counters so far. With features, image features
+    come from that store (filled here for images it lacks) instead of the vision tower. With
+    shards (token_shards.TokenShards of data), samples are shard indices and data is not read.
+    """
+    resume = resume or {}
+    if shards is not None:
+        dataset_size = len(shards)
+        records, next_cursor = _rotating_window(range(dataset_size), max_samples, cursor)
+        urls = [shards.image(index) for index in records]
+    else:
+        records = list(data)
+        dataset_size = len(records)
+        records, next_cursor = _rotating_window(records, max_samples, cursor)
+        urls = [image_url(item) for item in records]
+    # Download images with the threaded prefetcher so workers only read the cache
+    image_cache = ImageCache(cache_dir=image_cache_dir)
+    image_cache.warm(urls)
+    feature_view = None
+    if features is not None:
+        added = features.warm(model, processor.image_processor, image_cache, urls)
+        print(f"Feature store: {added} images encoded, {len(features)} cached")
+        feature_view = features.view([image_cache.lookup(url) if url else None for url in urls])
+
+    dataset = LlavaDataset(records, processor, image_cache_dir, max_length, features=feature_view, shards=shards)
+    tokenizer = processor.tokenizer
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    first_batch = resume.get("batch", 0)
+    loader = DataLoader(
+        dataset,
+        batch_sampler=LengthBucketSampler(dataset.lengths, batch_size, start=first_batch),
+        collate_fn=PadCollator(pad_token_id, dataset.image_token_id),
+        num_workers=num_workers,
+        pin_memory=torch.cuda.is_available()
+    )
+
+    samples, tokens, pending, steps = resume.get("samples", 0), resume.get("tokens", 0), 0, 0
+    start = time.perf_counter() - resume.get("seconds", 0.0)
+    optimizer.zero_grad()
+    for batch_index, batch in enumerate(loader, start=first_batch + 1):
+        try:
+            batch = {k: v.to(model.device, non_blocking=True) for k, v in batch.items()}
+            if "pixel_values" in batch:
+                batch["pixel_values"] = batch["pixel_values"].to(model.dtype)
+            if "image_features" in batch:
+                batch["inputs_embeds"] = splice_features(model, batch["input_ids"], batch.pop("image_features"),
+                                                         dataset.image_token_id)
+                del batch["input_ids"]
+            # Scale so accumulated gradients match one large batch
+            loss = model(**batch).loss / grad_accum_steps
+            loss.backward()
+        except Exception as e:
+            print(f"Erreur lors du traitement du lot: {e}")
+            continue
+        samples += batch["attention_mask"].shape[0]
+        tokens += int(batch["attention_mask"].sum())
+        pending += 1
+        if pending == grad_accum_steps:
+            optimizer.step()
+            optimizer.zero_grad()
+            pending = 0
+            steps += 1
+            if checkpoint is not None and steps % checkpoint_steps == 0:
+                checkpoint({"cursor": cursor, "batch": batch_index, "samples": samples,
+                            "tokens": tokens, "seconds": time.perf_counter() - start})
+    if pending:
+        optimizer.step()
+        optimizer.zero_grad()
+    stats = _throughput(samples, tokens, time.perf_counter() - start)
+    stats.update(dataset_size=dataset_size, cursor=next_cursor, batches=first_batch + len(loader))
+    return stats
+
+def _rotating_window(records, max_samples: int, cursor: int):
+    """Take max_samples records starting at cursor, wrapping around; returns (records, next cursor)."""
+    if not max_samples or not records:
+        return records, 0
+    start = cursor % len(records)
+    window = [records[(start + i) % len(records)] for i in range(max_samples)]
+    return window, (start + max_samples) % len(records)
+
+def _last_cursor(stats_path: str) -> int:
+    try:
+        with open(stats_path, 'r') as f:
+            return json.load(f).get("cursor", 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _train_per_sample(model, processor, optimizer, data, image_cache_dir: str):
+    """Original batch-size-1 loop, kept for comparison with the batched path."""
     # Image preprocessing
     transform = transforms.Compose([
         transforms.Resize((224, 224)),  # Redimensionner pour CLIP-ViT
@@ -37,22 +239,18 @@ def train_llava(data_path: str, output_dir: str, client_id: str, model_dir: str
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
     ])
     
-    # Load and preprocess data
-    with open(data_path, 'r') as f:
-        data = json.load(f)
-    
-    # Dummy training loop (simplified for demo)
-    model.train()
-    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
-    for item in data:
+    samples, tokens = 0, 0
+    start = time.perf_counter()
+    # Images come from the persistent cache, downloaded ahead of the training loop
+    image_cache = ImageCache(cache_dir=image_cache_dir)
+    for item, image_array in image_cache.prefetch(data, url_of=image_url):
         try:
             # Préparer le texte
             text = item["text"]
             
-            # Télécharger et prétraiter l'image depuis image_url
-            if "image_url" in item and item["image_url"]:
-                response = requests.get(item["image_url"])
-                image = Image.open(BytesIO(response.content)).convert("RGB")
+            # Image déjà décodée et redimensionnée (224x224) par le cache
+            if image_array is not None:
+                image = Image.fromarray(image_array)
                 image_tensor = transform(image).to(model.device)
             else:
                 # Si pas d'image, utiliser un placeholder ou sauter
@@ -74,14 +272,21 @@ def train_llava(data_path: str, output_dir: str, client_id: str, model_dir: str
             loss.backward()
             optimizer.step()
             optimizer.zero_grad()
+            samples += 1
+            tokens += inputs["input_ids"].shape[-1]
         except Exception as e:
             print(f"Erreur lors du traitement de l'élément {item}: {e}")
             continue
-    
-    # Save LoRA weights
-    os.makedirs(output_dir, exist_ok=True)
-    model.save_pretrained(f"{output_dir}/lora_weights_{client_id}")
-    return f"{output_dir}/lora_weights_{client_id}"
+    return _throughput(samples, tokens, time.perf_counter() - start)
+
+def _throughput(samples: int, tokens: int, seconds: float):
+    return {
+        "samples": samples,
+        "tokens": tokens,
+        "seconds": seconds,
+        "samples_per_sec": samples / seconds if seconds else 0.0,
+        "tokens_per_sec": tokens / seconds if seconds else 0.0
+    }
 
 if __name__ == "__main__":
     import sys
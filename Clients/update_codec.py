@@ -0,0 +1,125 @@
+import math
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+# Wire format (a flat list of ndarrays, so it travels through Flower's NumPyClient unchanged):
+#   [header, then per tensor: scale, (indices if top-k), values]
+#   header = int64 [CODEC_MAGIC, n_tensors, quantization code, top-k flag]
+# Tensors carry round-over-round deltas against the global parameters the client received.
+CODEC_MAGIC = 0x4C4F5241  # "LORA"
+QUANTIZATIONS = {"none": 0, "fp16": 1, "int8": 2}
+
+class UpdateCodec:
+    """Delta codec with optional fp16/int8 quantization and top-k sparsification.
+
+    Specs are "<quantization>[:<top-k fraction>]", e.g. "int8", "fp16:0.05" or "none:0.01".
+    An empty spec or "dense" means no codec: absolute weights are sent as before.
+    """
+
+    def __init__(self, quantization: str = "int8", topk: float = None):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {sorted(QUANTIZATIONS)}")
+        if topk is not None and not 0.0 < topk <= 1.0:
+            raise ValueError(f"Top-k fraction must be in (0, 1], got {topk}")
+        self.quantization = quantization
+        self.topk = topk
+
+    @classmethod
+    def from_spec(cls, spec: str):
+        """Build a codec from a deployment spec string; returns None for the dense path."""
+        spec = (spec or "").strip().lower()
+        if spec in ("", "dense"):
+            return None
+        quantization, _, topk = spec.partition(":")
+        return cls(quantization or "none", float(topk) if topk else None)
+
+    @property
+    def spec(self) -> str:
+        return self.quantization + (f":{self.topk}" if self.topk else "")
+
+    def encode(self, deltas: List[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Encode float deltas; returns (payload, what the receiver will decode them to)."""
+        header = np.array([CODEC_MAGIC, len(deltas), QUANTIZATIONS[self.quantization], int(bool(self.topk))], dtype=np.int64)
+        payload, decoded = [header], []
+        for delta in deltas:
+            flat = np.asarray(delta, dtype=np.float32).ravel()
+            if self.topk:
+                k = max(1, math.ceil(self.topk * flat.size))
+                indices = np.sort(np.argpartition(np.abs(flat), -k)[-k:]).astype(np.int32) if k < flat.size \
+                    else np.arange(flat.size, dtype=np.int32)
+                values = flat[indices]
+            else:
+                indices, values = None, flat
+            scale, quantized = _quantize(values, self.quantization)
+            payload.append(np.array([scale], dtype=np.float32))
+            if indices is not None:
+                payload.append(indices)
+            payload.append(quantized)
+            decoded.append(_scatter(_dequantize(quantized, scale), indices, delta.shape))
+        return payload, decoded
+
+def is_encoded(payload: List[np.ndarray]) -> bool:
+    """True if payload was produced by UpdateCodec.encode."""
+    return bool(payload) and payload[0].dtype == np.int64 and payload[0].shape == (4,) and payload[0][0] == CODEC_MAGIC
+
+def decode(payload: List[np.ndarray], reference: List[np.ndarray]) -> List[np.ndarray]:
+    """Decode a payload into absolute float32 weights, given the reference it is a delta against."""
+    _, n_tensors, _, sparse = (int(x) for x in payload[0])
+    if n_tensors != len(reference):
+        raise ValueError(f"Payload has {n_tensors} tensors, reference has {len(reference)}")
+    weights, pos = [], 1
+    for ref in reference:
+        scale = float(payload[pos][0])
+        indices = payload[pos + 1] if sparse else None
+        quantized = payload[pos + 1 + sparse]
+        pos += 2 + sparse
+        delta = _scatter(_dequantize(quantized, scale), indices, ref.shape)
+        weights.append(np.asarray(ref, dtype=np.float32) + delta)
+    return weights
+
+class UpdateEncoder:
+    """Client-side encoder that keeps an error-feedback residual across rounds."""
+
+    def __init__(self, codec: UpdateCodec):
+        self.codec = codec
+        self.residual = None
+
+    def encode(self, weights: List[np.ndarray], reference: List[np.ndarray]) -> Tuple[List[np.ndarray], Dict]:
+        """Encode weights - reference plus the carried residual; returns (payload, metrics)."""
+        start = time.perf_counter()
+        deltas = [np.asarray(w, dtype=np.float32) - np.asarray(r, dtype=np.float32) for w, r in zip(weights, reference)]
+        if self.residual is not None and [r.shape for r in self.residual] == [d.shape for d in deltas]:
+            deltas = [d + r for d, r in zip(deltas, self.residual)]
+        payload, decoded = self.codec.encode(deltas)
+        # Whatever compression dropped this round is added back next round
+        self.residual = [d - s for d, s in zip(deltas, decoded)]
+        encode_seconds = time.perf_counter() - start
+
+        dense_bytes = sum(np.asarray(w).nbytes for w in weights)
+        encoded_bytes = sum(a.nbytes for a in payload)
+        return payload, {
+            "codec": self.codec.spec,
+            "codec_ratio": dense_bytes / encoded_bytes if encoded_bytes else 0.0,
+            "encode_ms": encode_seconds * 1000.0
+        }
+
+def _quantize(values: np.ndarray, quantization: str) -> Tuple[float, np.ndarray]:
+    if quantization == "int8":
+        peak = float(np.max(np.abs(values))) if values.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return scale, np.clip(np.rint(values / scale), -127, 127).astype(np.int8)
+    if quantization == "fp16":
+        return 1.0, values.astype(np.float16)
+    return 1.0, values.astype(np.float32)
+
+def _dequantize(quantized: np.ndarray, scale: float) -> np.ndarray:
+    values = quantized.astype(np.float32)
+    return values * scale if quantized.dtype == np.int8 else values
+
+def _scatter(values: np.ndarray, indices, shape) -> np.ndarray:
+    if indices is None:
+        return values.reshape(shape)
+    dense = np.zeros(int(np.prod(shape)), dtype=np.float32)
+    dense[indices] = values
+    return dense.reshape(shape)
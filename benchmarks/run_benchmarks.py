@@ -0,0 +1,261 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# End-to-end benchmark suite: every pipeline stage on synthetic data and a tiny CPU LLaVA.
+# Each benchmark runs in its own spawned process, so peak RSS is per stage and no model or
+# cache state leaks between stages. Results are JSON; --baseline flags regressions against a
+# reference run such as the committed benchmarks/baseline.json.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "Clients"), os.path.join(ROOT, "host"), os.path.dirname(os.path.abspath(__file__))]
+
+BENCHMARKS = {}
+
+def benchmark(name: str, unit: str):
+    """Register fn(options, workdir) -> (per-repeat latencies in seconds, items per repeat)."""
+    def register(fn):
+        BENCHMARKS[name] = (fn, unit)
+        return fn
+    return register
+
+def _repeat(fn, repeats: int, warmup: int = 0):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def _tiny_model(workdir: str) -> str:
+    from synthetic import make_tiny_model
+    return make_tiny_model(os.path.join(workdir, "model"))
+
+def _cleaned_data(workdir: str, num_posts: int) -> str:
+    from synthetic import make_synthetic_data
+    return make_synthetic_data(os.path.join(workdir, "cleaned.jsonl"), num_posts)
+
+def _export(options, workdir: str) -> str:
+    from synthetic import make_facebook_export
+    return make_facebook_export(os.path.join(workdir, "raw_facebook_data.json"), options["posts"])
+
+def _count(path: str) -> int:
+    from jsonstream import iter_records
+    return sum(1 for _ in iter_records(path))
+
+@benchmark("fetch_data", "records")
+def bench_fetch_data(options, workdir):
+    from fetch_data import fetch_data
+    raw = _export(options, workdir)
+    return _repeat(lambda: fetch_data(raw, os.path.join(workdir, "fetched.json")), options["repeats"]), options["posts"]
+
+@benchmark("clean_data", "records")
+def bench_clean_data(options, workdir):
+    from fetch_data import fetch_data
+    from clean_data import clean_data
+    fetched = fetch_data(_export(options, workdir), os.path.join(workdir, "fetched.json"))
+    return _repeat(lambda: clean_data(fetched, os.path.join(workdir, "cleaned.json")), options["repeats"]), _count(fetched)
+
+@benchmark("clean_data_parallel", "records")
+def bench_clean_data_parallel(options, workdir):
+    from fetch_data import fetch_data
+    from clean_data import clean_data_parallel
+    fetched = fetch_data(_export(options, workdir), os.path.join(workdir, "fetched.json"))
+    return _repeat(lambda: clean_data_parallel(fetched, os.path.join(workdir, "cleaned.json")),
+                   options["repeats"]), _count(fetched)
+
+@benchmark("ingest_data", "records")
+def bench_ingest_data(options, workdir):
+    from ingest_data import ingest_data
+    raw = _export(options, workdir)
+    return _repeat(lambda: ingest_data(raw, os.path.join(workdir, "cleaned.jsonl")), options["repeats"]), options["posts"]
+
+@benchmark("train_llava", "samples")
+def bench_train_llava(options, workdir):
+    from train_llava import train_llava
+    model_dir, data = _tiny_model(workdir), _cleaned_data(workdir, options["samples"])
+    run = lambda: train_llava(data, os.path.join(workdir, "output"), "bench", model_dir=model_dir,
+                              image_cache_dir=os.path.join(workdir, "image_cache"), batch_size=8, num_workers=0)
+    return _repeat(run, options["repeats"], warmup=1), options["samples"]
+
+@benchmark("generate_profile", "samples")
+def bench_generate_profile(options, workdir):
+    from generate_profile import generate_profile
+    model_dir, data = _tiny_model(workdir), _cleaned_data(workdir, options["samples"])
+    runs = iter(range(10**6))
+    # A fresh output directory per run, so nothing is resumed and no embedding is cached
+    run = lambda: generate_profile(data, model_dir, os.path.join(workdir, f"profile_{next(runs)}"), "bench",
+                                   cache_dir=None)
+    return _repeat(run, options["repeats"], warmup=1), options["samples"]
+
+def _client(workdir: str):
+    from flower_client import LLaVAClient
+    return LLaVAClient("bench", _tiny_model(workdir), os.path.join(workdir, "output"))
+
+@benchmark("client_get_parameters", "calls")
+def bench_client_get_parameters(options, workdir):
+    client = _client(workdir)
+    return _repeat(lambda: client.get_parameters({}), options["calls"], warmup=1), 1
+
+@benchmark("client_set_parameters", "calls")
+def bench_client_set_parameters(options, workdir):
+    client = _client(workdir)
+    params = client.get_parameters({})
+    return _repeat(lambda: client.set_parameters(params), options["calls"], warmup=1), 1
+
+@benchmark("host_aggregate", "clients")
+def bench_host_aggregate(options, workdir):
+    from mcp_host import MCPHost
+    from synthetic import lora_shapes, make_lora_arrays
+    shapes = lora_shapes(options["lora_layers"])
+    results = [(make_lora_arrays(shapes, seed), 100 + seed) for seed in range(options["clients"])]
+    host = MCPHost(output_dir=os.path.join(workdir, "output"))
+    return _repeat(lambda: host.aggregate(results), options["repeats"]), options["clients"]
+
+@benchmark("aggregate_models", "clients")
+def bench_aggregate_models(options, workdir):
+    from aggregator import aggregate_models
+    from synthetic import lora_shapes, make_adapter_dir
+    shapes = lora_shapes(options["lora_layers"])
+    paths = [make_adapter_dir(os.path.join(workdir, f"lora_weights_client{i}"), shapes, seed=i)
+             for i in range(options["clients"])]
+    return _repeat(lambda: aggregate_models(paths, os.path.join(workdir, "global")), options["repeats"]), options["clients"]
+
+@benchmark("fuse_profiles", "profiles")
+def bench_fuse_profiles(options, workdir):
+    from fuse_profiles import fuse_profiles
+    from synthetic import make_profile
+    paths = [make_profile(os.path.join(workdir, f"profile_client{i}"), seed=i) for i in range(options["clients"])]
+    return _repeat(lambda: fuse_profiles(paths, os.path.join(workdir, "general")), options["repeats"]), options["clients"]
+
+def _run_one(name: str, options: dict, conn):
+    """Child process: run one benchmark and send back its summary."""
+    fn, unit = BENCHMARKS[name]
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        latencies, items = fn(options, workdir)
+        latencies = np.array(latencies)
+        conn.send({
+            "unit": unit,
+            "repeats": len(latencies),
+            "items_per_repeat": items,
+            "throughput_per_sec": items * len(latencies) / float(latencies.sum()),
+            "latency_ms": {
+                "p50": float(np.percentile(latencies, 50) * 1000.0),
+                "p90": float(np.percentile(latencies, 90) * 1000.0),
+                "p99": float(np.percentile(latencies, 99) * 1000.0),
+                "mean": float(latencies.mean() * 1000.0)
+            },
+            # ru_maxrss is in KiB on Linux; children are worker pools such as clean_data_parallel's
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        })
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_benchmarks(names=None, **options) -> dict:
+    """Run the selected benchmarks (all by default), each in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in names or BENCHMARKS:
+        parent, child = context.Pipe(duplex=False)
+        process = context.Process(target=_run_one, args=(name, options, child))
+        process.start()
+        child.close()
+        try:
+            results[name] = parent.recv()
+        except EOFError:
+            results[name] = None
+        process.join()
+        if results[name] is None:
+            results[name] = {"error": f"benchmark process exited with code {process.exitcode}"}
+        summary = results[name]
+        if "error" in summary:
+            print(f"{name:>24}: FAILED {summary['error']}")
+        else:
+            print(f"{name:>24}: {summary['throughput_per_sec']:10.1f} {summary['unit']}/s, "
+                  f"p50 {summary['latency_ms']['p50']:9.2f} ms, p99 {summary['latency_ms']['p99']:9.2f} ms, "
+                  f"peak RSS {summary['peak_rss_mb']:7.0f} MB")
+    return {"meta": _meta(options), "benchmarks": results}
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.15, rss_tolerance: float = 0.10) -> list:
+    """Regressions of report against baseline: lower throughput, higher p50 latency or peak RSS."""
+    regressions = []
+    for name, current in report["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous or "error" in previous or "error" in current:
+            continue
+        checks = [
+            ("throughput_per_sec", current["throughput_per_sec"], previous["throughput_per_sec"], -tolerance),
+            ("latency_ms.p50", current["latency_ms"]["p50"], previous["latency_ms"]["p50"], tolerance),
+            ("peak_rss_mb", current["peak_rss_mb"], previous["peak_rss_mb"], rss_tolerance)
+        ]
+        for metric, value, reference, allowed in checks:
+            change = (value - reference) / reference if reference else 0.0
+            if (allowed < 0 and change < allowed) or (allowed > 0 and change > allowed):
+                regressions.append({"benchmark": name, "metric": metric, "baseline": reference,
+                                    "current": value, "change": change})
+    return regressions
+
+def _meta(options: dict) -> dict:
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+        "options": options
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the pipeline benchmark suite (offline, CPU)")
+    parser.add_argument("--only", default="", help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--posts", type=int, default=20000, help="posts in the synthetic Facebook export")
+    parser.add_argument("--samples", type=int, default=64, help="samples for train_llava and generate_profile")
+    parser.add_argument("--clients", type=int, default=8, help="clients for aggregation and profile fusion")
+    parser.add_argument("--lora-layers", type=int, default=32, help="decoder layers of the synthetic LoRA adapters")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=50, help="repeats for the per-call client benchmarks")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results.json"))
+    parser.add_argument("--baseline", help="baseline results JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results to this baseline path")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed throughput/latency change")
+    parser.add_argument("--rss-tolerance", type=float, default=0.10, help="allowed peak RSS growth")
+    args = parser.parse_args()
+
+    names = [name for name in args.only.split(",") if name] or None
+    unknown = set(names or []) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    report = run_benchmarks(names, posts=args.posts, samples=args.samples, clients=args.clients,
+                            lora_layers=args.lora_layers, repeats=args.repeats, calls=args.calls)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance, args.rss_tolerance)
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression['benchmark']} {regression['metric']}: {regression['baseline']:.2f} -> "
+                  f"{regression['current']:.2f} ({regression['change']:+.0%})")
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report.get("regressions") else 0)
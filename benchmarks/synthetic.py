@@ -0,0 +1,125 @@
+import json
+import os
+import random
+import numpy as np
+
+# Synthetic inputs for the benchmark suite and the FL simulation: raw Facebook exports, cleaned
+# posts, a tiny LLaVA, LoRA adapters and profiles.
+# Everything is generated locally and deterministically from a seed, so benchmarks run offline.
+
+WORDS = ["promo", "summer", "sale", "new", "photo", "today", "love", "team", "event", "city",
+         "great", "food", "travel", "music", "live", "weekend", "launch", "thanks", "family", "night"]
+
+def make_facebook_export(path: str, num_posts: int, seed: int = 0, jsonl: bool = None,
+                         missing_rate: float = 0.05) -> str:
+    """Write a raw Facebook Graph-style export with the noise clean_data has to handle.
+
+    Posts mix URLs, hashtags, mentions, emoji and runs of whitespace; a small fraction lacks
+    a message or picture, and field names vary ("message"/"text", "full_picture"/"image_url").
+    """
+    rng = random.Random(seed)
+    jsonl = path.endswith(".jsonl") if jsonl is None else jsonl
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        if not jsonl:
+            f.write("[")
+        for i in range(num_posts):
+            record = _post(rng, i, missing_rate)
+            line = json.dumps(record, ensure_ascii=False)
+            f.write(line + "\n" if jsonl else ("," if i else "") + "\n" + line)
+        if not jsonl:
+            f.write("\n]\n")
+    return path
+
+def _post(rng: random.Random, i: int, missing_rate: float) -> dict:
+    parts = []
+    for _ in range(rng.randint(5, 60)):
+        roll = rng.random()
+        if roll < 0.05:
+            parts.append(f"https://example.com/{rng.randrange(10**6)}?ref=fb")
+        elif roll < 0.10:
+            parts.append(f"#{rng.choice(WORDS)}")
+        elif roll < 0.14:
+            parts.append(f"@user{rng.randrange(1000)}")
+        elif roll < 0.16:
+            parts.append(rng.choice(["🔥", "😀", "👍", "!!!", "…"]))
+        else:
+            parts.append(rng.choice(WORDS))
+    record = {"post_id": f"{rng.randrange(10**9)}_{i}", "created_time": "2024-06-01T12:00:00+0000"}
+    text_key, image_key = ("message", "full_picture") if rng.random() < 0.8 else ("text", "image_url")
+    if rng.random() >= missing_rate:
+        record[text_key] = rng.choice([" ", "  ", "\n"]).join(parts)
+    if rng.random() >= missing_rate:
+        record[image_key] = f"https://scontent.example.com/{i}.jpg"
+    return record
+
+def lora_shapes(num_layers: int = 32, hidden: int = 4096, rank: int = 8):
+    """Tensor names and shapes of a LLaVA-7B LoRA adapter (q_proj and v_proj, as in lora_config)."""
+    specs = []
+    for layer in range(num_layers):
+        for proj in ("q_proj", "v_proj"):
+            prefix = f"base_model.model.language_model.model.layers.{layer}.self_attn.{proj}"
+            specs.append((f"{prefix}.lora_A.weight", (rank, hidden)))
+            specs.append((f"{prefix}.lora_B.weight", (hidden, rank)))
+    return sorted(specs)
+
+def make_lora_arrays(shapes, seed: int = 0, dtype=np.float32):
+    rng = np.random.default_rng(seed)
+    return [rng.normal(0, 0.02, shape).astype(dtype) for _, shape in shapes]
+
+def make_adapter_dir(adapter_dir: str, shapes, seed: int = 0) -> str:
+    """Write a PEFT adapter directory (safetensors + config) with random LoRA weights."""
+    from adapter_io import ADAPTER_CONFIG, save_adapter_arrays
+    save_adapter_arrays(adapter_dir, [name for name, _ in shapes], make_lora_arrays(shapes, seed))
+    with open(os.path.join(adapter_dir, ADAPTER_CONFIG), 'w') as f:
+        json.dump({"peft_type": "LORA", "r": 8, "lora_alpha": 16, "target_modules": ["q_proj", "v_proj"]}, f)
+    return adapter_dir
+
+def make_profile(stem: str, dim: int = 4096, num_samples: int = 1000, seed: int = 0) -> str:
+    from profile_io import save_profile
+    rng = np.random.default_rng(seed)
+    return save_profile(stem, rng.normal(0, 1, dim), num_samples, variance=rng.random(dim))
+
+# Vocabulary of the tiny model and its synthetic cleaned posts
+TOKENS = [f"w{i}" for i in range(200)]
+
+def make_tiny_model(model_dir: str, seed: int = 0) -> str:
+    """Save a randomly initialized two-layer LLaVA (CLIP + Llama) with a word-level tokenizer.
+
+    Weights are stored in float16, the dtype the registry loads by default, so they can be mapped.
+    """
+    if os.path.exists(os.path.join(model_dir, "config.json")):
+        return model_dir
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import (CLIPImageProcessor, CLIPVisionConfig, LlamaConfig, LlavaConfig,
+                              LlavaForConditionalGeneration, LlavaProcessor, PreTrainedTokenizerFast)
+    vocab = {token: i for i, token in enumerate(["<unk>", "<s>", "</s>", "<pad>", "<image>"] + TOKENS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(single="<s> $A", special_tokens=[("<s>", 1)])
+    processor = LlavaProcessor(
+        image_processor=CLIPImageProcessor(size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32}),
+        tokenizer=PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="<unk>", bos_token="<s>",
+                                          eos_token="</s>", pad_token="<pad>", additional_special_tokens=["<image>"]),
+        patch_size=16, vision_feature_select_strategy="default", num_additional_image_tokens=1
+    )
+    config = LlavaConfig(
+        vision_config=CLIPVisionConfig(hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                       num_attention_heads=2, image_size=32, patch_size=16),
+        text_config=LlamaConfig(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=2,
+                                num_key_value_heads=2, vocab_size=len(vocab)),
+        image_token_index=vocab["<image>"], vision_feature_layer=-1
+    )
+    torch.manual_seed(seed)
+    LlavaForConditionalGeneration(config).half().save_pretrained(model_dir)
+    processor.save_pretrained(model_dir)
+    return model_dir
+
+def make_synthetic_data(path: str, num_posts: int, seed: int = 0, max_words: int = 48) -> str:
+    """Write text-only cleaned posts with random lengths, as produced by clean_data."""
+    from jsonstream import write_records
+    rng = random.Random(seed)
+    write_records(({"post_id": str(i), "text": " ".join(rng.choices(TOKENS, k=rng.randint(4, max_words))),
+                    "image": None, "platform": "synthetic"} for i in range(num_posts)), path)
+    return path
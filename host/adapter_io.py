@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import struct
+import numpy as np
+from typing import List, Tuple
+from safetensors.numpy import load_file, save_file
+
+ADAPTER_FILE = "adapter_model.safetensors"
+ADAPTER_CONFIG = "adapter_config.json"
+
+def has_adapter(adapter_dir: str) -> bool:
+    return os.path.exists(os.path.join(adapter_dir, ADAPTER_FILE))
+
+def load_adapter_arrays(adapter_dir: str) -> Tuple[List[str], List[np.ndarray]]:
+    """Load LoRA tensors from a PEFT adapter directory, in sorted name order."""
+    tensors = load_file(os.path.join(adapter_dir, ADAPTER_FILE))
+    names = sorted(tensors)
+    return names, [tensors[name] for name in names]
+
+def save_adapter_arrays(adapter_dir: str, names: List[str], arrays: List[np.ndarray], template_dir: str = None):
+    """Write LoRA tensors as a PEFT adapter directory, copying the config from template_dir."""
+    if len(names) != len(arrays):
+        raise ValueError(f"Expected {len(names)} LoRA tensors, got {len(arrays)}")
+    os.makedirs(adapter_dir, exist_ok=True)
+    save_file({name: np.ascontiguousarray(array) for name, array in zip(names, arrays)},
+              os.path.join(adapter_dir, ADAPTER_FILE))
+    if template_dir and os.path.abspath(template_dir) != os.path.abspath(adapter_dir):
+        shutil.copy(os.path.join(template_dir, ADAPTER_CONFIG), os.path.join(adapter_dir, ADAPTER_CONFIG))
+    return adapter_dir
+
+SAFETENSORS_DTYPES = {
+    np.dtype(np.float16): "F16", np.dtype(np.float32): "F32", np.dtype(np.float64): "F64",
+    np.dtype(np.int8): "I8", np.dtype(np.int32): "I32", np.dtype(np.int64): "I64"
+}
+
+class SafetensorsWriter:
+    """Write a safetensors file one tensor at a time.
+
+    Names, shapes and dtypes are declared up front so the header can be written first;
+    tensors must then be written in the declared order.
+    """
+
+    def __init__(self, path: str, specs: List[Tuple[str, tuple, np.dtype]], metadata: dict = None):
+        header, offset = {}, 0
+        for name, shape, dtype in specs:
+            nbytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            header[name] = {"dtype": SAFETENSORS_DTYPES[np.dtype(dtype)], "shape": list(shape),
+                            "data_offsets": [offset, offset + nbytes]}
+            offset += nbytes
+        if metadata:
+            header["__metadata__"] = metadata
+        encoded = json.dumps(header, separators=(',', ':')).encode("utf-8")
+        encoded += b" " * (-len(encoded) % 8)  # keep tensor data 8-byte aligned
+
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.specs = specs
+        self.position = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(self.tmp_path, 'wb')
+        self.file.write(struct.pack("<Q", len(encoded)))
+        self.file.write(encoded)
+
+    def write(self, name: str, array: np.ndarray):
+        expected_name, shape, dtype = self.specs[self.position]
+        if name != expected_name:
+            raise ValueError(f"Expected tensor '{expected_name}', got '{name}'")
+        self.file.write(np.ascontiguousarray(array, dtype=dtype).reshape(shape).tobytes())
+        self.position += 1
+
+    def close(self):
+        self.file.close()
+        if self.position != len(self.specs):
+            os.remove(self.tmp_path)
+            raise ValueError(f"Only {self.position} of {len(self.specs)} tensors were written")
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
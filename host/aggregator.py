@@ -1,36 +1,76 @@
-import torch
-from peft import PeftModel
-from transformers import AutoModelForCausalLM
 import os
+import shutil
+import numpy as np
+from typing import List
+from safetensors import safe_open
+from adapter_io import ADAPTER_FILE, ADAPTER_CONFIG, SafetensorsWriter
 
-def aggregate_models(client_weights_paths: list, output_dir: str):
+class StreamingAggregator:
+    """Weighted average that folds client updates into fp32 accumulators as they arrive.
+
+    Only the accumulators and one scratch buffer are kept, so memory does not grow with
+    the number of clients.
+    """
+
+    def __init__(self):
+        self.accumulators = None
+        self.dtypes = None
+        self.scratch = None
+        self.total_weight = 0.0
+
+    def add(self, params: List[np.ndarray], weight: float):
+        if self.accumulators is None:
+            self.accumulators = [np.zeros(p.shape, dtype=np.float32) for p in params]
+            self.dtypes = [p.dtype for p in params]
+            self.scratch = np.empty(max((p.size for p in params), default=0), dtype=np.float32)
+        elif len(params) != len(self.accumulators):
+            raise ValueError(f"Expected {len(self.accumulators)} tensors, got {len(params)}")
+        for acc, p in zip(self.accumulators, params):
+            # Scale into the shared scratch buffer instead of allocating a temporary per tensor
+            scaled = self.scratch[:p.size].reshape(p.shape)
+            np.multiply(p, weight, out=scaled, casting="unsafe")
+            acc += scaled
+        self.total_weight += weight
+
+    def result(self, keep_dtype: bool = False) -> List[np.ndarray]:
+        if not self.total_weight:
+            raise ValueError("No client updates to aggregate")
+        averaged = [acc / self.total_weight for acc in self.accumulators]
+        if keep_dtype:
+            averaged = [a.astype(dtype, copy=False) for a, dtype in zip(averaged, self.dtypes)]
+        return averaged
+
+def aggregate_models(client_weights_paths: list, output_dir: str, num_examples: list = None):
     """Perform FedAvg aggregation of LoRA weights."""
-    base_model_name = "liuhaotian/llava-v1.5-7b"
-    base_model = AutoModelForCausalLM.from_pretrained(base_model_name, torch_dtype=torch.float16)
-    
-    # Initialize aggregated weights
-    aggregated_state_dict = None
-    num_clients = len(client_weights_paths)
-    
-    for path in client_weights_paths:
-        # Load client LoRA weights
-        model = PeftModel.from_pretrained(base_model, path)
-        state_dict = model.state_dict()
-        
-        if aggregated_state_dict is None:
-            aggregated_state_dict = {k: torch.zeros_like(v) for k, v in state_dict.items()}
-        
-        # Accumulate weights
-        for k, v in state_dict.items():
-            aggregated_state_dict[k] += v / num_clients
-    
-    # Save aggregated model
-    os.makedirs(output_dir, exist_ok=True)
-    model = PeftModel.from_pretrained(base_model, client_weights_paths[0])  # Use first client's config
-    model.load_state_dict(aggregated_state_dict)
-    model.save_pretrained(f"{output_dir}/global_model")
-    return f"{output_dir}/global_model"
+    # Adapter files are memory-mapped; the base model is never loaded
+    weights = num_examples or [1] * len(client_weights_paths)
+    total = float(sum(weights))
+    handles = [safe_open(os.path.join(path, ADAPTER_FILE), framework="numpy") for path in client_weights_paths]
+    names = sorted(handles[0].keys())
+    first = {name: handles[0].get_slice(name) for name in names}
+    specs = [(name, tuple(first[name].get_shape()), _numpy_dtype(first[name].get_dtype())) for name in names]
+
+    global_dir = f"{output_dir}/global_model"
+    with SafetensorsWriter(os.path.join(global_dir, ADAPTER_FILE), specs, {"format": "pt"}) as writer:
+        # One fp32 accumulator and one scratch buffer, sized for the largest tensor and reused
+        # for every tensor; each result is written before the next one is accumulated
+        size = max((int(np.prod(shape)) for _, shape, _ in specs), default=0)
+        acc_buffer, scratch_buffer = np.empty(size, dtype=np.float32), np.empty(size, dtype=np.float32)
+        for name, shape, dtype in specs:
+            count = int(np.prod(shape))
+            acc, scratch = acc_buffer[:count].reshape(shape), scratch_buffer[:count].reshape(shape)
+            acc.fill(0.0)
+            for handle, weight in zip(handles, weights):
+                np.multiply(handle.get_tensor(name), weight / total, out=scratch, casting="unsafe")
+                acc += scratch
+            writer.write(name, acc.astype(dtype, copy=False))
+    # Use first client's config
+    shutil.copy(os.path.join(client_weights_paths[0], ADAPTER_CONFIG), os.path.join(global_dir, ADAPTER_CONFIG))
+    return global_dir
+
+def _numpy_dtype(safetensors_dtype: str) -> np.dtype:
+    return {"F16": np.float16, "F32": np.float32, "F64": np.float64}[safetensors_dtype]
 
 if __name__ == "__main__":
     client_weights = ["output/lora_weights_client1", "output/lora_weights_client2"]
-    aggregate_models(client_weights, "output/global")
\ No newline at end of file
+    aggregate_models(client_weights, "output/global")
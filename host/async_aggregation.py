@@ -0,0 +1,82 @@
+import threading
+import numpy as np
+from typing import Dict, List, Tuple
+from aggregator import StreamingAggregator
+
+def staleness_weight(staleness: int, exponent: float = 0.5) -> float:
+    """Polynomial staleness discount (1 + s)^-exponent: fresh updates count fully."""
+    return (1.0 + max(staleness, 0)) ** -exponent
+
+class BufferedAsyncAggregator:
+    """Global model that advances one version every time buffer_size client updates arrive.
+
+    Clients train from whatever version is current when they are dispatched and may report
+    back after several other updates were applied. Each update is taken as a delta against the
+    version it started from, discounted by how many versions old that is, and the buffered
+    deltas are averaged (weighted by sample count and staleness) into the next version.
+    With buffer_size equal to the number of clients, no staleness and server_lr 1.0 this is FedAvg.
+    """
+
+    def __init__(self, initial: List[np.ndarray], buffer_size: int = 1,
+                 staleness_exponent: float = 0.5, server_lr: float = 1.0):
+        if buffer_size < 1:
+            raise ValueError(f"Buffer size must be at least 1, got {buffer_size}")
+        self.params = [np.asarray(p, dtype=np.float32) for p in initial]
+        self.version = 0
+        self.buffer_size = buffer_size
+        self.staleness_exponent = staleness_exponent
+        self.server_lr = server_lr
+        self._buffer = StreamingAggregator()
+        self._buffered = []  # staleness of each update in the buffer
+        # Versions still held by in-flight clients, with how many clients hold each
+        self._snapshots: Dict[int, List[np.ndarray]] = {}
+        self._holders: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def checkout(self) -> Tuple[int, List[np.ndarray]]:
+        """Return (version, params) to send to a client; pair every checkout with one add or release."""
+        with self._lock:
+            self._snapshots.setdefault(self.version, self.params)
+            self._holders[self.version] = self._holders.get(self.version, 0) + 1
+            return self.version, self.params
+
+    def reference(self, version: int) -> List[np.ndarray]:
+        """Parameters of a checked-out version (the reference for that client's codec deltas)."""
+        return self._snapshots[version]
+
+    def add(self, params: List[np.ndarray], num_examples: int, base_version: int) -> Dict:
+        """Buffer a client's weights trained from base_version; returns a summary if a new version was applied."""
+        with self._lock:
+            reference = self._snapshots[base_version]
+            staleness = self.version - base_version
+            weight = num_examples * staleness_weight(staleness, self.staleness_exponent)
+            self._buffer.add([np.asarray(p, dtype=np.float32) - r for p, r in zip(params, reference)], weight)
+            self._buffered.append(staleness)
+            self._release(base_version)
+            if len(self._buffered) < self.buffer_size:
+                return {}
+            # New arrays rather than in-place updates: older versions may still be held as snapshots
+            self.params = [p + self.server_lr * d for p, d in zip(self.params, self._buffer.result())]
+            self.version += 1
+            for version in [v for v in self._snapshots if v not in self._holders]:
+                del self._snapshots[version]
+            summary = {
+                "version": self.version,
+                "updates": len(self._buffered),
+                "mean_staleness": float(np.mean(self._buffered)),
+                "max_staleness": int(max(self._buffered))
+            }
+            self._buffer, self._buffered = StreamingAggregator(), []
+            return summary
+
+    def release(self, version: int):
+        """Drop a checkout whose client failed or was cancelled."""
+        with self._lock:
+            self._release(version)
+
+    def _release(self, version: int):
+        self._holders[version] -= 1
+        if not self._holders[version]:
+            del self._holders[version]
+            if version != self.version:
+                del self._snapshots[version]
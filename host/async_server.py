@@ -0,0 +1,96 @@
+import time
+import concurrent.futures
+import flwr as fl
+from flwr.common import FitIns, ndarrays_to_parameters, parameters_to_ndarrays
+from flwr.server.history import History
+from async_aggregation import BufferedAsyncAggregator
+from tracing import span
+
+class AsyncBufferedServer(fl.server.Server):
+    """Flower server that aggregates asynchronously instead of in lock-step rounds.
+
+    Every available client is kept busy: as soon as one returns, its update is buffered and
+    it is sent the current global adapter again. The global adapter advances by one version
+    (counted as one round) each time buffer_size updates have arrived.
+
+    Versions count on from start_version (the round a resumed host stopped at), and
+    on_version(version, params) is called after each one, e.g. to checkpoint it. The strategy
+    (MCPFedAvg) supplies each client's fit config, including its scheduler budget, decodes
+    compressed updates and feeds every completed update to the scheduler.
+    """
+
+    def __init__(self, client_manager, strategy, buffer_size: int = 1, staleness_exponent: float = 0.5,
+                 server_lr: float = 1.0, start_version: int = 0, on_version=None):
+        super().__init__(client_manager=client_manager, strategy=strategy)
+        self.start_version = start_version
+        self.on_version = on_version
+        self.buffer_size = buffer_size
+        self.staleness_exponent = staleness_exponent
+        self.server_lr = server_lr
+        self.idle_seconds = {}  # per client: time between returning an update and receiving new work
+
+    def fit(self, num_rounds: int, timeout: float):
+        history = History()
+        self.parameters = self._get_initial_parameters(server_round=0, timeout=timeout)
+        aggregator = BufferedAsyncAggregator(parameters_to_ndarrays(self.parameters), self.buffer_size,
+                                             self.staleness_exponent, self.server_lr)
+        aggregator.version = self.start_version
+        num_rounds += self.start_version
+        min_clients = getattr(self.strategy, "min_available_clients", 1)
+        self._client_manager.wait_for(min_clients)
+        start = time.perf_counter()
+
+        in_flight, returned_at = {}, {}
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while aggregator.version < num_rounds:
+                # Hand the current version to every connected client that is not training
+                busy = {client.cid for client, _ in in_flight.values()}
+                clients = self._client_manager.all()
+                for cid, client in clients.items():
+                    if cid in busy:
+                        continue
+                    version, params = aggregator.checkout()
+                    ins = FitIns(ndarrays_to_parameters(params),
+                                 self.strategy.fit_config(client, version + 1, clients.values()))
+                    if cid in returned_at:
+                        self.idle_seconds[cid] = self.idle_seconds.get(cid, 0.0) + time.perf_counter() - returned_at.pop(cid)
+                    in_flight[pool.submit(client.fit, ins, timeout, version)] = (client, version)
+                if not in_flight:
+                    self._client_manager.wait_for(1)
+                    continue
+
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    client, base_version = in_flight.pop(future)
+                    returned_at[client.cid] = time.perf_counter()
+                    try:
+                        fit_res = future.result()
+                    except Exception as e:
+                        print(f"Client {client.cid} failed on version {base_version}: {e}")
+                        aggregator.release(base_version)
+                        continue
+                    client_id = self.strategy.client_id(client, base_version + 1)
+                    with span("host.aggregate_update", round=base_version + 1, client_id=client_id,
+                              staleness=aggregator.version - base_version) as trace:
+                        trace.add(bytes_received=sum(len(t) for t in fit_res.parameters.tensors),
+                                  samples=fit_res.num_examples)
+                        arrays = self.strategy.decode_update(client, fit_res, aggregator.reference(base_version),
+                                                             base_version + 1)
+                        summary = aggregator.add(arrays, fit_res.num_examples, base_version)
+                    self.strategy.observe(client, fit_res)
+                    if summary:
+                        self.parameters = ndarrays_to_parameters(aggregator.params)
+                        if self.on_version is not None:
+                            self.on_version(summary["version"], aggregator.params)
+                        summary["elapsed_s"] = time.perf_counter() - start
+                        history.add_metrics_distributed_fit(server_round=summary["version"], metrics=summary)
+                        print(f"Version {summary['version']}: {summary['updates']} updates, "
+                              f"mean staleness {summary['mean_staleness']:.2f}, {summary['elapsed_s']:.1f}s")
+        finally:
+            # Updates still in flight when the target version is reached are not waited for
+            pool.shutdown(wait=False, cancel_futures=True)
+        elapsed = time.perf_counter() - start
+        print(f"Reached {num_rounds} versions in {elapsed:.1f}s; client idle time: "
+              + ", ".join(f"{cid} {seconds:.1f}s" for cid, seconds in self.idle_seconds.items()))
+        return history, elapsed
@@ -2,25 +2,40 @@ import json
 import os
 import numpy as np
 from typing import List
+from profile_io import load_profile, save_profile
 
-def fuse_profiles(profile_paths: List[str], output_dir: str):
+def fuse_profiles(profile_paths: List[str], output_dir: str, binary: bool = True):
     """Fuse platform-specific profiles into a general profile."""
-    profiles = []
+    # Streaming, sample-count-weighted merge: one (memory-mapped) profile is read at a time
+    count, mean, m2 = 0, None, None
     for path in profile_paths:
-        with open(path, 'r') as f:
-            profile_data = json.load(f)
-            profiles.append(np.array(profile_data["profile"]))
-
-    # Average profiles to create general profile
-    general_profile = np.mean(profiles, axis=0).tolist()
+        profile = load_profile(path)
+        n = profile["num_samples"]
+        p_mean = np.asarray(profile["mean"], dtype=np.float64)
+        # Without a variance, the pooled variance only reflects spread between client means
+        p_m2 = np.asarray(profile["variance"], dtype=np.float64) * n if profile["variance"] is not None \
+            else np.zeros_like(p_mean)
+        if count == 0:
+            count, mean, m2 = n, p_mean, p_m2
+            continue
+        total = count + n
+        delta = p_mean - mean
+        mean = mean + delta * (n / total)
+        m2 = m2 + p_m2 + delta ** 2 * (count * n / total)
+        count = total
+    if not count:
+        raise ValueError("No profiles to fuse")
 
     # Save general profile
     os.makedirs(output_dir, exist_ok=True)
+    if binary:
+        return save_profile(f"{output_dir}/general_profile", mean, count, m2 / count,
+                            num_clients=len(profile_paths))
     general_profile_path = f"{output_dir}/general_profile.json"
     with open(general_profile_path, 'w') as f:
-        json.dump({"general_profile": general_profile}, f, indent=2)
+        json.dump({"general_profile": mean.tolist(), "num_samples": count}, f)
 
     return general_profile_path
 
 if __name__ == "__main__":
-    fuse_profiles(["/output/profile_client1.json", "/output/profile_client2.json"], "/output")
\ No newline at end of file
+    fuse_profiles(["/output/profile_client1.json", "/output/profile_client2.json"], "/output")
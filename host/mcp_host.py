@@ -1,68 +1,136 @@
 import flwr as fl
-import torch
-from transformers import AutoModelForCausalLM
-from peft import PeftModel
 import os
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from fuse_profiles import fuse_profiles
+from adapter_io import has_adapter, load_adapter_arrays, save_adapter_arrays
+from strategy import MCPFedAvg
+from async_server import AsyncBufferedServer
+from scheduler import ThroughputScheduler
+from aggregator import StreamingAggregator
+from tracing import span
+from checkpoint import CheckpointWriter, latest_checkpoint, load_checkpoint
 
 class MCPHost:
-    def __init__(self, output_dir: str, num_rounds: int = 3):
+    def __init__(self, output_dir: str, num_rounds: int = 3, codec: str = None, mode: str = None,
+                 buffer_size: int = None, num_clients: int = None):
         self.output_dir = output_dir
         self.num_rounds = num_rounds
+        # Clients to wait for before training starts (one per fanned-out pipeline client)
+        self.num_clients = num_clients or int(os.environ.get("NUM_CLIENTS", 2))
+        # "sync" waits for every client each round; "async" applies every buffer_size updates
+        # (see async_server), so with async num_rounds counts global adapter versions
+        self.mode = mode or os.environ.get("FL_MODE", "sync")
+        self.buffer_size = buffer_size or int(os.environ.get("ASYNC_BUFFER_SIZE", 1))
+        # Update codec spec sent to clients, e.g. "int8" or "int8:0.01" (see update_codec)
+        self.codec = codec if codec is not None else os.environ.get("UPDATE_CODEC", "dense")
+        # Per-client sample budgets so clients finish rounds together (SCHEDULER=off to disable)
+        self.scheduler = None
+        if os.environ.get("SCHEDULER", "throughput") == "throughput":
+            self.scheduler = ThroughputScheduler(
+                target_seconds=float(os.environ.get("ROUND_SECONDS", 0)) or None,
+                log_path=f"{output_dir}/scheduler_log.jsonl"
+            )
+        # Global adapter, round and strategy state every CHECKPOINT_ROUNDS rounds (0 disables)
+        self.checkpoint_dir = f"{output_dir}/checkpoints/host"
+        self.checkpoint_rounds = int(os.environ.get("CHECKPOINT_ROUNDS", 1))
+        self.checkpoint_writer = None
+        self.resume_round = 0  # rounds already completed by a previous run of this host
         self.model_name = "liuhaotian/llava-v1.5-7b"
         self.client_profiles = {}  # Store client weights and profiles
 
     def get_initial_parameters(self):
-        """Get initial model parameters."""
-        model = AutoModelForCausalLM.from_pretrained(
-            self.model_name, torch_dtype=torch.float16
-        )
-        return [val.cpu().numpy() for val in model.state_dict().values()]
+        """Get initial LoRA adapter parameters, or None to let Flower ask a client for them."""
+        # Resume from the latest valid checkpoint, so a restarted host continues where it stopped
+        path = latest_checkpoint(self.checkpoint_dir)
+        if path is not None:
+            arrays, state, _ = load_checkpoint(path, load_optimizer=False)
+            self.resume_round = state["round"]
+            if self.scheduler is not None and state.get("scheduler"):
+                self.scheduler.load_state(state["scheduler"])
+            print(f"Resuming after round {self.resume_round} from {path}")
+            return fl.common.ndarrays_to_parameters(arrays)
+        # Otherwise from a previously saved global adapter; never ship the base model weights
+        if has_adapter(f"{self.output_dir}/global"):
+            _, arrays = load_adapter_arrays(f"{self.output_dir}/global")
+            return fl.common.ndarrays_to_parameters(arrays)
+        return None
+
+    def remaining_rounds(self) -> int:
+        return max(self.num_rounds - self.resume_round, 0)
+
+    def save_checkpoint(self, server_round: int, parameters: List[np.ndarray]):
+        """Checkpoint the global adapter after server_round, in the background."""
+        if not self.checkpoint_rounds or server_round % self.checkpoint_rounds:
+            return
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = CheckpointWriter(self.checkpoint_dir)
+        state = {"round": server_round, "mode": self.mode, "codec": self.codec}
+        if self.scheduler is not None:
+            state["scheduler"] = self.scheduler.state()
+        self.checkpoint_writer.save(server_round, parameters, state)
+
+    def close_checkpoints(self):
+        """Wait for pending checkpoints to reach disk; raises if one could not be written."""
+        writer, self.checkpoint_writer = self.checkpoint_writer, None
+        if writer is not None:
+            writer.close()
 
     def aggregate(self, results: List[Tuple[List[np.ndarray], int]]) -> List[np.ndarray]:
         """Aggregate client weights using FedAvg."""
-        aggregated_params = []
-        num_examples_total = sum(num_examples for _, num_examples in results)
-        for i in range(len(results[0][0])):
-            weighted_sum = np.zeros_like(results[0][0][i])
+        with span("host.aggregate", clients=len(results)) as trace:
+            aggregator = StreamingAggregator()
             for params, num_examples in results:
-                weighted_sum += params[i] * (num_examples / num_examples_total)
-            aggregated_params.append(weighted_sum)
-        return aggregated_params
+                aggregator.add(params, num_examples)
+                trace.add(samples=num_examples)
+            return aggregator.result()
 
     def save_global_model(self, parameters: List[np.ndarray]):
-        """Save aggregated model."""
-        model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float16)
-        state_dict = model.state_dict()
-        for i, (key, val) in enumerate(state_dict.items()):
-            state_dict[key] = torch.from_numpy(parameters[i]).to(val.device)
-        model = PeftModel.from_pretrained(model, f"{self.output_dir}/lora_weights_client1")
-        model.load_state_dict(state_dict)
-        os.makedirs(self.output_dir, exist_ok=True)
-        model.save_pretrained(f"{self.output_dir}/global")
-        return f"{self.output_dir}/global"
+        """Save the aggregated LoRA adapter."""
+        # Tensor names and adapter config come from a client adapter with the same layout
+        template_dir = f"{self.output_dir}/lora_weights_client1"
+        names, _ = load_adapter_arrays(template_dir)
+        return save_adapter_arrays(f"{self.output_dir}/global", names, parameters, template_dir)
 
     def fuse_client_profiles(self, profile_paths: List[str]):
         """Fuse platform-specific profiles into a general profile."""
-        return fuse_profiles(profile_paths, self.output_dir)
+        with span("host.fuse_profiles", profiles=len(profile_paths)):
+            return fuse_profiles(profile_paths, self.output_dir)
 
-    def run_fl_rounds(self, profile_paths: List[str] = None):
-        """Run Flower server for FL rounds and fuse profiles."""
-        strategy = fl.server.strategy.FedAvg(
-            min_fit_clients=2,
-            min_available_clients=2,
-            on_fit_config_fn=lambda r: {},
+    def build_strategy(self, **kwargs) -> MCPFedAvg:
+        """FedAvg strategy for this host; kwargs override the FedAvg defaults below."""
+        options = dict(
+            min_fit_clients=self.num_clients,
+            min_available_clients=self.num_clients,
+            on_fit_config_fn=lambda r: {"codec": self.codec, "server_round": r},
             fit_metrics_aggregation_fn=None,
             evaluate_fn=None,
             initial_parameters=self.get_initial_parameters()
         )
-        fl.server.start_server(
-            server_address="[::]:8080",
-            config=fl.server.ServerConfig(num_rounds=self.num_rounds),
-            strategy=strategy
-        )
+        options.update(kwargs)
+        return MCPFedAvg(self, scheduler=self.scheduler, **options)
+
+    def build_server(self, strategy: MCPFedAvg, client_manager=None) -> fl.server.Server:
+        """Synchronous Flower server, or the buffered async one in async mode."""
+        client_manager = client_manager or fl.server.SimpleClientManager()
+        if self.mode == "async":
+            return AsyncBufferedServer(client_manager, strategy, buffer_size=self.buffer_size,
+                                       start_version=self.resume_round, on_version=self.save_checkpoint)
+        return fl.server.Server(client_manager=client_manager, strategy=strategy)
+
+    def run_fl_rounds(self, profile_paths: List[str] = None):
+        """Run Flower server for FL rounds and fuse profiles."""
+        strategy = self.build_strategy()
+        if self.remaining_rounds():
+            try:
+                fl.server.start_server(
+                    server_address="[::]:8080",
+                    server=self.build_server(strategy),
+                    config=fl.server.ServerConfig(num_rounds=self.remaining_rounds()),
+                    strategy=strategy
+                )
+            finally:
+                self.close_checkpoints()
         # Fuse profiles after FL rounds
         if profile_paths:
             return self.fuse_client_profiles(profile_paths)
@@ -0,0 +1,105 @@
+import json
+import os
+import statistics
+from typing import Dict, List
+
+class ThroughputScheduler:
+    """Per-client sample budgets that make every client's round take about the same time.
+
+    Clients report samples/sec, training time and round latency in their fit metrics. The
+    non-training part of a round (pipeline stages, adapter exchange) is tracked as overhead.
+    Clients are keyed by the client_id they report, which survives reconnects and host restarts.
+    Each round every client gets budget = (target - overhead) * samples/sec, where the target is
+    target_seconds or, by default, the median time the clients would need for one full pass.
+    Budgets above a client's dataset size mean extra passes, so fast clients keep training
+    instead of waiting for the slowest one.
+    """
+
+    def __init__(self, target_seconds: float = None, min_samples: int = 8, smoothing: float = 0.5,
+                 log_path: str = None):
+        self.target_seconds = target_seconds
+        self.min_samples = min_samples
+        self.smoothing = smoothing  # weight of the newest measurement in the moving averages
+        self.log_path = log_path
+        self.clients: Dict[str, Dict] = {}
+
+    def observe(self, client_id: str, num_examples: int, metrics: Dict):
+        """Fold one client's fit result into its throughput estimates."""
+        if not metrics.get("samples_per_sec"):
+            return  # client without throughput reporting: leave it unscheduled
+        overhead = max(metrics.get("round_seconds", 0.0) - metrics.get("train_seconds", 0.0), 0.0)
+        state = self.clients.get(client_id)
+        if state is None:
+            state = self.clients[client_id] = {"samples_per_sec": metrics["samples_per_sec"], "overhead_s": overhead}
+        else:
+            for key, value in (("samples_per_sec", metrics["samples_per_sec"]), ("overhead_s", overhead)):
+                state[key] = self.smoothing * value + (1.0 - self.smoothing) * state[key]
+        state.update(
+            name=client_id,
+            dataset_size=metrics.get("dataset_size", num_examples),
+            last_samples=num_examples,
+            last_round_s=metrics.get("round_seconds")
+        )
+
+    def state(self) -> Dict:
+        """Throughput estimates, for the host checkpoint."""
+        return {"clients": self.clients}
+
+    def load_state(self, state: Dict):
+        self.clients.update(state.get("clients", {}))
+
+    def full_pass_seconds(self, client_id: str) -> float:
+        state = self.clients[client_id]
+        return state["overhead_s"] + state["dataset_size"] / state["samples_per_sec"]
+
+    def budgets(self, server_round: int, client_ids: List[str]) -> Dict[str, int]:
+        """Sample budget per client for this round; clients not measured yet get none (full pass)."""
+        known = [client_id for client_id in client_ids if client_id in self.clients]
+        if not known:
+            return {}
+        target = self._target(known)
+        budgets = {client_id: self._budget(client_id, target) for client_id in known}
+        self.log(server_round, target, budgets)
+        return budgets
+
+    def budget(self, server_round: int, client_id: str, peers: List[str]):
+        """Budget for one client dispatched on its own (async mode), against the target of all
+        connected peers; None if it has not been measured yet."""
+        if client_id not in self.clients:
+            return None
+        target = self._target([peer for peer in set(peers) | {client_id} if peer in self.clients])
+        budget = self._budget(client_id, target)
+        self.log(server_round, target, {client_id: budget})
+        return budget
+
+    def _target(self, known: List[str]) -> float:
+        return self.target_seconds or statistics.median(self.full_pass_seconds(client_id) for client_id in known)
+
+    def _budget(self, client_id: str, target: float) -> int:
+        state = self.clients[client_id]
+        return max(self.min_samples, int((target - state["overhead_s"]) * state["samples_per_sec"]))
+
+    def log(self, server_round: int, target: float, budgets: Dict[str, int]):
+        """Print and append this round's decisions and per-client throughput."""
+        entries = []
+        for client_id, budget in budgets.items():
+            state = self.clients[client_id]
+            entry = {
+                "round": server_round,
+                "client": state["name"],
+                "samples_per_sec": state["samples_per_sec"],
+                "overhead_s": state["overhead_s"],
+                "last_round_s": state["last_round_s"],
+                "last_samples": state["last_samples"],
+                "budget": budget,
+                "predicted_round_s": state["overhead_s"] + budget / state["samples_per_sec"]
+            }
+            entries.append(entry)
+            print(f"Round {server_round}: {entry['client']} {entry['samples_per_sec']:.2f} samples/sec, "
+                  f"last round {entry['last_round_s'] or 0.0:.1f}s -> budget {budget} samples "
+                  f"(~{entry['predicted_round_s']:.1f}s, target {target:.1f}s)")
+        if self.log_path:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
@@ -0,0 +1,139 @@
+import heapq
+import json
+import numpy as np
+from typing import Dict, List
+from async_aggregation import BufferedAsyncAggregator
+
+# Local multi-client simulation of synchronous FedAvg vs buffered asynchronous aggregation.
+# Virtual time only: each client's local round takes its own (jittered) duration, and local
+# training is a few gradient steps on a quadratic whose optimum differs per client (non-IID).
+# With a ThroughputScheduler, async dispatches carry a sample budget like the real host's, and
+# a client's round time and number of steps scale with the samples it trains on.
+
+class SimClient:
+    def __init__(self, cid: int, seconds_per_round: float, optimum: np.ndarray, num_examples: int, rng):
+        self.cid = cid
+        self.seconds_per_round = seconds_per_round
+        self.optimum = optimum
+        self.num_examples = num_examples
+        self.rng = rng
+
+    def duration(self, samples: int = None) -> float:
+        """Time for one local round; seconds_per_round is a full pass over num_examples."""
+        fraction = 1.0 if samples is None else samples / self.num_examples
+        return self.seconds_per_round * fraction * float(self.rng.lognormal(0.0, 0.1))
+
+    def train(self, params: List[np.ndarray], steps: int = 5, lr: float = 0.05, noise: float = 0.05) -> List[np.ndarray]:
+        # Noisy gradient descent on 0.5 * ||x - optimum||^2
+        x = params[0].copy()
+        for _ in range(steps):
+            x -= lr * (x - self.optimum + self.rng.normal(0, noise, x.shape).astype(np.float32))
+        return [x]
+
+def make_clients(seconds_per_round: List[float], heterogeneity: float = 0.3, dim: int = 64,
+                 seed: int = 0) -> List[SimClient]:
+    """Clients whose optima are a shared point plus a per-client offset scaled by heterogeneity."""
+    rng = np.random.default_rng(seed)
+    shared = rng.normal(0, 1, dim)
+    return [SimClient(i, s, (shared + heterogeneity * rng.normal(0, 1, dim)).astype(np.float32),
+                      int(rng.integers(100, 1000)), rng)
+            for i, s in enumerate(seconds_per_round)]
+
+def global_loss(params: List[np.ndarray], clients: List[SimClient]) -> float:
+    weights = np.array([c.num_examples for c in clients], dtype=np.float64)
+    target = np.average([c.optimum for c in clients], axis=0, weights=weights)
+    return float(0.5 * np.sum((params[0] - target) ** 2))
+
+def simulate_sync(clients: List[SimClient], rounds: int, dim: int = 64) -> Dict:
+    """Lock-step FedAvg: every round lasts as long as its slowest client."""
+    aggregator = BufferedAsyncAggregator([np.zeros(dim, dtype=np.float32)], buffer_size=len(clients))
+    now, idle, trace = 0.0, {c.cid: 0.0 for c in clients}, []
+    for _ in range(rounds):
+        checkouts = [aggregator.checkout() for _ in clients]
+        durations = [c.duration() for c in clients]
+        for client, (version, params), duration in zip(clients, checkouts, durations):
+            aggregator.add(client.train(params), client.num_examples, version)
+            idle[client.cid] += max(durations) - duration
+        now += max(durations)
+        trace.append((now, global_loss(aggregator.params, clients)))
+    return _report("sync", now, idle, trace)
+
+def simulate_async(clients: List[SimClient], rounds: int, buffer_size: int = 1,
+                   staleness_exponent: float = 0.5, server_lr: float = None, dim: int = 64,
+                   scheduler=None) -> Dict:
+    """Buffered async: a client is re-dispatched the moment it returns, so it is never idle.
+
+    With a scheduler, each dispatch gets the budget the scheduler gives that client against
+    the others, and each returned update is fed back to it as the client's fit metrics.
+    """
+    # A version built from K of N updates moves the model K/N as far as a full FedAvg round
+    server_lr = server_lr or buffer_size / len(clients)
+    aggregator = BufferedAsyncAggregator([np.zeros(dim, dtype=np.float32)], buffer_size, staleness_exponent, server_lr)
+    names = [f"client{c.cid}" for c in clients]
+    events, trace, staleness = [], [], []
+
+    def dispatch(client, now):
+        version, params = aggregator.checkout()
+        samples = scheduler.budget(version + 1, names[client.cid], names) if scheduler is not None else None
+        samples = samples or client.num_examples
+        steps = max(1, round(5 * samples / client.num_examples))
+        duration = client.duration(samples)
+        heapq.heappush(events, (now + duration, client.cid, version, samples, duration, client.train(params, steps)))
+
+    for client in clients:
+        dispatch(client, 0.0)
+    now = 0.0
+    while aggregator.version < rounds:
+        now, cid, version, samples, duration, weights = heapq.heappop(events)
+        client = clients[cid]
+        summary = aggregator.add(weights, samples, version)
+        if scheduler is not None:
+            scheduler.observe(names[cid], samples, {"samples_per_sec": samples / duration, "train_seconds": duration,
+                                                    "round_seconds": duration, "dataset_size": client.num_examples})
+        if summary:
+            staleness.append(summary["mean_staleness"])
+            trace.append((now, global_loss(aggregator.params, clients)))
+        dispatch(client, now)
+    name = f"async(K={buffer_size}{', scheduler' if scheduler is not None else ''})"
+    report = _report(name, now, {c.cid: 0.0 for c in clients}, trace)
+    report["mean_staleness"] = float(np.mean(staleness))
+    return report
+
+def _report(name: str, elapsed: float, idle: Dict[int, float], trace) -> Dict:
+    return {
+        "strategy": name,
+        "time_to_target_rounds_s": elapsed,
+        "idle_fraction": {f"client{cid}": seconds / elapsed for cid, seconds in idle.items()},
+        "final_loss": trace[-1][1],
+        "trace": trace
+    }
+
+def time_to_loss(trace, loss: float) -> float:
+    return next((t for t, value in trace if value <= loss), float("inf"))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare sync FedAvg with buffered async aggregation")
+    parser.add_argument("--seconds", default="60,90,240,600", help="per-client local round time, comma-separated")
+    parser.add_argument("--rounds", type=int, default=50, help="target number of global versions")
+    parser.add_argument("--target-loss", type=float, default=0.05, help="loss threshold, as a fraction of the initial loss")
+    parser.add_argument("--buffer-sizes", default="1,2", help="async buffer sizes K to compare")
+    parser.add_argument("--heterogeneity", type=float, default=0.3, help="spread of client optima (non-IID-ness)")
+    parser.add_argument("--scheduler", action="store_true", help="also run async with per-client sample budgets")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    seconds = [float(s) for s in args.seconds.split(",")]
+    clients = make_clients(seconds, args.heterogeneity, seed=args.seed)
+    target = args.target_loss * global_loss([np.zeros_like(clients[0].optimum)], clients)
+    reports = [simulate_sync(clients, args.rounds)]
+    for k in args.buffer_sizes.split(","):
+        reports.append(simulate_async(make_clients(seconds, args.heterogeneity, seed=args.seed), args.rounds, int(k)))
+        if args.scheduler:
+            from scheduler import ThroughputScheduler
+            reports.append(simulate_async(make_clients(seconds, args.heterogeneity, seed=args.seed), args.rounds,
+                                          int(k), scheduler=ThroughputScheduler()))
+    for report in reports:
+        # An async version is cheaper than a sync round, so also compare the time to a fixed loss
+        report["time_to_target_loss_s"] = time_to_loss(report.pop("trace"), target)
+        print(json.dumps(report))
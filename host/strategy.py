@@ -0,0 +1,114 @@
+import time
+import flwr as fl
+from flwr.common import Code, FitIns, GetPropertiesIns, ndarrays_to_parameters, parameters_to_ndarrays
+from update_codec import decode, is_encoded
+from aggregator import StreamingAggregator
+from tracing import nbytes, span
+
+class MCPFedAvg(fl.server.strategy.FedAvg):
+    """FedAvg that decodes compressed client updates and folds them into a streaming average.
+
+    With a scheduler, each client's fit config also carries its sample budget for the round.
+    The scheduler is keyed by the client_id clients report, not by Flower's cid, which changes
+    whenever a client reconnects (so restored estimates would never match after a restart).
+    Flower numbers rounds from 1 on every start, so rounds are shifted by the host's resume
+    round and a restarted host keeps counting where its last checkpoint stopped.
+    In async mode AsyncBufferedServer dispatches clients one at a time and uses fit_config,
+    decode_update and observe instead of configure_fit and aggregate_fit.
+    """
+
+    def __init__(self, host, scheduler=None, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.scheduler = scheduler
+        self.current_parameters = None  # global weights sent this round, the reference for deltas
+        self.client_ids = {}  # Flower cid -> client_id, from fit metrics or get_properties
+
+    def configure_fit(self, server_round, parameters, client_manager):
+        server_round += self.host.resume_round
+        with span("host.configure_fit", round=server_round) as trace:
+            instructions = self._configure_fit(server_round, parameters, client_manager)
+            trace.add(bytes_sent=nbytes(self.current_parameters) * len(instructions))
+            return instructions
+
+    def _configure_fit(self, server_round, parameters, client_manager):
+        self.current_parameters = parameters_to_ndarrays(parameters)
+        instructions = super().configure_fit(server_round, parameters, client_manager)
+        if self.scheduler is None:
+            return instructions
+        names = {client.cid: self.client_id(client, server_round) for client, _ in instructions}
+        budgets = self.scheduler.budgets(server_round, list(names.values()))
+        # FedAvg hands every client the same FitIns, so budgets go into per-client copies
+        return [(client, FitIns(ins.parameters, {**ins.config, "max_samples": budgets[names[client.cid]]}))
+                if names[client.cid] in budgets else (client, ins)
+                for client, ins in instructions]
+
+    def client_id(self, client, server_round: int) -> str:
+        """The client's own id, asked once per connection; the cid if it does not report one."""
+        if client.cid not in self.client_ids:
+            client_id = None
+            try:
+                res = client.get_properties(GetPropertiesIns({}), timeout=30, group_id=server_round)
+                if res.status.code == Code.OK:
+                    client_id = res.properties.get("client_id")
+            except Exception as e:
+                print(f"Round {server_round}: no properties from {client.cid}: {e}")
+            self.client_ids[client.cid] = client_id or client.cid
+        return self.client_ids[client.cid]
+
+    def fit_config(self, client, server_round: int, peers) -> dict:
+        """Fit config for one client dispatched on its own: the round config plus, with a
+        scheduler, its sample budget against the clients in peers."""
+        config = self.on_fit_config_fn(server_round) if self.on_fit_config_fn else {}
+        if self.scheduler is None:
+            return config
+        budget = self.scheduler.budget(server_round, self.client_id(client, server_round),
+                                       [self.client_id(peer, server_round) for peer in peers])
+        return config if budget is None else {**config, "max_samples": budget}
+
+    def decode_update(self, client, fit_res, reference, server_round: int):
+        """A client's update as absolute weights, decoding it against reference if compressed."""
+        arrays = parameters_to_ndarrays(fit_res.parameters)
+        if is_encoded(arrays):
+            start = time.perf_counter()
+            arrays = decode(arrays, reference)
+            print(f"Round {server_round}: decoded update from {client.cid} "
+                  f"({fit_res.metrics.get('codec')}, {fit_res.metrics.get('codec_ratio', 0.0):.1f}x) "
+                  f"in {(time.perf_counter() - start) * 1000.0:.1f} ms")
+        return arrays
+
+    def observe(self, client, fit_res):
+        """Feed a completed fit into the scheduler's throughput estimates."""
+        if self.scheduler is None:
+            return
+        client_id = fit_res.metrics.get("client_id") or self.client_ids.get(client.cid, client.cid)
+        self.client_ids[client.cid] = client_id
+        self.scheduler.observe(client_id, fit_res.num_examples, fit_res.metrics)
+
+    def aggregate_fit(self, server_round, results, failures):
+        server_round += self.host.resume_round
+        with span("host.aggregate_fit", round=server_round, clients=len(results), failures=len(failures)) as trace:
+            trace.add(bytes_received=sum(len(t) for _, res in results for t in res.parameters.tensors),
+                      samples=sum(res.num_examples for _, res in results))
+            return self._aggregate_fit(server_round, results, failures)
+
+    def _aggregate_fit(self, server_round, results, failures):
+        if not results:
+            return None, {}
+        if not self.accept_failures and failures:
+            return None, {}
+
+        # Fold each update into the running average as soon as it is decoded
+        aggregator = StreamingAggregator()
+        for client, fit_res in results:
+            aggregator.add(self.decode_update(client, fit_res, self.current_parameters, server_round),
+                           fit_res.num_examples)
+            self.observe(client, fit_res)
+
+        arrays = aggregator.result()
+        self.host.save_checkpoint(server_round, arrays)
+        parameters = ndarrays_to_parameters(arrays)
+        metrics = {}
+        if self.fit_metrics_aggregation_fn:
+            metrics = self.fit_metrics_aggregation_fn([(res.num_examples, res.metrics) for _, res in results])
+        return parameters, metrics
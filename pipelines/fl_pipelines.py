@@ -1,3 +1,4 @@
+from typing import List
 from kfp.v2 import dsl
 from kfp.v2.dsl import component, pipeline, Output, Artifact
 
@@ -7,26 +8,39 @@ def flower_client_op(client_id: str) -> str:
     sys.path.append("/clients")
     from flower_client import start_flower_client
     start_flower_client(client_id)
-    return f"/output/profile_{client_id}.json"
+    return f"/output/profile_{client_id}.npy"
 
 @component
-def mcp_host_op(profile_paths: list) -> str:
+def mcp_host_op(profile_paths: list, num_clients: int) -> str:
     import sys
     sys.path.append("/host")
     from mcp_host import MCPHost
-    mcp_host = MCPHost(output_dir="/output")
+    mcp_host = MCPHost(output_dir="/output", num_clients=num_clients)
     return mcp_host.run_fl_rounds(profile_paths=profile_paths)
 
-@pipeline(name="federated-llava-pipeline")
-def fl_pipeline():
-    client_ids = ["client1", "client2"]  # Example client IDs
-    client_tasks = []
-    for client_id in client_ids:
-        task = flower_client_op(client_id=client_id)
-        client_tasks.append(task.output)
-    
-    mcp_task = mcp_host_op(profile_paths=client_tasks)
+def client_ids_for(num_clients: int) -> List[str]:
+    return [f"client{i}" for i in range(1, num_clients + 1)]
+
+def build_pipeline(client_ids: List[str]):
+    """Federated pipeline with one Flower client task per client id, all feeding the host."""
+    @pipeline(name="federated-llava-pipeline")
+    def fl_pipeline():
+        # The fan-out is fixed at compile time; the host waits for exactly this many clients
+        client_tasks = []
+        for client_id in client_ids:
+            task = flower_client_op(client_id=client_id)
+            client_tasks.append(task.output)
+
+        mcp_task = mcp_host_op(profile_paths=client_tasks, num_clients=len(client_ids))
+    return fl_pipeline
+
+fl_pipeline = build_pipeline(client_ids_for(2))
 
 if __name__ == "__main__":
+    import argparse
     from kfp.v2.compiler import Compiler
-    Compiler().compile(fl_pipeline, "fl_pipeline.yaml")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Compile the federated pipeline")
+    parser.add_argument("--num-clients", type=int, default=2)
+    parser.add_argument("--output", default="fl_pipeline.yaml")
+    args = parser.parse_args()
+    Compiler().compile(build_pipeline(client_ids_for(args.num_clients)), args.output)
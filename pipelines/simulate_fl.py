@@ -0,0 +1,164 @@
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+# Single-machine simulation: the real host (MCPHost strategy, scheduler, async server) drives
+# LLaVAClient instances living in a process pool, with a tiny CPU LLaVA and synthetic posts.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "Clients"), os.path.join(ROOT, "host"), os.path.join(ROOT, "benchmarks")]
+
+from flwr.common import (Code, DisconnectRes, EvaluateRes, FitRes, GetParametersRes, GetPropertiesRes,
+                         Parameters, Status)
+from flwr.server.client_proxy import ClientProxy
+from synthetic import make_synthetic_data, make_tiny_model
+
+# Worker side: each pool process keeps its own clients, which share one base model via the registry
+_WORKER = {}
+
+def _worker_init(root: str, model_dir: str, torch_threads: int):
+    import torch
+    torch.set_num_threads(torch_threads)
+    _WORKER.update(root=root, model_dir=model_dir, clients={})
+
+def _client(cid: str):
+    from flower_client import LLaVAClient
+    from train_llava import train_llava
+
+    class SimLLaVAClient(LLaVAClient):
+        def run_workflow(self, max_samples: int = None):
+            # Data is already cleaned; training is the only stage
+            return train_llava(f"{_WORKER['root']}/data/{self.client_id}.jsonl", self.output_dir, self.client_id,
+                               model_dir=self.model_name, image_cache_dir=f"{_WORKER['root']}/image_cache",
+                               batch_size=4, num_workers=0, max_samples=max_samples)
+
+    if cid not in _WORKER["clients"]:
+        _WORKER["clients"][cid] = SimLLaVAClient(cid, _WORKER["model_dir"], f"{_WORKER['root']}/output")
+    return _WORKER["clients"][cid]
+
+def _worker_get_parameters(cid: str):
+    from flwr.common import ndarrays_to_parameters
+    return ndarrays_to_parameters(_client(cid).get_parameters({}))
+
+def _worker_get_properties(cid: str):
+    return _client(cid).get_properties({})
+
+def _worker_fit(cid: str, parameters: Parameters, config: dict):
+    from flwr.common import ndarrays_to_parameters, parameters_to_ndarrays
+    arrays, num_examples, metrics = _client(cid).fit(parameters_to_ndarrays(parameters), config)
+    return ndarrays_to_parameters(arrays), num_examples, metrics
+
+class PoolClientProxy(ClientProxy):
+    """ClientProxy that runs the client's work in the process pool instead of over gRPC."""
+
+    def __init__(self, cid: str, pool, stats: dict):
+        super().__init__(cid)
+        self.pool = pool
+        self.stats = stats
+
+    def get_properties(self, ins, timeout=None, group_id=None):
+        return GetPropertiesRes(Status(Code.OK, "Success"), self.pool.apply(_worker_get_properties, (self.cid,)))
+
+    def get_parameters(self, ins, timeout=None, group_id=None):
+        parameters = self.pool.apply(_worker_get_parameters, (self.cid,))
+        return GetParametersRes(Status(Code.OK, "Success"), parameters)
+
+    def fit(self, ins, timeout=None, group_id=None):
+        start = time.perf_counter()
+        parameters, num_examples, metrics = self.pool.apply(_worker_fit, (self.cid, ins.parameters, ins.config))
+        self.stats["fits"].append({
+            "client": self.cid,
+            "seconds": time.perf_counter() - start,
+            "samples": num_examples,
+            "bytes_down": sum(len(t) for t in ins.parameters.tensors),
+            "bytes_up": sum(len(t) for t in parameters.tensors)
+        })
+        return FitRes(Status(Code.OK, "Success"), parameters, num_examples, metrics)
+
+    def evaluate(self, ins, timeout=None, group_id=None):
+        return EvaluateRes(Status(Code.OK, "Success"), 0.0, 0, {})
+
+    def reconnect(self, ins, timeout=None, group_id=None):
+        return DisconnectRes("")
+
+def run_simulation(num_clients: int = 8, num_rounds: int = 3, workers: int = None, root: str = "/tmp/fl_sim",
+                   min_posts: int = 8, max_posts: int = 64, mode: str = None, codec: str = None, seed: int = 0,
+                   trace_dir: str = None, resume: bool = False):
+    """Run num_rounds of federated training over num_clients simulated clients; returns a summary.
+
+    With resume, the host and clients continue from the checkpoints of an earlier run in root.
+    """
+    import shutil
+    from mcp_host import MCPHost
+    if not resume:
+        shutil.rmtree(f"{root}/output/checkpoints", ignore_errors=True)
+    if trace_dir:
+        import tracing
+        # Spawned workers read TRACE_DIR when they import tracing
+        os.environ["TRACE_DIR"] = trace_dir
+        tracing.configure(trace_dir, service="host")
+    model_dir = make_tiny_model(f"{root}/model")
+    rng = random.Random(seed)
+    client_ids = [f"client{i}" for i in range(1, num_clients + 1)]
+    for i, cid in enumerate(client_ids):
+        # Very different data volumes per client, as in the real fleet
+        make_synthetic_data(f"{root}/data/{cid}.jsonl", rng.randint(min_posts, max_posts), seed=seed + i)
+
+    workers = workers or os.cpu_count()
+    host = MCPHost(output_dir=f"{root}/output", num_rounds=num_rounds, codec=codec, mode=mode,
+                   num_clients=num_clients)
+    stats = {"fits": []}
+    # Spawned workers do not inherit the driver's threads (the server runs fits on a thread pool)
+    pool = multiprocessing.get_context("spawn").Pool(workers, _worker_init, (root, model_dir, 1))
+    try:
+        strategy = host.build_strategy(fraction_evaluate=0.0, min_evaluate_clients=0)
+        server = host.build_server(strategy)
+        # One server thread per client; the process pool bounds how many actually train at once
+        server.set_max_workers(num_clients)
+        for cid in client_ids:
+            server.client_manager().register(PoolClientProxy(cid, pool, stats))
+        start = time.perf_counter()
+        server.fit(num_rounds=host.remaining_rounds(), timeout=None)
+        elapsed = time.perf_counter() - start
+        fits = list(stats["fits"])
+    finally:
+        host.close_checkpoints()
+        # Let fits still in flight (async mode) finish, so their server threads can exit
+        pool.close()
+        pool.join()
+
+    return {
+        "clients": num_clients,
+        "rounds": num_rounds,
+        "resumed_after": host.resume_round,
+        "workers": workers,
+        "mode": host.mode,
+        "codec": host.codec,
+        "seconds": elapsed,
+        "fits": len(fits),
+        "fits_per_sec": len(fits) / elapsed if elapsed else 0.0,
+        "samples": sum(f["samples"] for f in fits),
+        "mean_fit_seconds": sum(f["seconds"] for f in fits) / len(fits) if fits else 0.0,
+        "max_fit_seconds": max((f["seconds"] for f in fits), default=0.0),
+        "bytes_down": sum(f["bytes_down"] for f in fits),
+        "bytes_up": sum(f["bytes_up"] for f in fits)
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulate federated LLaVA training on one machine")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None, help="pool processes (default: CPU count)")
+    parser.add_argument("--root", default="/tmp/fl_sim", help="scratch directory for model, data and adapters")
+    parser.add_argument("--mode", choices=["sync", "async"], default=None)
+    parser.add_argument("--codec", default=None, help="update codec spec, e.g. int8 or fp16:0.05")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-dir", default=None, help="write spans here (summarize with Clients/tracing.py)")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoints of a previous run")
+    args = parser.parse_args()
+    print(json.dumps(run_simulation(args.clients, args.rounds, args.workers, args.root, mode=args.mode,
+                                    codec=args.codec, seed=args.seed, trace_dir=args.trace_dir,
+                                    resume=args.resume), indent=2))
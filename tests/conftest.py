@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules import each other by bare name, as in the client and host images
+sys.path[:0] = [os.path.join(ROOT, "Clients"), os.path.join(ROOT, "host"), os.path.join(ROOT, "benchmarks")]
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory):
+    """Directory of the two-layer CPU LLaVA used by the simulation and benchmarks."""
+    from synthetic import make_tiny_model
+    return make_tiny_model(str(tmp_path_factory.mktemp("tiny") / "model"))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+flwr = pytest.importorskip("flwr")
+from flwr.common import Code, FitRes, GetPropertiesRes, Status, ndarrays_to_parameters
+from flwr.server import SimpleClientManager
+from flwr.server.client_proxy import ClientProxy
+from mcp_host import MCPHost
+
+class _Proxy(ClientProxy):
+    """Client that trains instantly but reports a fixed throughput, keeping every config it receives."""
+
+    def __init__(self, cid, client_id, samples_per_sec, dataset_size=100):
+        super().__init__(cid)
+        self.client_id, self.samples_per_sec, self.dataset_size = client_id, samples_per_sec, dataset_size
+        self.configs = []
+
+    def get_properties(self, ins, timeout=None, group_id=None):
+        return GetPropertiesRes(Status(Code.OK, ""), {"client_id": self.client_id})
+
+    def fit(self, ins, timeout=None, group_id=None):
+        self.configs.append(dict(ins.config))
+        samples = ins.config.get("max_samples", self.dataset_size)
+        train_seconds = samples / self.samples_per_sec
+        metrics = {"client_id": self.client_id, "samples_per_sec": self.samples_per_sec,
+                   "train_seconds": train_seconds, "round_seconds": train_seconds + 1.0,
+                   "dataset_size": self.dataset_size}
+        return FitRes(Status(Code.OK, ""), ins.parameters, samples, metrics)
+
+    def get_parameters(self, ins, timeout=None, group_id=None):
+        raise NotImplementedError
+
+    def evaluate(self, ins, timeout=None, group_id=None):
+        raise NotImplementedError
+
+    def reconnect(self, ins, timeout=None, group_id=None):
+        raise NotImplementedError
+
+def test_async_mode_applies_scheduler_budgets(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_ROUNDS", "0")
+    monkeypatch.delenv("SCHEDULER", raising=False)
+    monkeypatch.delenv("ROUND_SECONDS", raising=False)
+    host = MCPHost(output_dir=str(tmp_path), mode="async", num_clients=2)
+    strategy = host.build_strategy(initial_parameters=ndarrays_to_parameters([np.zeros(4, np.float32)]),
+                                   fraction_evaluate=0.0, min_evaluate_clients=0)
+    manager = SimpleClientManager()
+    # Flower cids are per connection; budgets must follow the client_id each client reports
+    fast, slow = _Proxy("cid-a", "client1", samples_per_sec=10.0), _Proxy("cid-b", "client2", samples_per_sec=1.0)
+    for proxy in (fast, slow):
+        manager.register(proxy)
+
+    host.build_server(strategy, manager).fit(num_rounds=8, timeout=None)
+
+    assert set(host.scheduler.clients) == {"client1", "client2"}
+    # The first dispatch is unmeasured (full pass); later ones carry the scheduler's budget
+    assert "max_samples" not in fast.configs[0] and "max_samples" not in slow.configs[0]
+    fast_budget, slow_budget = fast.configs[-1]["max_samples"], slow.configs[-1]["max_samples"]
+    assert fast_budget > slow_budget
+    assert fast_budget / slow_budget == pytest.approx(10.0, rel=0.2)
+    assert (tmp_path / "scheduler_log.jsonl").exists()
+
+def test_async_spans_carry_the_reported_client_id(tmp_path, monkeypatch):
+    import tracing
+    monkeypatch.setenv("CHECKPOINT_ROUNDS", "0")
+    monkeypatch.setenv("SCHEDULER", "off")
+    host = MCPHost(output_dir=str(tmp_path), mode="async", num_clients=2)
+    strategy = host.build_strategy(initial_parameters=ndarrays_to_parameters([np.zeros(4, np.float32)]),
+                                   fraction_evaluate=0.0, min_evaluate_clients=0)
+    manager = SimpleClientManager()
+    for proxy in (_Proxy("cid-a", "client1", 10.0), _Proxy("cid-b", "client2", 1.0)):
+        manager.register(proxy)
+    tracing.configure(str(tmp_path / "traces"))
+    try:
+        host.build_server(strategy, manager).fit(num_rounds=4, timeout=None)
+    finally:
+        tracing.configure(None)
+    spans = [s for s in tracing.load_spans([str(tmp_path / "traces")]) if s["name"] == "host.aggregate_update"]
+    assert spans and {s["client_id"] for s in spans} == {"client1", "client2"}
@@ -0,0 +1,31 @@
+import json
+from clean_data import clean_data, clean_data_parallel
+from jsonstream import is_line_delimited, iter_records
+from synthetic import make_facebook_export
+from fetch_data import fetch_data
+
+def _fetched(tmp_path, num_posts=300):
+    return fetch_data(make_facebook_export(str(tmp_path / "raw.json"), num_posts), str(tmp_path / "fetched.json"))
+
+def _rewrite(source, path, indent=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in iter_records(source):
+            f.write(json.dumps(record, ensure_ascii=False, indent=indent) + "\n")
+    return path
+
+def test_parallel_matches_serial_on_line_delimited_input(tmp_path):
+    jsonl = _rewrite(_fetched(tmp_path), str(tmp_path / "fetched.jsonl"))
+    assert is_line_delimited(jsonl)
+    serial = clean_data(jsonl, str(tmp_path / "serial.json"))
+    parallel = clean_data_parallel(jsonl, str(tmp_path / "parallel.json"), num_workers=2, shard_bytes=4096)
+    assert list(iter_records(parallel["output_path"])) == list(iter_records(serial))
+
+def test_parallel_matches_serial_on_pretty_printed_records(tmp_path):
+    # A stream of multi-line values: JSONL to iter_records, but not splittable at newlines
+    pretty = _rewrite(_fetched(tmp_path), str(tmp_path / "fetched.jsonl"), indent=2)
+    assert not is_line_delimited(pretty)
+    serial = clean_data(pretty, str(tmp_path / "serial.json"))
+    parallel = clean_data_parallel(pretty, str(tmp_path / "parallel.json"), num_workers=2, shard_bytes=4096,
+                                   chunk_records=50)
+    assert len(list(iter_records(serial))) > 0
+    assert list(iter_records(parallel["output_path"])) == list(iter_records(serial))
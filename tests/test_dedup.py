@@ -0,0 +1,66 @@
+import json
+import os
+import dedup
+from dedup import DedupIndex, write_deduplicated
+
+TEXTS = ["summer sale on every item in the city store today only",
+         "new music release this weekend with the whole team live",
+         "family dinner photo from our travel to the coast last night",
+         "thanks everyone for coming to the launch event yesterday"]
+
+def _run(tmp_path, records, **options):
+    kept = []
+    write_deduplicated(records, lambda rows: len([kept.append(row) for row in rows]),
+                       str(tmp_path / "dedup_index.sqlite"), **options)
+    with open(tmp_path / "dedup_removed.jsonl") as f:
+        removed = [json.loads(line) for line in f]
+    return kept, removed
+
+def test_exact_and_near_duplicates_are_streamed_to_the_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "FLUSH_DOCS", 2)
+    records = [{"post_id": str(i), "text": text, "image": f"https://img/{i}.jpg"} for i, text in enumerate(TEXTS)]
+    records += [{"post_id": "10", "text": TEXTS[0].upper() + "!", "image": "https://img/10.jpg"},
+                {"post_id": "11", "text": TEXTS[1] + " now", "image": "https://img/11.jpg"},
+                # Same post twice in one export, after the first copy was flushed to the index
+                dict(records[0])]
+    kept, removed = _run(tmp_path, records)
+    assert [row["post_id"] for row in kept] == ["0", "1", "2", "3"]
+    assert [(row["post_id"], row["reason"]) for row in removed] == [("10", "exact"), ("11", "near"), ("0", "exact")]
+    report = json.load(open(tmp_path / "dedup_report.json"))
+    assert report["removed"] == 3 and not os.path.exists(tmp_path / "dedup_removed.jsonl.tmp")
+
+def test_same_image_is_a_separate_signal(tmp_path):
+    records = [{"post_id": "1", "text": TEXTS[0], "image": "https://img/a.jpg"},
+               {"post_id": "2", "text": TEXTS[1], "image": "https://img/a.jpg"},
+               {"post_id": "3", "text": TEXTS[2], "image": None},
+               {"post_id": "4", "text": TEXTS[3], "image": None}]
+    kept, _ = _run(tmp_path / "off", records, use_image=False)
+    assert len(kept) == 4
+    kept, removed = _run(tmp_path / "on", records, use_image=True, image_cache_dir=str(tmp_path / "none"))
+    assert [row["post_id"] for row in kept] == ["1", "3", "4"]
+    assert [(row["post_id"], row["reason"]) for row in removed] == [("2", "image")]
+
+def test_same_image_under_another_url_matches_by_content_hash(tmp_path):
+    from image_cache import ImageCache
+    cache = ImageCache(str(tmp_path / "image_cache"))
+    for url in ("https://a/1.jpg", "https://b/copy.jpg"):
+        with open(cache._url_path(url), 'w') as f:
+            f.write("ab" * 32)
+    records = [{"post_id": "1", "text": TEXTS[0], "image": "https://a/1.jpg"},
+               {"post_id": "2", "text": TEXTS[1], "image": "https://b/copy.jpg"}]
+    kept, removed = _run(tmp_path, records, use_image=True, image_cache_dir=cache.cache_dir)
+    assert [row["post_id"] for row in kept] == ["1"] and removed[0]["reason"] == "image"
+
+def test_rerun_keeps_what_was_kept(tmp_path):
+    records = [{"post_id": str(i), "text": text, "image": None} for i, text in enumerate(TEXTS)]
+    records.append({"post_id": "9", "text": TEXTS[2], "image": None})
+    first, _ = _run(tmp_path, records)
+    second, removed = _run(tmp_path, records)
+    assert second == first and [row["post_id"] for row in removed] == ["9"]
+
+def test_dedup_is_off_by_default(monkeypatch):
+    from client_mcp_server import dedup_index_path
+    monkeypatch.delenv("DEDUP", raising=False)
+    assert dedup_index_path() is None
+    monkeypatch.setenv("DEDUP", "1")
+    assert dedup_index_path() == os.environ.get("DEDUP_INDEX", "/data/dedup_index.sqlite")
@@ -0,0 +1,36 @@
+import numpy as np
+import generate_profile as profiling
+from profile_io import load_profile
+from synthetic import make_synthetic_data
+
+def _counting(monkeypatch):
+    """Count the posts actually embedded (not served from the cache or the resume state)."""
+    embedded = []
+    original = profiling.embed_ids
+    def embed_ids(model, tokenizer, sequences):
+        embedded.append(len(sequences))
+        return original(model, tokenizer, sequences)
+    monkeypatch.setattr(profiling, "embed_ids", embed_ids)
+    return embedded
+
+def test_second_run_embeds_nothing(tiny_model, tmp_path, monkeypatch):
+    data = make_synthetic_data(str(tmp_path / "cleaned.jsonl"), 40)
+    output_dir, cache_dir = str(tmp_path / "new" / "output"), str(tmp_path / "cache")
+    embedded = _counting(monkeypatch)
+
+    first = profiling.generate_profile(data, tiny_model, output_dir, "c", batch_size=8, cache_dir=cache_dir)
+    assert sum(embedded) == 40
+    embedded.clear()
+    second = profiling.generate_profile(data, tiny_model, output_dir, "c", batch_size=8, cache_dir=cache_dir)
+    assert embedded == []
+    np.testing.assert_allclose(load_profile(second)["mean"], load_profile(first)["mean"], rtol=1e-6)
+
+def test_max_samples_counts_new_posts_on_resume(tiny_model, tmp_path, monkeypatch):
+    data = make_synthetic_data(str(tmp_path / "cleaned.jsonl"), 40)
+    output_dir, cache_dir = str(tmp_path / "output"), str(tmp_path / "cache")
+    embedded = _counting(monkeypatch)
+
+    profiling.generate_profile(data, tiny_model, output_dir, "c", cache_dir=cache_dir, max_samples=15)
+    second = profiling.generate_profile(data, tiny_model, output_dir, "c", cache_dir=cache_dir, max_samples=15)
+    assert sum(embedded) == 30
+    assert load_profile(second)["num_samples"] == 30
@@ -0,0 +1,107 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import numpy as np
+import pytest
+import requests
+from PIL import Image
+from image_cache import ImageCache
+
+NUM_IMAGES = 12
+
+class _CountingHandler(SimpleHTTPRequestHandler):
+    """Serves files slowly enough for downloads to overlap, and records how many do."""
+
+    def __init__(self, *args, stats=None, **kwargs):
+        self.stats = stats
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        with self.stats["lock"]:
+            self.stats["requests"] += 1
+            self.stats["active"] += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+        try:
+            time.sleep(0.05)
+            super().do_GET()
+        finally:
+            with self.stats["lock"]:
+                self.stats["active"] -= 1
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def image_server(tmp_path):
+    """Local stand-in for the image host: (base URL, request stats, served bytes by file name)."""
+    root = tmp_path / "served"
+    root.mkdir()
+    rng = np.random.default_rng(0)
+    contents = {}
+    for i in range(NUM_IMAGES):
+        buffer = BytesIO()
+        Image.fromarray(rng.integers(0, 255, (48, 64, 3), dtype=np.uint8)).save(buffer, format="PNG")
+        contents[f"{i}.png"] = buffer.getvalue()
+    # The same bytes under a second name, as when a post is reshared with another URL
+    contents["copy.png"] = contents["0.png"]
+    for name, content in contents.items():
+        (root / name).write_bytes(content)
+
+    stats = {"lock": threading.Lock(), "requests": 0, "active": 0, "max_active": 0}
+    handler = functools.partial(_CountingHandler, directory=str(root), stats=stats)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", stats, contents
+    server.shutdown()
+    server.server_close()
+
+def test_prefetch_is_bounded_and_keeps_order(image_server, tmp_path):
+    base, stats, _ = image_server
+    urls = [f"{base}/{i}.png" for i in range(NUM_IMAGES)]
+    cache = ImageCache(str(tmp_path / "cache"), max_workers=3)
+    results = cache.prefetch(urls, lookahead=4)
+    first_url, first_array = next(results)
+    # Nothing beyond the lookahead window is requested before the first item is consumed
+    assert stats["requests"] <= 4
+    yielded = [first_url] + [url for url, array in results if array is not None]
+    assert yielded == urls
+    assert 1 < stats["max_active"] <= 3
+
+def test_second_run_is_served_from_cache_without_network(image_server, tmp_path, monkeypatch):
+    base, stats, _ = image_server
+    urls = [f"{base}/{i}.png" for i in range(NUM_IMAGES)]
+    assert ImageCache(str(tmp_path / "cache")).warm(urls) == NUM_IMAGES
+    requests_after_first_run = stats["requests"]
+
+    def offline(*args, **kwargs):
+        raise requests.ConnectionError("network disabled in test")
+    monkeypatch.setattr(requests.Session, "get", offline)
+    cache = ImageCache(str(tmp_path / "cache"))
+    assert cache.warm(urls) == NUM_IMAGES
+    assert all(cache.get(url) is not None for url in urls)
+    assert stats["requests"] == requests_after_first_run
+
+def test_urls_map_to_content_hashes(image_server, tmp_path):
+    base, _, contents = image_server
+    cache = ImageCache(str(tmp_path / "cache"))
+    first, copy = f"{base}/0.png", f"{base}/copy.png"
+    assert cache.lookup(first) is None
+    cache.warm([first, copy, f"{base}/1.png"])
+    expected = hashlib.sha256(contents["0.png"]).hexdigest()
+    assert cache.lookup(first) == cache.lookup(copy) == expected
+    assert cache.lookup(f"{base}/1.png") == hashlib.sha256(contents["1.png"]).hexdigest()
+    # Identical bytes behind two URLs are stored once
+    blobs = [name for _, _, files in os.walk(tmp_path / "cache" / "blobs") for name in files]
+    assert sorted(blobs) == sorted({expected, cache.lookup(f"{base}/1.png")})
+
+def test_decoded_arrays_are_224_rgb(image_server, tmp_path):
+    base, _, _ = image_server
+    cache = ImageCache(str(tmp_path / "cache"))
+    array = cache.get(f"{base}/3.png")
+    assert array.shape == (224, 224, 3) and array.dtype == np.uint8
+    assert cache.get_image(f"{base}/3.png").size == (224, 224)
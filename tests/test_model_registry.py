@@ -0,0 +1,29 @@
+import pytest
+import torch
+from safetensors.torch import save_file
+from transformers import LlavaForConditionalGeneration
+import model_registry
+
+def test_stored_dtype_is_mapped(tiny_model):
+    model = model_registry._load_mapped(tiny_model, torch.float16)
+    assert {param.dtype for param in model.parameters()} == {torch.float16}
+
+def test_other_dtype_falls_back_to_a_regular_load(tiny_model, tmp_path):
+    fp32_dir = str(tmp_path / "fp32")
+    LlavaForConditionalGeneration.from_pretrained(tiny_model, torch_dtype=torch.float32).save_pretrained(fp32_dir)
+    with pytest.warns(UserWarning, match="falling back to a regular load"):
+        assert model_registry._load_mapped(fp32_dir, torch.float16) is None
+    with pytest.warns(UserWarning, match="falling back"):
+        model = model_registry.get_base_model(fp32_dir, torch.float16, use_mmap=True)
+    assert {param.dtype for param in model.parameters()} == {torch.float16}
+
+def test_integer_tensors_are_mapped(tmp_path):
+    path = str(tmp_path / "tensors.safetensors")
+    tensors = {"position_ids": torch.arange(12, dtype=torch.int64).reshape(1, 12),
+               "mask": torch.tensor([True, False]), "empty": torch.zeros(0, dtype=torch.int32),
+               "weight": torch.randn(3, 4, dtype=torch.bfloat16)}
+    save_file(tensors, path)
+    header, data_start = model_registry._read_header(path)
+    mapped = model_registry._map_safetensors(path, header, data_start)
+    for name, tensor in tensors.items():
+        assert mapped[name].dtype == tensor.dtype and torch.equal(mapped[name], tensor)
@@ -0,0 +1,22 @@
+from pipeline_executor import PipelineExecutor
+
+def test_stages_follow_the_client_output_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("OUTPUT_DIR", raising=False)
+    output_dir = str(tmp_path / "output")
+    executor = PipelineExecutor("c", stages=["train_llava", "generate_profile"], output_dir=output_dir)
+    assert executor.state_path == f"{output_dir}/pipeline_state_c.json"
+    adapter = f"{output_dir}/lora_weights_c/adapter_model.safetensors"
+    assert executor.tools["train_llava"]["outputs"] == [adapter]
+    assert adapter in executor.tools["generate_profile"]["inputs"]
+    assert executor.tools["generate_profile"]["outputs"] == [f"{output_dir}/profile_c.npy"]
+    paths = [path for tool in executor.tools.values() for path in tool["inputs"] + tool["outputs"]]
+    assert not [path for path in paths if path.startswith("/output")]
+
+def test_dedup_report_reads_train_stats_from_output_dir(tmp_path, monkeypatch):
+    import client_mcp_server
+    calls = []
+    monkeypatch.setattr(client_mcp_server, "ingest_incremental", lambda *args, **kwargs: calls.append(kwargs))
+    output_dir = str(tmp_path / "output")
+    tools = {tool["name"]: tool for tool in client_mcp_server.client_tools("c", output_dir=output_dir)}
+    tools["ingest_incremental"]["function"]()
+    assert calls[0]["stats_path"] == f"{output_dir}/train_stats_c.json"
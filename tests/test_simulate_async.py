@@ -0,0 +1,25 @@
+import json
+from scheduler import ThroughputScheduler
+from simulate_async import make_clients, simulate_async
+
+def test_scheduler_budgets_diverge_with_stragglers(tmp_path):
+    clients = make_clients([60.0, 90.0, 600.0], seed=0)
+    log_path = tmp_path / "scheduler_log.jsonl"
+    scheduler = ThroughputScheduler(log_path=str(log_path))
+    simulate_async(clients, rounds=20, scheduler=scheduler)
+
+    assert set(scheduler.clients) == {"client0", "client1", "client2"}
+    last = {}
+    for line in log_path.read_text().splitlines():
+        entry = json.loads(line)
+        last[entry["client"]] = entry
+    # Every client was dispatched with a budget once measured...
+    assert set(last) == {"client0", "client1", "client2"}
+    # ...and the budgets follow throughput, so the straggler gets the smallest share
+    rates = {name: scheduler.clients[name]["samples_per_sec"] for name in last}
+    by_rate = sorted(last, key=rates.get)
+    assert [last[name]["budget"] for name in by_rate] == sorted(last[name]["budget"] for name in by_rate)
+    assert last["client0"]["budget"] > 2 * last["client2"]["budget"]
+    # Budgets aim every client at the same round time
+    predicted = [entry["predicted_round_s"] for entry in last.values()]
+    assert max(predicted) < 1.5 * min(predicted)
@@ -0,0 +1,43 @@
+from jsonstream import append_jsonl, iter_records
+from model_registry import get_tokenizer
+from synthetic import make_synthetic_data
+from token_shards import TokenShards, build_shards, tokenizer_fingerprint
+import generate_profile as profiling
+
+def _contents(shard_dir):
+    shards = TokenShards(shard_dir)
+    return [(shards[i].tolist(), shards.text_hash(i)) for i in range(len(shards))]
+
+def test_appended_posts_become_new_shards(tiny_model, tmp_path, capsys):
+    tokenizer = get_tokenizer(tiny_model)
+    data = make_synthetic_data(str(tmp_path / "cleaned.jsonl"), 30)
+    shard_dir = build_shards(data, tokenizer, shard_records=16)
+    first = TokenShards(shard_dir).manifest["shards"]
+
+    more = make_synthetic_data(str(tmp_path / "more.jsonl"), 20, seed=1)
+    append_jsonl(iter_records(more), data)
+    capsys.readouterr()
+    build_shards(data, tokenizer, shard_records=16)
+    assert "appended 20 posts" in capsys.readouterr().out
+    manifest = TokenShards(shard_dir).manifest
+    # Existing shards are kept as they were, new posts follow them
+    assert manifest["shards"][:len(first)] == first and manifest["records"] == 50
+    assert _contents(shard_dir) == _contents(build_shards(data, tokenizer, str(tmp_path / "full"), shard_records=16))
+
+def test_rewritten_data_rebuilds_shards(tiny_model, tmp_path, capsys):
+    tokenizer = get_tokenizer(tiny_model)
+    data = make_synthetic_data(str(tmp_path / "cleaned.jsonl"), 30)
+    shard_dir = build_shards(data, tokenizer)
+    make_synthetic_data(data, 40, seed=2)
+    capsys.readouterr()
+    build_shards(data, tokenizer)
+    assert "appended" not in capsys.readouterr().out
+    assert len(TokenShards(shard_dir)) == 40
+
+def test_profile_padding_keeps_the_shared_tokenizer(tiny_model, tmp_path, monkeypatch):
+    tokenizer = get_tokenizer(tiny_model)
+    monkeypatch.setattr(tokenizer, "pad_token", None)
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    data = make_synthetic_data(str(tmp_path / "cleaned.jsonl"), 20)
+    profiling.generate_profile(data, tiny_model, str(tmp_path / "output"), "c", cache_dir=None)
+    assert tokenizer.pad_token is None and tokenizer_fingerprint(tokenizer) == fingerprint
@@ -0,0 +1,48 @@
+import sys
+import types
+import tracing
+
+class _FakeCuda:
+    """Process-wide allocation counters, like torch.cuda's."""
+
+    def __init__(self):
+        self.allocated, self.peak, self.resets = 0, 0, 0
+
+    def is_available(self):
+        return True
+
+    def allocate(self, mb):
+        self.allocated += mb * 2**20
+        self.peak = max(self.peak, self.allocated)
+
+    def free(self, mb):
+        self.allocated -= mb * 2**20
+
+    def memory_allocated(self):
+        return self.allocated
+
+    def max_memory_allocated(self):
+        return self.peak
+
+    def reset_peak_memory_stats(self):
+        self.resets += 1
+        self.peak = self.allocated
+
+def test_nested_spans_do_not_reset_the_gpu_peak(tmp_path, monkeypatch):
+    cuda = _FakeCuda()
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(cuda=cuda))
+    tracing.configure(str(tmp_path))
+    try:
+        with tracing.span("outer"):
+            with tracing.span("inner"):
+                cuda.allocate(100)
+                cuda.free(100)
+            # A span started later in the outer one must not hide the inner peak
+            with tracing.span("later"):
+                cuda.allocate(10)
+    finally:
+        tracing.configure(None)
+    spans = {s["name"]: s for s in tracing.load_spans([str(tmp_path)])}
+    assert cuda.resets == 0
+    assert spans["outer"]["peak_gpu_mb"] == spans["inner"]["peak_gpu_mb"] == 100
+    assert spans["later"]["gpu_start_mb"] == 0 and spans["later"]["gpu_end_mb"] == 10
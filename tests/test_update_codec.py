@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+from update_codec import UpdateCodec, UpdateEncoder, decode
+
+SHAPES = [(8, 4096), (4096, 8)] * 4
+
+# Max |codec average - dense average| over one round. Dense codecs only round; top-k codecs defer
+# the unsent part of each update to later rounds, so a round's aggregate differs by up to the
+# residual still owed
+AGGREGATE_TOLERANCE = {"fp16": 1e-4, "int8": 1e-4, "int8:0.1": 5e-3, "fp16:0.01": 5e-3}
+
+def _simulate(spec: str, clients: int = 4, rounds: int = 5, seed: int = 0):
+    """FedAvg rounds through the codec and densely; returns (max aggregate error, feedback drift)."""
+    rng = np.random.default_rng(seed)
+    reference = [rng.normal(0, 0.02, s).astype(np.float32) for s in SHAPES]
+    encoders = [UpdateEncoder(UpdateCodec.from_spec(spec)) for _ in range(clients)]
+    sent_total = [np.zeros(s, dtype=np.float32) for s in SHAPES]
+    true_total = [np.zeros(s, dtype=np.float32) for s in SHAPES]
+    error = 0.0
+    for _ in range(rounds):
+        dense, decoded = [], []
+        for encoder in encoders:
+            weights = [r + rng.normal(0, 1e-3, r.shape).astype(np.float32) for r in reference]
+            payload, _ = encoder.encode(weights, reference)
+            decoded.append(decode(payload, reference))
+            dense.append(weights)
+        dense_avg = [np.mean([c[i] for c in dense], axis=0) for i in range(len(SHAPES))]
+        codec_avg = [np.mean([c[i] for c in decoded], axis=0) for i in range(len(SHAPES))]
+        error = max(error, max(float(np.max(np.abs(c - d))) for c, d in zip(codec_avg, dense_avg)))
+        for i in range(len(SHAPES)):
+            true_total[i] += dense_avg[i] - reference[i]
+            sent_total[i] += codec_avg[i] - reference[i]
+    # Error feedback: what was sent plus what is still owed equals the true cumulative update
+    owed = [np.mean([e.residual[i] for e in encoders], axis=0) for i in range(len(SHAPES))]
+    drift = max(float(np.max(np.abs(s + o - t))) for s, o, t in zip(sent_total, owed, true_total))
+    return error, drift
+
+@pytest.mark.parametrize("spec", sorted(AGGREGATE_TOLERANCE))
+def test_aggregate_stays_close_to_dense_path(spec):
+    error, drift = _simulate(spec)
+    assert error < AGGREGATE_TOLERANCE[spec], f"{spec}: aggregate error {error}"
+    assert drift < 1e-4, f"{spec}: error feedback drift {drift}"
+
+def test_uncompressed_codec_is_exact():
+    error, drift = _simulate("none")
+    assert error < 1e-6 and drift < 1e-6
+
+def _training_client(client_id, model_dir, output_dir, seed):
+    """LLaVAClient whose workflow adds a random step to the adapter instead of training."""
+    import json
+    from flower_client import LLaVAClient
+    from lora_adapter import get_lora_arrays, set_lora_arrays
+    rng = np.random.default_rng(seed)
+
+    class Client(LLaVAClient):
+        def run_workflow(self, max_samples=None):
+            self.trained = [w + rng.normal(0, 1e-2, w.shape).astype(w.dtype) for w in get_lora_arrays(self.model)]
+            set_lora_arrays(self.model, self.trained)
+            self.model.save_pretrained(self.adapter_dir)
+            with open(f"{self.output_dir}/train_stats_{self.client_id}.json", 'w') as f:
+                json.dump({"samples": 10, "samples_per_sec": 5.0, "tokens_per_sec": 50.0, "seconds": 2.0}, f)
+            return self.adapter_dir
+
+    return Client(client_id, model_dir, output_dir)
+
+@pytest.mark.parametrize("spec", ["fp16", "int8", "int8:0.1"])
+def test_round_trip_through_client_encoder_and_strategy(spec, tiny_model, tmp_path, monkeypatch):
+    pytest.importorskip("flwr")
+    from flwr.common import (Code, FitRes, GetPropertiesRes, Status, ndarrays_to_parameters,
+                             parameters_to_ndarrays)
+    from flwr.server import SimpleClientManager
+    from flwr.server.client_proxy import ClientProxy
+    from lora_adapter import get_lora_arrays
+    from mcp_host import MCPHost
+    monkeypatch.setenv("CHECKPOINT_ROUNDS", "0")
+
+    class Proxy(ClientProxy):
+        def __init__(self, client):
+            super().__init__(client.client_id)
+            self.client, self.rounds = client, []
+
+        def get_properties(self, ins, timeout=None, group_id=None):
+            return GetPropertiesRes(Status(Code.OK, ""), self.client.get_properties({}))
+
+        def fit(self, ins, timeout=None, group_id=None):
+            received = parameters_to_ndarrays(ins.parameters)
+            payload, num_examples, metrics = self.client.fit(received, ins.config)
+            self.rounds.append((received, payload, self.client.trained))
+            return FitRes(Status(Code.OK, ""), ndarrays_to_parameters(payload), num_examples, metrics)
+
+        def get_parameters(self, ins, timeout=None, group_id=None):
+            raise NotImplementedError
+
+        def evaluate(self, ins, timeout=None, group_id=None):
+            raise NotImplementedError
+
+        def reconnect(self, ins, timeout=None, group_id=None):
+            raise NotImplementedError
+
+    proxies = [Proxy(_training_client(f"client{i}", tiny_model, str(tmp_path), seed=i)) for i in range(2)]
+    manager = SimpleClientManager()
+    for proxy in proxies:
+        manager.register(proxy)
+    host = MCPHost(output_dir=str(tmp_path), codec=spec, num_clients=2)
+    strategy = host.build_strategy(fraction_evaluate=0.0, min_evaluate_clients=0)
+    parameters = ndarrays_to_parameters([w.astype(np.float32) for w in get_lora_arrays(proxies[0].client.model)])
+
+    for server_round in range(1, 4):
+        instructions = strategy.configure_fit(server_round, parameters, manager)
+        assert all(ins.config["codec"] == spec for _, ins in instructions)
+        results = [(proxy, proxy.fit(ins)) for proxy, ins in instructions]
+        parameters, _ = strategy.aggregate_fit(server_round, results, [])
+        aggregate = parameters_to_ndarrays(parameters)
+        # The server decodes exactly what the clients meant to send...
+        sent = [decode(proxy.rounds[-1][1], proxy.rounds[-1][0]) for proxy in proxies]
+        for i, tensor in enumerate(aggregate):
+            np.testing.assert_allclose(tensor, np.mean([weights[i] for weights in sent], axis=0), atol=1e-6)
+        # ...which, for dense codecs, is the trained adapters up to quantization
+        if ":" not in spec:
+            dense = [np.mean([np.asarray(proxy.rounds[-1][2][i], dtype=np.float32) for proxy in proxies], axis=0)
+                     for i in range(len(aggregate))]
+            assert max(float(np.max(np.abs(a - d))) for a, d in zip(aggregate, dense)) < AGGREGATE_TOLERANCE[spec] * 10
+
+    # Error feedback: over all rounds, what each client sent plus its residual is its full update
+    for proxy in proxies:
+        residual = proxy.client.encoder.residual
+        for i in range(len(residual)):
+            true = sum(np.asarray(trained[i], dtype=np.float32) - received[i] for received, _, trained in proxy.rounds)
+            sent = sum(decode(payload, received)[i] - received[i] for received, payload, _ in proxy.rounds)
+            np.testing.assert_allclose(sent + residual[i], true, atol=1e-5)
+        if ":" in spec:
+            assert max(float(np.max(np.abs(r))) for r in residual) > 0